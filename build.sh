@@ -10,4 +10,7 @@ python manage.py collectstatic --noinput
 # Aplica as migrações no banco de dados novo
 python manage.py migrate
 
+# Tabela do cache compartilhado (CACHES no settings); não faz nada se já existir
+python manage.py createcachetable
+
 python manage.py createsuperuser --noinput || true
\ No newline at end of file
@@ -61,6 +61,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core_rh.middleware.PapeisUsuarioMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     #'core_rh.middleware.TrocaSenhaObrigatoriaMiddleware',
@@ -272,4 +273,43 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 CSRF_TRUSTED_ORIGINS = ['https://portalrh.dividata360.com.br']
 X_FRAME_OPTIONS = 'SAMEORIGIN'
-SECURE_CROSS_ORIGIN_OPENER_POLICY = None
\ No newline at end of file
+SECURE_CROSS_ORIGIN_OPENER_POLICY = None
+
+# --- MÍDIA EM OBJECT STORAGE (OPCIONAL) ---
+# Com MEDIA_S3_BUCKET definido os anexos vão para um bucket compatível com S3
+# (AWS, MinIO local etc.) e todos os nós do gunicorn enxergam os mesmos arquivos.
+# Sem a variável, continua o disco local em MEDIA_ROOT.
+MEDIA_S3_BUCKET = config('MEDIA_S3_BUCKET', default='')
+if MEDIA_S3_BUCKET:
+    STORAGES = {
+        'default': {
+            'BACKEND': 'storages.backends.s3.S3Storage',
+            'OPTIONS': {
+                'bucket_name': MEDIA_S3_BUCKET,
+                'endpoint_url': config('MEDIA_S3_ENDPOINT_URL', default=None),
+                'region_name': config('MEDIA_S3_REGION', default=None),
+                'access_key': config('MEDIA_S3_ACCESS_KEY', default=None),
+                'secret_key': config('MEDIA_S3_SECRET_KEY', default=None),
+                'location': config('MEDIA_S3_PREFIXO', default='media'),
+                'default_acl': None,
+                'file_overwrite': False,
+                'querystring_auth': True,
+            },
+        },
+        'staticfiles': {
+            'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+        },
+    }
+
+# --- CACHE COMPARTILHADO ENTRE OS WORKERS ---
+# Versão dos papéis dos usuários e marcas de PDFs em renderização precisam ser
+# vistas por todos os processos do gunicorn: o LocMemCache padrão é por
+# processo. A tabela é criada no build (`manage.py createcachetable`).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'core_rh_cache',
+        # Uma versão de papéis por usuário: o padrão (300 entradas) descartaria cedo demais
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
@@ -1,5 +1,4 @@
 import json
-import io
 from django.contrib import admin
 from django.contrib.auth.models import User, Group
 from django.utils.html import format_html
@@ -8,45 +7,22 @@ from django import forms
 from django.urls import reverse, path
 from django.shortcuts import redirect, render
 from django.contrib import messages
-from django.core.files.base import ContentFile
-import pdfplumber
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
 
 
 from .models import (
-    Funcionario, RegistroPonto, Cargo, Equipe, 
-    Ferias, Contracheque, Atestado, ControleKM, TrechoKM, DespesaDiversa
+    Funcionario, RegistroPonto, FolhaPontoStatus, Cargo, Equipe, 
+    Ferias, Contracheque, ProcessamentoContracheque, Atestado, ControleKM, TrechoKM, DespesaDiversa
 )
 from .forms import UploadLoteContrachequeForm
-
-try:
-    from pypdf import PdfReader, PdfWriter
-except ImportError:
-    PdfReader = None
-    PdfWriter = None
+from .papeis import papeis_do_usuario
+from .contracheque_service import criar_processamento, reprocessar_carimbos, url_processamento_contracheque
 
 # --- PERMISSÕES PERSONALIZADAS (RH) ---
 
 def is_rh_member(user):
-    # Retorna True se o usuário é Superuser ou membro da Equipe RH
+    # Retorna True se o usuário é Superuser ou membro da Equipe RH (papéis memorizados por request/sessão)
     if not user or not user.is_authenticated: return False
-    if user.is_superuser: return True
-    
-    if user.groups.filter(name='RH').exists(): return True
-
-    try:
-        if hasattr(user, 'funcionario'):
-            func = user.funcionario
-            rh_names = ['RH', 'Recursos Humanos', 'Gestão de Pessoas']
-            
-            if func.equipe and func.equipe.nome in rh_names: return True
-            
-            if func.outras_equipes.filter(nome__in=rh_names).exists(): return True
-    except Exception:
-        pass
-        
-    return False
+    return papeis_do_usuario(user)['rh']
 
 class RHAccessMixin:
     def has_module_permission(self, request):
@@ -230,6 +206,13 @@ class RegistroPontoAdmin(RHAccessMixin, admin.ModelAdmin):
     botao_pdf.short_description = "Folha do Mês"
     botao_pdf.allow_tags = True
 
+@admin.register(FolhaPontoStatus)
+class FolhaPontoStatusAdmin(RHAccessMixin, admin.ModelAdmin):
+    list_display = ('funcionario', 'mes', 'ano', 'assinado_funcionario', 'assinado_gestor', 'atualizado_em')
+    list_filter = ('ano', 'mes', 'assinado_funcionario', 'assinado_gestor', 'funcionario__equipe')
+    search_fields = ('funcionario__nome_completo',)
+    readonly_fields = ('data_assinatura_funcionario', 'data_assinatura_gestor', 'atualizado_em')
+
 
 @admin.register(Ferias)
 class FeriasAdmin(RHAccessMixin, admin.ModelAdmin):
@@ -336,16 +319,32 @@ class FeriasAdmin(RHAccessMixin, admin.ModelAdmin):
 @admin.register(Contracheque)
 class ContrachequeAdmin(RHAccessMixin, admin.ModelAdmin):
     list_display = ('funcionario', 'referencia', 'status_envio', 'status_assinatura', 'data_ciencia', 'link_arquivo')
-    list_filter = ('ano', 'mes', 'data_ciencia')
+    list_filter = ('ano', 'mes', 'data_ciencia', 'status_carimbo')
     search_fields = ('funcionario__nome_completo', 'funcionario__matricula')
+    actions = ['reprocessar_pdf_assinado']
     
     def referencia(self, obj): return f"{obj.get_mes_display()}/{obj.ano}"
     def status_envio(self, obj): return mark_safe('<span style="color: green;"><i class="fas fa-check-circle"></i> Enviado</span>')
     def status_assinatura(self, obj):
+        if obj.data_ciencia and obj.status_carimbo == 'Falhou':
+            return format_html('<span style="color: red; font-weight: bold;" title="{}"><i class="fas fa-exclamation-triangle"></i> Assinado (PDF falhou)</span>', obj.erro_carimbo)
         return mark_safe('<span style="color: green; font-weight: bold;"><i class="fas fa-file-signature"></i> Assinado</span>') if obj.data_ciencia else mark_safe('<span style="color: orange;"><i class="fas fa-clock"></i> Pendente</span>')
+
+    @admin.action(description="Gerar novamente o PDF assinado (falhas)")
+    def reprocessar_pdf_assinado(self, request, queryset):
+        total = reprocessar_carimbos(queryset)
+        self.message_user(request, f"{total} contracheque(s) voltaram para a fila.", level=messages.SUCCESS)
+
     def link_arquivo(self, obj):
         return format_html('<a href="{}" target="_blank" class="button" style="padding:5px 10px;">Ver PDF</a>', obj.arquivo.url) if obj.arquivo else "-"
 
+    def save_model(self, request, obj, form, change):
+        # Arquivo trocado à mão: as âncoras antigas não valem mais (a assinatura recalcula)
+        if 'arquivo' in form.changed_data:
+            obj.layout_pdf = None
+            obj.hash_conteudo = ''
+        super().save_model(request, obj, form, change)
+
     def get_urls(self):
         urls = super().get_urls()
         my_urls = [path('importar-lote/', self.admin_site.admin_view(self.importar_lote_view), name='importar_contracheques')]
@@ -360,8 +359,11 @@ class ContrachequeAdmin(RHAccessMixin, admin.ModelAdmin):
                 ano = int(form.cleaned_data['ano'])
                 data_recebimento = form.cleaned_data['data_recebimento']
                 try:
-                    self.processar_pdf(arquivo_geral, mes, ano, data_recebimento, request)
-                    return redirect('admin:core_rh_contracheque_changelist')
+                    # Divisão em segundo plano; a página de acompanhamento mostra o progresso
+                    processamento = criar_processamento(arquivo_geral, mes, ano, data_recebimento, 'admin', request.user)
+                    return redirect(url_processamento_contracheque(
+                        processamento, reverse('admin:core_rh_contracheque_changelist')
+                    ))
                 except Exception as e:
                     messages.error(request, f"Erro ao processar PDF: {str(e)}")
         else:
@@ -369,97 +371,17 @@ class ContrachequeAdmin(RHAccessMixin, admin.ModelAdmin):
 
         return render(request, 'admin/importar_contracheques.html', {'form': form, 'title': 'Importar Contracheques', 'site_header': self.admin_site.site_header})
 
-    def processar_pdf(self, arquivo, mes, ano, data_recebimento, request):
-        if not PdfReader: raise ImportError("Instale pypdf")
-        if not canvas: raise ImportError("Instale reportlab")
-        
-        arquivo.seek(0)
-        plumber_pdf = pdfplumber.open(arquivo)
-        
-        arquivo.seek(0)
-        reader = PdfReader(arquivo)
-        
-        funcionarios = Funcionario.objects.all()
-        count_sucesso = 0
-        nao_encontrados = []
-        logs_detalhados = []
-
-        for page_num, page in enumerate(reader.pages):
-            texto_pagina = page.extract_text() or ""
-            texto_pagina_upper = texto_pagina.upper()
-            
-            funcionario_encontrado = None
-            for func in funcionarios:
-                nome_upper = func.nome_completo.upper().strip()
-                if nome_upper and nome_upper in texto_pagina_upper:
-                    funcionario_encontrado = func
-                    break
-            
-            if funcionario_encontrado:
-                writer = PdfWriter()
-                
-                if data_recebimento:
-                    pos_x = 130
-                    pos_y = 55
-                    try:
-                        p_page = plumber_pdf.pages[page_num]
-                        palavras = p_page.search("DATA DO RECEBIMENTO") or \
-                                   p_page.search("DATA RECEBIMENTO") or \
-                                   p_page.search("RECEBIMENTO")
-                        
-                        if palavras:
-                            target = palavras[0]
-                            altura_pagina = float(page.mediabox.height)
-                            pos_x = target['x0'] + 15
-                            pos_y = altura_pagina - target['top'] + 12
-                    except Exception as e:
-                        logs_detalhados.append(f"Pág {page_num+1}: Erro cálculo pos ({e})")
-
-                    try:
-                        packet = io.BytesIO()
-                        can = canvas.Canvas(packet, pagesize=A4)
-                        can.setFont("Helvetica", 10)
-                        data_str = data_recebimento.strftime("%d/%m/%Y")
-                        can.drawString(pos_x, pos_y, data_str)
-                        can.setFillColorRGB(1, 0, 0) 
-                        can.circle(pos_x, pos_y, 2, fill=1) 
-                        can.save()
-
-                        packet.seek(0)
-                        overlay_pdf = PdfReader(packet)
-                        page.merge_page(overlay_pdf.pages[0])
-                    except: pass
-
-                writer.add_page(page)
-                
-                pdf_bytes = io.BytesIO()
-                writer.write(pdf_bytes)
-                pdf_content = ContentFile(pdf_bytes.getvalue())
-                
-                defaults = {'arquivo': None}
-                if data_recebimento: defaults['data_ciencia'] = data_recebimento
-
-                cc, created = Contracheque.objects.update_or_create(
-                    funcionario=funcionario_encontrado, mes=mes, ano=ano,
-                    defaults=defaults
-                )
-                if not created and data_recebimento:
-                    cc.data_ciencia = data_recebimento
-                    cc.save()
-
-                cc.arquivo.save(f"holerite_{funcionario_encontrado.id}.pdf", pdf_content)
-                count_sucesso += 1
-            else:
-                nao_encontrados.append(f"Pág {page_num + 1}")
-        
-        plumber_pdf.close()
-        
-        messages.success(request, f"{count_sucesso} processados.")
-        if logs_detalhados:
-            msg_log = " | ".join(logs_detalhados[:3])
-            messages.warning(request, f"Atenção nas datas: {msg_log}")
-        if nao_encontrados: 
-            messages.warning(request, f"Páginas ignoradas (sem nome): {', '.join(nao_encontrados)}")
+@admin.register(ProcessamentoContracheque)
+class ProcessamentoContrachequeAdmin(RHAccessMixin, admin.ModelAdmin):
+    list_display = ('__str__', 'origem', 'progresso', 'criado_por', 'criado_em', 'link_acompanhamento')
+    list_filter = ('status', 'origem', 'ano', 'mes')
+    readonly_fields = ('status', 'total_paginas', 'paginas_processadas', 'faixas_concluidas', 'mensagem_erro', 'concluido_em')
+    exclude = ('resultado',)
+
+    def progresso(self, obj): return f"{obj.paginas_processadas}/{obj.total_paginas} ({obj.percentual}%)"
+    def link_acompanhamento(self, obj):
+        url = url_processamento_contracheque(obj, reverse('admin:core_rh_processamentocontracheque_changelist'))
+        return format_html('<a href="{}" class="button" style="padding:5px 10px;">Acompanhar</a>', url)
 
 # --- NOVOS REGISTROS (Atestados e KM) ---
 
@@ -483,3 +405,10 @@ class DespesaDiversaAdmin(admin.ModelAdmin):
     list_display = ('funcionario', 'data', 'tipo', 'valor', 'status')
     list_filter = ('status', 'tipo', 'data')
     search_fields = ('funcionario__nome_completo', 'numero_chamado')
+
+    def save_model(self, request, obj, form, change):
+        if 'comprovante' in form.changed_data:
+            # Comprovante trocado: a miniatura é refeita pelo signal
+            obj.miniatura = ''
+            obj.hash_comprovante = ''
+        super().save_model(request, obj, form, change)
@@ -0,0 +1,169 @@
+import io
+import os
+import re
+from functools import partial
+
+from django.core.files.storage import default_storage
+
+# ==========================================
+# ACESSO A ANEXOS (COMPROVANTES, CONTRACHEQUES, FOLHAS ASSINADAS)
+# ==========================================
+# Tudo passa pela API de storage do Django: nada de FieldFile.path, MEDIA_ROOT
+# ou os.path.exists. Assim a mídia pode ficar no disco local ou num bucket
+# compatível com S3 (ver MEDIA_S3_BUCKET no settings) sem mudar as views.
+
+TAMANHO_BLOCO = 64 * 1024
+
+# Cabeçalho Range de uma faixa só: bytes=inicio-fim, bytes=inicio- ou bytes=-sufixo
+_REGEX_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _nome_e_storage(arquivo):
+    """Aceita um FieldFile ou o nome do arquivo no storage padrão."""
+    if hasattr(arquivo, 'storage') and hasattr(arquivo, 'name'):
+        return arquivo.name, arquivo.storage
+    return arquivo, default_storage
+
+
+def _objeto_s3(storage, nome):
+    """Objeto do bucket quando o storage é o S3Storage do django-storages; senão None."""
+    bucket = getattr(storage, 'bucket', None)
+    normalizar = getattr(storage, '_normalize_name', None)
+    if bucket is None or normalizar is None:
+        return None
+    return bucket.Object(normalizar(nome.replace('\\', '/')))
+
+
+def existe(arquivo):
+    nome, storage = _nome_e_storage(arquivo)
+    if not nome:
+        return False
+    try:
+        return storage.exists(nome)
+    except Exception as e:
+        print(f"Erro ao consultar arquivo {nome} no storage: {e}")
+        return False
+
+
+def tamanho(arquivo):
+    nome, storage = _nome_e_storage(arquivo)
+    return storage.size(nome)
+
+
+def extensao(arquivo):
+    nome, _ = _nome_e_storage(arquivo)
+    return os.path.splitext(nome or '')[1].lstrip('.').lower()
+
+
+def abrir(arquivo):
+    """Arquivo binário aberto, para ser usado com `with`."""
+    nome, storage = _nome_e_storage(arquivo)
+    return storage.open(nome, 'rb')
+
+
+def abridor(arquivo):
+    """Função sem argumentos que abre o arquivo (formato esperado por gerar_zip_streaming)."""
+    return partial(abrir_em_blocos, arquivo)
+
+
+class _LeitorBlocos(io.RawIOBase):
+    """Arquivo só de leitura sobre um gerador de blocos (ver ler_blocos)."""
+
+    def __init__(self, blocos):
+        super().__init__()
+        self._blocos = blocos
+        # O primeiro bloco é lido já na abertura: arquivo inexistente falha aqui, não no meio da leitura
+        self._resto = next(blocos, b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        while not self._resto:
+            self._resto = next(self._blocos, b'')
+            if not self._resto:
+                return 0
+        n = min(len(destino), len(self._resto))
+        destino[:n] = self._resto[:n]
+        self._resto = self._resto[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._blocos.close()
+        super().close()
+
+
+def abrir_em_blocos(arquivo, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Como abrir(), mas lendo sob demanda: no S3 não baixa o objeto inteiro antes
+    do primeiro read() (o storage.open do django-storages baixa).
+    """
+    return _LeitorBlocos(ler_blocos(arquivo, tamanho_bloco))
+
+
+def ler_bytes(arquivo):
+    with abrir(arquivo) as f:
+        return f.read()
+
+
+def ler_blocos(arquivo, tamanho_bloco=TAMANHO_BLOCO):
+    """Gera o conteúdo em blocos, sem carregar o arquivo inteiro na memória."""
+    nome, storage = _nome_e_storage(arquivo)
+
+    objeto = _objeto_s3(storage, nome)
+    if objeto is not None:
+        # O S3File baixa o objeto inteiro para um temporário; o corpo da resposta vem em stream
+        corpo = objeto.get()['Body']
+        try:
+            yield from corpo.iter_chunks(tamanho_bloco)
+        finally:
+            corpo.close()
+        return
+
+    with storage.open(nome, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            yield bloco
+
+
+def ler_intervalo(arquivo, inicio, fim=None):
+    """
+    Bytes de [inicio, fim) — fim None lê até o final.
+    No S3 vira um GET com cabeçalho Range; no disco, seek + read.
+    """
+    if fim is not None and fim <= inicio:
+        return b''
+    nome, storage = _nome_e_storage(arquivo)
+
+    objeto = _objeto_s3(storage, nome)
+    if objeto is not None:
+        faixa = f"bytes={inicio}-{fim - 1}" if fim is not None else f"bytes={inicio}-"
+        corpo = objeto.get(Range=faixa)['Body']
+        try:
+            return corpo.read()
+        finally:
+            corpo.close()
+
+    with storage.open(nome, 'rb') as f:
+        f.seek(inicio)
+        return f.read() if fim is None else f.read(fim - inicio)
+
+
+def faixa_solicitada(cabecalho, total):
+    """
+    (inicio, fim) pedido num cabeçalho HTTP Range, já limitado ao tamanho do
+    arquivo; None sem cabeçalho (ou num formato que não tratamos: vai o arquivo
+    inteiro). Faixa fora do arquivo levanta ValueError (resposta 416).
+    """
+    match = _REGEX_RANGE.match((cabecalho or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    inicio, fim = match.groups()
+    if not inicio:
+        # bytes=-500: os últimos 500 bytes
+        return max(total - int(fim), 0), total
+    inicio = int(inicio)
+    fim = min(int(fim) + 1, total) if fim else total
+    if inicio >= total or fim <= inicio:
+        raise ValueError(f"Faixa fora do arquivo ({cabecalho}, {total} bytes)")
+    return inicio, fim
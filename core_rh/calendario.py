@@ -0,0 +1,160 @@
+from datetime import date, timedelta
+from functools import lru_cache
+
+import holidays
+
+from .models import Atestado, Ferias
+
+ESTADO_FERIADOS_PADRAO = 'DF'
+
+DIAS_SEMANA_PT = {
+    0: 'Segunda-feira', 1: 'Terça-feira', 2: 'Quarta-feira', 3: 'Quinta-feira',
+    4: 'Sexta-feira', 5: 'Sábado', 6: 'Domingo'
+}
+
+
+def get_datas_competencia(mes_referencia, ano_referencia):
+    if mes_referencia == 1:
+        mes_anterior = 12
+        ano_anterior = ano_referencia - 1
+    else:
+        mes_anterior = mes_referencia - 1
+        ano_anterior = ano_referencia
+        
+    data_inicio = date(ano_anterior, mes_anterior, 16)
+    data_fim = date(ano_referencia, mes_referencia, 15)
+
+    return data_inicio, data_fim
+
+
+@lru_cache(maxsize=128)
+def tabela_feriados(estado, ano):
+    """
+    Tabela {data: nome} de feriados de um estado/ano.
+    Fica em cache no processo: o holidays.BR só é montado uma vez por (estado, ano).
+    """
+    try:
+        calendario = holidays.BR(state=estado, years=ano)
+    except NotImplementedError:
+        calendario = holidays.BR(state=ESTADO_FERIADOS_PADRAO, years=ano)
+    return dict(calendario)
+
+
+def estado_do_funcionario(funcionario):
+    return getattr(funcionario, 'estado_sigla', None) or ESTADO_FERIADOS_PADRAO
+
+
+def feriados_periodo(funcionario, data_inicio, data_fim):
+    """Feriados {data: nome} que caem entre data_inicio e data_fim (a competência cruza anos em janeiro)."""
+    estado = estado_do_funcionario(funcionario)
+    feriados = {}
+    for ano in range(data_inicio.year, data_fim.year + 1):
+        for data, nome in tabela_feriados(estado, ano).items():
+            if data_inicio <= data <= data_fim:
+                feriados[data] = nome
+    return feriados
+
+
+def _varrer_intervalos(total_dias, intervalos):
+    """
+    Marca os dias cobertos por uma lista de intervalos (índice inicial, índice final)
+    com um vetor de diferenças: O(dias + intervalos).
+    """
+    diferenca = [0] * (total_dias + 1)
+    for inicio, fim in intervalos:
+        inicio = max(inicio, 0)
+        fim = min(fim, total_dias - 1)
+        if inicio > fim:
+            continue
+        diferenca[inicio] += 1
+        diferenca[fim + 1] -= 1
+
+    cobertos = []
+    acumulado = 0
+    for i in range(total_dias):
+        acumulado += diferenca[i]
+        cobertos.append(acumulado > 0)
+    return cobertos
+
+
+def obs_automatica(eh_ferias, eh_feriado, tipo_atestado):
+    """Observação padrão do dia quando o colaborador não escreveu nada."""
+    if eh_ferias:
+        return "Férias"
+    if eh_feriado:
+        return "FERIADO"
+    if tipo_atestado == 'DIAS':
+        return "Atestado Médico"
+    if tipo_atestado == 'HORAS':
+        return "Atestado de Comparecimento"
+    return ""
+
+
+def montar_dias_competencia(funcionario, data_inicio, data_fim, registros=None, com_afastamentos=True):
+    """
+    Monta a grade de dias da competência (16 -> 15) de um funcionário.
+
+    Cada dia traz feriado, férias, atestado, a observação automática e o
+    RegistroPonto do dia (se informado em `registros`, um dict {data: registro}).
+    Férias e atestados aprovados são aplicados por varredura de intervalos.
+    """
+    registros = registros or {}
+    total_dias = (data_fim - data_inicio).days + 1
+    feriados = feriados_periodo(funcionario, data_inicio, data_fim)
+
+    dias_ferias = [False] * total_dias
+    dias_atestado = [False] * total_dias
+    dias_comparecimento = [False] * total_dias
+
+    if funcionario and com_afastamentos:
+        ferias_periodo = Ferias.objects.filter(
+            funcionario=funcionario,
+            data_inicio__lte=data_fim,
+            data_fim__gte=data_inicio
+        ).values_list('data_inicio', 'data_fim')
+
+        dias_ferias = _varrer_intervalos(total_dias, [
+            ((ini - data_inicio).days, (fim - data_inicio).days) for ini, fim in ferias_periodo
+        ])
+
+        atestados_periodo = Atestado.objects.filter(
+            funcionario=funcionario,
+            status='Aprovado',
+            data_inicio__lte=data_fim
+        ).values_list('tipo', 'data_inicio', 'qtd_dias')
+
+        intervalos_atestado = []
+        for tipo, ini, qtd_dias in atestados_periodo:
+            idx = (ini - data_inicio).days
+            if tipo == 'DIAS':
+                intervalos_atestado.append((idx, idx + (qtd_dias or 1) - 1))
+            elif tipo == 'HORAS' and 0 <= idx < total_dias:
+                dias_comparecimento[idx] = True
+
+        dias_atestado = _varrer_intervalos(total_dias, intervalos_atestado)
+
+    dias = []
+    for i in range(total_dias):
+        data_atual = data_inicio + timedelta(days=i)
+        nome_feriado = feriados.get(data_atual, "")
+
+        # Atestado em dias prevalece sobre declaração de comparecimento
+        tipo_atestado = None
+        if dias_atestado[i]:
+            tipo_atestado = 'DIAS'
+        elif dias_comparecimento[i]:
+            tipo_atestado = 'HORAS'
+
+        dias.append({
+            'data': data_atual,
+            'dia_semana_nome': DIAS_SEMANA_PT[data_atual.weekday()],
+            'eh_fim_de_semana': data_atual.weekday() >= 5,
+            'eh_feriado': bool(nome_feriado),
+            'nome_feriado': nome_feriado.upper(),
+            'eh_ferias': dias_ferias[i],
+            'tipo_atestado': tipo_atestado,
+            'obs_automatica': obs_automatica(dias_ferias[i], bool(nome_feriado), tipo_atestado),
+            'registro': registros.get(data_atual),
+        })
+
+    return dias
@@ -0,0 +1,146 @@
+import io
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, ContentStream, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+# ==========================================
+# GRAVAÇÃO COMPACTA DOS PDFs DE CONTRACHEQUE
+# ==========================================
+# A página copiada da folha de pagamento leva junto o dicionário de recursos
+# da folha inteira (todas as fontes e imagens), mesmo usando só uma parte.
+# Aqui cada PDF é gravado só com os recursos que o conteúdo da página usa,
+# objetos repetidos viram um só e o conteúdo é comprimido.
+# O relatório de economia não grava o PDF duas vezes: soma o tamanho dos
+# streams podados e o que a compressão do conteúdo tirou (estimativa).
+# Sem imports do Django: também roda nos workers da divisão.
+
+CATEGORIAS_PODAVEIS = ('/Font', '/XObject', '/ExtGState')
+
+
+def _nomes_usados(page):
+    """Todos os nomes citados no conteúdo da página (fontes, imagens, estados gráficos...)."""
+    conteudo = page.get_contents()
+    if conteudo is None:
+        return set()
+    usados = set()
+    for operandos, _operador in ContentStream(conteudo, page.pdf).operations:
+        if isinstance(operandos, list):
+            usados.update(op for op in operandos if isinstance(op, NameObject))
+    return usados
+
+
+def _form_sem_recursos(recursos):
+    """Forms antigos sem /Resources próprio usam os da página: nesse caso não dá para podar."""
+    xobjects = recursos.get('/XObject')
+    if not xobjects:
+        return False
+    for objeto in xobjects.get_object().values():
+        objeto = objeto.get_object()
+        if objeto.get('/Subtype') == '/Form' and '/Resources' not in objeto:
+            return True
+    return False
+
+
+def _objetos_alcancaveis(valores):
+    """{(idnum, geração): objeto} de tudo que é referenciado a partir dos valores dados."""
+    alcancados = {}
+    pilha = list(valores)
+    while pilha:
+        atual = pilha.pop()
+        if isinstance(atual, IndirectObject):
+            chave = (atual.idnum, atual.generation)
+            if chave in alcancados:
+                continue
+            atual = atual.get_object()
+            alcancados[chave] = atual
+        if isinstance(atual, DictionaryObject):
+            # /Parent leva de volta à árvore de páginas: não faz parte do recurso
+            pilha.extend(valor for nome, valor in atual.items() if nome != '/Parent')
+        elif isinstance(atual, ArrayObject):
+            pilha.extend(atual)
+    return alcancados
+
+
+def _tamanho_streams(objetos):
+    return sum(len(objeto._data or b'') for objeto in objetos if isinstance(objeto, StreamObject))
+
+
+def _tamanho_conteudo(page):
+    conteudo = page.get('/Contents')
+    if conteudo is None:
+        return 0
+    conteudo = conteudo.get_object()
+    partes = conteudo if isinstance(conteudo, ArrayObject) else [conteudo]
+    return _tamanho_streams(parte.get_object() for parte in partes)
+
+
+def remover_recursos_nao_usados(page):
+    """Poda os recursos da página; retorna os bytes (streams) que deixaram de ir junto."""
+    if page.get('/Resources') is None:
+        return 0
+    # Cópia própria da página: o dicionário original pode ser compartilhado com as outras
+    recursos = DictionaryObject(page['/Resources'].get_object())
+    if _form_sem_recursos(recursos):
+        return 0
+    page[NameObject('/Resources')] = recursos
+
+    usados = _nomes_usados(page)
+    removidos, mantidos = [], []
+    for categoria in CATEGORIAS_PODAVEIS:
+        if categoria not in recursos:
+            continue
+        itens = DictionaryObject()
+        for nome, valor in recursos[categoria].get_object().items():
+            if nome in usados:
+                itens[nome] = valor
+                mantidos.append(valor)
+            else:
+                removidos.append(valor)
+        recursos[NameObject(categoria)] = itens
+
+    # Objetos compartilhados com um recurso mantido (ex: o mesmo arquivo de fonte) continuam no PDF
+    podados = _objetos_alcancaveis(removidos)
+    for chave in _objetos_alcancaveis(mantidos):
+        podados.pop(chave, None)
+    return _tamanho_streams(podados.values())
+
+
+def escrever_pdf_medindo(pages, compactar=True):
+    """
+    (bytes, economia estimada) de um PDF com as páginas dadas. A poda troca
+    o /Resources da própria página por uma cópia; as outras páginas do PDF de
+    origem não são afetadas.
+    """
+    writer = PdfWriter()
+    economia = 0
+    for page in pages:
+        if compactar:
+            try:
+                # Antes do add_page: assim os recursos não usados nem chegam a ser copiados
+                economia += remover_recursos_nao_usados(page)
+            except Exception:
+                # Conteúdo que o parser não entende: grava com os recursos completos
+                pass
+        writer.add_page(page)
+
+    if compactar:
+        for page in writer.pages:
+            antes = _tamanho_conteudo(page)
+            page.compress_content_streams(level=9)
+            economia += max(antes - _tamanho_conteudo(page), 0)
+        writer.compress_identical_objects()
+
+    saida = io.BytesIO()
+    writer.write(saida)
+    return saida.getvalue(), economia
+
+
+def escrever_pdf(pages, compactar=True):
+    """Bytes de um PDF com as páginas dadas (compactado por padrão), ver escrever_pdf_medindo."""
+    return escrever_pdf_medindo(pages, compactar)[0]
+
+
+def compactar_pdf(conteudo):
+    """Versão compactada de um PDF já gravado, ou o próprio conteúdo se não ficar menor."""
+    compacto = escrever_pdf(PdfReader(io.BytesIO(conteudo)).pages)
+    return compacto if len(compacto) < len(conteudo) else conteudo
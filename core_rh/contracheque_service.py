@@ -0,0 +1,587 @@
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, time, timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+import pdfplumber
+from pypdf import PdfReader
+
+from . import arquivos
+from .compactacao_pdf import escrever_pdf
+from .divisao_contracheques import (
+    ESTILO_RECIBO, ESTILO_SIMPLES, DivisorFolha, iniciar_worker, processar_faixa, total_paginas,
+)
+from .indice_documentos import reindexar_contracheques_competencia
+from .layout_pdf import carimbar_assinatura, extrair_layout
+from .models import Contracheque, Funcionario, ProcessamentoContracheque, ResumoContracheque, pasta_contracheques
+from .tarefas import executar_em_segundo_plano
+
+# ==========================================
+# IMPORTAÇÃO EM LOTE DE CONTRACHEQUES (COORDENADOR)
+# ==========================================
+# O upload só cria o ProcessamentoContracheque e agenda o trabalho. Aqui o PDF
+# é dividido em faixas de páginas processadas por um pool de processos; cada
+# faixa concluída tem seus arquivos gravados e fica registrada no job, então
+# um processamento interrompido continua de onde parou. Os registros de
+# Contracheque são gravados de uma vez só, no final.
+# Num reenvio da mesma competência, as páginas com o mesmo hash do
+# contracheque já gravado são puladas; o job guarda o comparativo
+# (novos / alterados / inalterados / ausentes) para o relatório.
+
+PAGINAS_POR_FAIXA = getattr(settings, 'RH_CONTRACHEQUE_PAGINAS_POR_FAIXA', 25)
+# Grava cada contracheque só com os recursos da própria página (ver compactacao_pdf)
+COMPACTAR_PDF = getattr(settings, 'RH_CONTRACHEQUE_COMPACTAR_PDF', True)
+
+# Sem atualização por esse tempo, o processamento é considerado interrompido
+PROCESSAMENTO_EXPIRA = timedelta(minutes=5)
+
+ESTILO_POR_ORIGEM = {'painel': ESTILO_RECIBO, 'admin': ESTILO_SIMPLES}
+
+
+def _quantidade_processos():
+    return getattr(settings, 'RH_CONTRACHEQUE_PROCESSOS', min(4, os.cpu_count() or 1))
+
+
+def criar_processamento(arquivo, mes, ano, data_recebimento=None, origem='painel', usuario=None):
+    """Guarda o PDF enviado e agenda a divisão em segundo plano."""
+    processamento = ProcessamentoContracheque(
+        mes=mes, ano=ano, data_recebimento=data_recebimento, origem=origem,
+        criado_por=usuario if usuario and usuario.is_authenticated else None,
+    )
+    processamento.arquivo.save(f"folha_{ano}_{mes:02d}.pdf", arquivo, save=False)
+    processamento.save()
+    enfileirar_processamento(processamento.pk)
+    return processamento
+
+
+def enfileirar_processamento(processamento_id):
+    transaction.on_commit(lambda: executar_em_segundo_plano(processar_lote_contracheques, processamento_id))
+
+
+def url_processamento_contracheque(processamento, next_url):
+    """Página de acompanhamento do job, com o link de volta para quem fez o upload."""
+    return f"{reverse('processamento_contracheque', args=[processamento.pk])}?{urlencode({'next': next_url})}"
+
+
+def processamento_interrompido(processamento):
+    return (processamento.status == 'Processando'
+            and processamento.atualizado_em < timezone.now() - PROCESSAMENTO_EXPIRA)
+
+
+def retomar_se_interrompido(processamento):
+    """Reagenda um processamento parado (ex: worker do gunicorn reiniciado no meio)."""
+    if processamento_interrompido(processamento):
+        enfileirar_processamento(processamento.pk)
+        return True
+    return False
+
+
+def _reservar(processamento_id, incluir_erro=False):
+    """Marca como Processando se ninguém estiver cuidando dele. Evita dois coordenadores no mesmo job."""
+    agora = timezone.now()
+    livre = Q(status='Pendente') | Q(status='Processando', atualizado_em__lt=agora - PROCESSAMENTO_EXPIRA)
+    if incluir_erro:
+        livre |= Q(status='Erro')
+    return ProcessamentoContracheque.objects.filter(livre, pk=processamento_id).update(
+        status='Processando', atualizado_em=agora, mensagem_erro=''
+    ) == 1
+
+
+def _baixar_para_temporario(arquivo):
+    """Os workers abrem o PDF por caminho; com storage remoto ele é copiado para um temporário local."""
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temporario:
+        for bloco in arquivos.ler_blocos(arquivo):
+            temporario.write(bloco)
+    return temporario.name
+
+
+def _executar_faixas(caminho_pdf, faixas, funcionarios, data_recebimento, estilo, hashes_atuais):
+    """Gera (inicio, resultados) de cada faixa conforme forem terminando."""
+    processos = min(_quantidade_processos(), len(faixas))
+
+    if processos <= 1:
+        divisor = DivisorFolha(
+            caminho_pdf, funcionarios, data_recebimento, estilo, hashes_atuais, COMPACTAR_PDF
+        )
+        try:
+            for inicio, fim in faixas:
+                yield inicio, divisor.processar(inicio, fim)
+        finally:
+            divisor.fechar()
+        return
+
+    # "spawn": os workers não herdam conexões de banco nem threads do gunicorn
+    with ProcessPoolExecutor(
+        max_workers=processos,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=iniciar_worker,
+        initargs=(caminho_pdf, funcionarios, data_recebimento, estilo, hashes_atuais, COMPACTAR_PDF),
+    ) as pool:
+        futuros = [pool.submit(processar_faixa, inicio, fim) for inicio, fim in faixas]
+        for futuro in as_completed(futuros):
+            yield futuro.result()
+
+
+def _nome_arquivo_contracheque(processamento, funcionario_id):
+    if processamento.origem == 'admin':
+        return f"holerite_{funcionario_id}.pdf"
+    return f"holerite_{funcionario_id}_{processamento.mes}_{processamento.ano}.pdf"
+
+
+def _salvar_pagina(processamento, funcionario, conteudo):
+    campo = Contracheque._meta.get_field('arquivo')
+    instancia = Contracheque(funcionario=funcionario, mes=processamento.mes, ano=processamento.ano)
+    nome = campo.generate_filename(instancia, _nome_arquivo_contracheque(processamento, funcionario.id))
+    return campo.storage.save(nome, ContentFile(conteudo))
+
+
+def _gravar_faixa(processamento, inicio, resultados, funcionarios):
+    """Grava os PDFs da faixa no storage e registra o progresso no job."""
+    resultado = processamento.resultado
+    for item in resultados:
+        pagina = item['pagina']
+        if item['inalterada']:
+            funcionario = funcionarios[item['funcionario_id']]
+            resultado['inalterados'][str(pagina)] = funcionario.id
+            resultado['sucesso'].append({'pagina': pagina, 'nome': funcionario.nome_completo, 'status': 'Sem alteração'})
+        elif item['conteudo']:
+            funcionario = funcionarios[item['funcionario_id']]
+            nome = _salvar_pagina(processamento, funcionario, item['conteudo'])
+            resultado['arquivos'][str(pagina)] = [funcionario.id, nome, item['layout'], item['hash']]
+            resultado['bytes']['sem_compactar'] += item['bytes_sem_compactar']
+            resultado['bytes']['gravado'] += item['bytes']
+            resultado['sucesso'].append({'pagina': pagina, 'nome': funcionario.nome_completo, 'status': 'Processado'})
+        else:
+            resultado['erro'].append({'pagina': pagina, 'motivo': item['motivo']})
+        if item['aviso']:
+            resultado['avisos'].append(f"Pág {pagina}: {item['aviso']}")
+
+    processamento.faixas_concluidas.append(inicio)
+    processamento.paginas_processadas += len(resultados)
+    processamento.save(update_fields=['resultado', 'faixas_concluidas', 'paginas_processadas', 'atualizado_em'])
+
+
+def _hashes_atuais(mes, ano):
+    return dict(
+        Contracheque.objects.filter(mes=mes, ano=ano).exclude(hash_conteudo='')
+        .values_list('funcionario_id', 'hash_conteudo')
+    )
+
+
+def _comparativo(processamento, por_funcionario):
+    """Nomes dos funcionários novos, alterados, inalterados e ausentes em relação à competência gravada."""
+    existentes = set(
+        Contracheque.objects.filter(mes=processamento.mes, ano=processamento.ano).values_list('funcionario_id', flat=True)
+    )
+    nomes = dict(
+        Funcionario.objects.filter(pk__in=existentes | set(por_funcionario)).values_list('id', 'nome_completo')
+    )
+
+    comparativo = {'novos': [], 'alterados': [], 'inalterados': [], 'ausentes': []}
+    for funcionario_id, dados in por_funcionario.items():
+        if dados is None:
+            grupo = 'inalterados'
+        else:
+            grupo = 'alterados' if funcionario_id in existentes else 'novos'
+        comparativo[grupo].append(nomes.get(funcionario_id, str(funcionario_id)))
+    comparativo['ausentes'] = [nomes[fid] for fid in existentes - set(por_funcionario) if fid in nomes]
+
+    for grupo in comparativo.values():
+        grupo.sort()
+    return comparativo
+
+
+def _consolidar(processamento):
+    """Cria/atualiza todos os Contracheques do job numa única transação."""
+    arquivos = processamento.resultado['arquivos']
+    inalterados = processamento.resultado.get('inalterados', {})
+
+    por_funcionario = {}
+    # Funcionário com mais de uma página fica com a última, como no processo antigo
+    for pagina in sorted({*arquivos, *inalterados}, key=int):
+        if pagina in inalterados:
+            # Igual ao que já está gravado: o contracheque atual fica como está
+            por_funcionario[inalterados[pagina]] = None
+            continue
+        # Jobs antigos gravavam só [funcionario_id, nome] ou [funcionario_id, nome, layout]
+        funcionario_id, nome, *extra = arquivos[pagina]
+        layout = extra[0] if extra else None
+        hash_conteudo = extra[1] if len(extra) > 1 else ''
+        por_funcionario[funcionario_id] = (nome, layout, hash_conteudo)
+
+    data_ciencia = None
+    if processamento.origem == 'admin' and processamento.data_recebimento:
+        data_ciencia = timezone.make_aware(datetime.combine(processamento.data_recebimento, time.min))
+
+    registros = [
+        Contracheque(
+            funcionario_id=funcionario_id, mes=processamento.mes, ano=processamento.ano,
+            arquivo=dados[0], layout_pdf=dados[1], hash_conteudo=dados[2], data_ciencia=data_ciencia,
+        )
+        for funcionario_id, dados in por_funcionario.items() if dados is not None
+    ]
+    campos = ['arquivo', 'layout_pdf', 'hash_conteudo'] + (['data_ciencia'] if data_ciencia else [])
+
+    with transaction.atomic():
+        processamento.resultado['comparativo'] = _comparativo(processamento, por_funcionario)
+
+        # Um único upsert (INSERT ... ON CONFLICT) só com as páginas novas ou alteradas
+        if registros:
+            Contracheque.objects.bulk_create(
+                registros, batch_size=500,
+                update_conflicts=True, unique_fields=['funcionario', 'mes', 'ano'], update_fields=campos,
+            )
+
+        processamento.resultado['sucesso'].sort(key=lambda item: item['pagina'])
+        processamento.resultado['erro'].sort(key=lambda item: item['pagina'])
+        processamento.status = 'Concluido'
+        processamento.concluido_em = timezone.now()
+        processamento.save(update_fields=['resultado', 'status', 'concluido_em', 'atualizado_em'])
+
+        transaction.on_commit(lambda: limpar_arquivos_orfaos(processamento.mes, processamento.ano))
+        # O upsert em lote não dispara os signals do índice de busca nem do resumo
+        transaction.on_commit(lambda: reindexar_contracheques_competencia(processamento.mes, processamento.ano))
+        agendar_resumo_competencia(processamento.mes, processamento.ano)
+
+
+# Arquivos mais novos que isto nunca são apagados como órfãos: o carimbo e o
+# upload individual gravam o PDF no storage antes do UPDATE que aponta para ele
+ORFAOS_CARENCIA = timedelta(minutes=30)
+
+
+def _nome_pdf_assinado(funcionario_id, mes, ano):
+    return f"holerite_{funcionario_id}_{mes}_{ano}_assinado"
+
+
+def limpar_arquivos_orfaos(mes, ano):
+    """
+    Apaga da pasta da competência os PDFs que nenhum Contracheque usa mais
+    (uploads anteriores substituídos, páginas repetidas do mesmo funcionário).
+    Arquivos de processamentos ainda em andamento, PDFs assinados de carimbos
+    na fila ou rodando e arquivos gravados há menos de ORFAOS_CARENCIA são preservados.
+    """
+    storage = Contracheque._meta.get_field('arquivo').storage
+    pasta = pasta_contracheques(mes, ano)
+    try:
+        _, nomes = storage.listdir(pasta)
+    except (FileNotFoundError, OSError):
+        return 0
+
+    em_uso = set(Contracheque.objects.filter(mes=mes, ano=ano).values_list('arquivo', flat=True))
+    em_andamento = ProcessamentoContracheque.objects.filter(
+        mes=mes, ano=ano, status__in=['Pendente', 'Processando']
+    ).values_list('resultado', flat=True)
+    for resultado in em_andamento:
+        em_uso.update(item[1] for item in (resultado or {}).get('arquivos', {}).values())
+    carimbando = [
+        _nome_pdf_assinado(funcionario_id, mes, ano)
+        for funcionario_id in Contracheque.objects.filter(
+            mes=mes, ano=ano, status_carimbo__in=['Pendente', 'Processando']
+        ).values_list('funcionario_id', flat=True)
+    ]
+
+    limite = timezone.now() - ORFAOS_CARENCIA
+    apagados = 0
+    for nome in nomes:
+        caminho = f"{pasta}/{nome}"
+        if caminho in em_uso or any(assinado in nome for assinado in carimbando):
+            continue
+        try:
+            if storage.get_modified_time(caminho) > limite:
+                continue
+            storage.delete(caminho)
+            apagados += 1
+        except Exception as e:
+            print(f"Erro ao apagar contracheque órfão {caminho}: {e}")
+    return apagados
+
+
+def processar_lote_contracheques(processamento_id, incluir_erro=False):
+    """Executa (ou retoma) um processamento. Não faz nada se outro processo já estiver nele."""
+    if not _reservar(processamento_id, incluir_erro):
+        return False
+
+    processamento = ProcessamentoContracheque.objects.get(pk=processamento_id)
+    caminho_pdf = None
+    try:
+        caminho_pdf = _baixar_para_temporario(processamento.arquivo)
+        if not processamento.total_paginas:
+            processamento.total_paginas = total_paginas(caminho_pdf)
+            processamento.save(update_fields=['total_paginas', 'atualizado_em'])
+
+        for chave in ('sucesso', 'erro', 'avisos'):
+            processamento.resultado.setdefault(chave, [])
+        processamento.resultado.setdefault('arquivos', {})
+        processamento.resultado.setdefault('inalterados', {})
+        processamento.resultado.setdefault('bytes', {'sem_compactar': 0, 'gravado': 0})
+
+        concluidas = set(processamento.faixas_concluidas)
+        faixas = [
+            (inicio, min(inicio + PAGINAS_POR_FAIXA, processamento.total_paginas))
+            for inicio in range(0, processamento.total_paginas, PAGINAS_POR_FAIXA)
+            if inicio not in concluidas
+        ]
+
+        funcionarios = {
+            func.id: func for func in Funcionario.objects.only('id', 'nome_completo', 'cpf', 'matricula')
+        }
+        dados_indice = [(f.id, f.nome_completo, f.cpf, f.matricula) for f in funcionarios.values()]
+        estilo = ESTILO_POR_ORIGEM.get(processamento.origem, ESTILO_RECIBO)
+
+        if faixas:
+            hashes_atuais = _hashes_atuais(processamento.mes, processamento.ano)
+            for inicio, resultados in _executar_faixas(
+                caminho_pdf, faixas, dados_indice, processamento.data_recebimento, estilo, hashes_atuais
+            ):
+                _gravar_faixa(processamento, inicio, resultados, funcionarios)
+
+        _consolidar(processamento)
+        return True
+
+    except Exception as e:
+        print(f"Erro no processamento de contracheques {processamento_id}: {e}")
+        ProcessamentoContracheque.objects.filter(pk=processamento_id).update(
+            status='Erro', mensagem_erro=str(e), atualizado_em=timezone.now()
+        )
+        return False
+
+    finally:
+        if caminho_pdf:
+            try:
+                os.remove(caminho_pdf)
+            except OSError:
+                pass
+
+
+# ==========================================
+# ASSINATURA DO CONTRACHEQUE (CIÊNCIA + CARIMBO EM SEGUNDO PLANO)
+# ==========================================
+# O clique do funcionário só grava data/IP da ciência (um UPDATE, protegido por
+# chave de idempotência). O PDF assinado é gerado depois por uma tarefa com
+# novas tentativas; depois de CARIMBO_MAX_TENTATIVAS fica como "Falhou" até o
+# RH reprocessar (admin ou `manage.py carimbar_contracheques --reprocessar-falhas`).
+# A hora da nova tentativa fica no próprio contracheque (proxima_tentativa_carimbo):
+# o timer do processo é só o atalho; se o processo reiniciar antes dele,
+# `manage.py carimbar_contracheques` (cron) pega os vencidos.
+
+CARIMBO_MAX_TENTATIVAS = 3
+# Espera antes da nova tentativa (dobra a cada falha)
+CARIMBO_ESPERA_SEGUNDOS = 30
+CARIMBO_EXPIRA = timedelta(minutes=5)
+
+CIENCIA_REGISTRADA = 'registrada'
+CIENCIA_REPETIDA = 'repetida'
+
+
+def registrar_ciencia_contracheque(contracheque_id, usuario, ip, chave):
+    """
+    Caminho rápido da assinatura. Retorna CIENCIA_REGISTRADA, CIENCIA_REPETIDA
+    (mesma chave reenviada, ex: duplo clique) ou None (não encontrado / já assinado).
+    """
+    agora = timezone.now()
+    try:
+        # Ciência e +1 no resumo no mesmo commit (ver atualizar_resumo_competencia)
+        with transaction.atomic():
+            atualizados = Contracheque.objects.filter(
+                pk=contracheque_id, funcionario__usuario=usuario, data_ciencia__isnull=True
+            ).update(
+                data_ciencia=agora, ip_ciencia=ip, chave_assinatura=chave,
+                status_carimbo='Pendente', tentativas_carimbo=0, erro_carimbo='', carimbo_atualizado_em=agora,
+                proxima_tentativa_carimbo=None,
+            )
+            if atualizados:
+                _somar_assinatura_resumo(contracheque_id)
+    except IntegrityError:
+        atualizados = 0
+
+    if atualizados:
+        enfileirar_carimbo(contracheque_id)
+        return CIENCIA_REGISTRADA
+
+    if Contracheque.objects.filter(pk=contracheque_id, funcionario__usuario=usuario, chave_assinatura=chave).exists():
+        return CIENCIA_REPETIDA
+    return None
+
+
+def enfileirar_carimbo(contracheque_id):
+    transaction.on_commit(lambda: executar_em_segundo_plano(carimbar_contracheque, contracheque_id))
+
+
+def carimbos_livres(agora=None):
+    """Filtro dos carimbos que podem rodar agora: na fila (com a espera da nova tentativa vencida) ou travados."""
+    agora = agora or timezone.now()
+    na_fila = Q(status_carimbo='Pendente') & (
+        Q(proxima_tentativa_carimbo__isnull=True) | Q(proxima_tentativa_carimbo__lte=agora)
+    )
+    return na_fila | Q(status_carimbo='Processando', carimbo_atualizado_em__lt=agora - CARIMBO_EXPIRA)
+
+
+def _espera_nova_tentativa(tentativas):
+    return timedelta(seconds=CARIMBO_ESPERA_SEGUNDOS * (2 ** (tentativas - 1)))
+
+
+def _agendar_nova_tentativa(contracheque_id, espera):
+    timer = threading.Timer(
+        espera.total_seconds(), executar_em_segundo_plano, args=(carimbar_contracheque, contracheque_id)
+    )
+    timer.daemon = True
+    timer.start()
+
+
+def gerar_pdf_assinado(contracheque):
+    """(bytes do PDF com a assinatura, layout usado). Usa as âncoras salvas no upload quando existem."""
+    nome_assinatura = contracheque.funcionario.nome_completo.strip().upper()
+
+    pdf_io = io.BytesIO(arquivos.ler_bytes(contracheque.arquivo))
+    reader = PdfReader(pdf_io)
+
+    # Só contracheques antigos (sem âncoras) precisam do pdfplumber
+    layout = contracheque.layout_pdf
+    if not layout or len(layout) != len(reader.pages):
+        pdf_io.seek(0)
+        with pdfplumber.open(pdf_io) as plumber_pdf:
+            layout = extrair_layout(plumber_pdf, reader)
+
+    for i, page in enumerate(reader.pages):
+        try:
+            carimbar_assinatura(page, layout[i], nome_assinatura)
+        except Exception as e:
+            print(f"Erro processando página {i}: {e}")
+
+    return escrever_pdf(reader.pages, COMPACTAR_PDF), layout
+
+
+def carimbar_contracheque(contracheque_id):
+    """Gera e grava o PDF assinado. Não faz nada se outra tarefa já estiver nele."""
+    agora = timezone.now()
+    if not Contracheque.objects.filter(carimbos_livres(agora), pk=contracheque_id).update(
+        status_carimbo='Processando', carimbo_atualizado_em=agora, proxima_tentativa_carimbo=None
+    ):
+        return False
+
+    contracheque = Contracheque.objects.select_related('funcionario').get(pk=contracheque_id)
+    try:
+        nome_original = contracheque.arquivo.name
+        conteudo, layout = gerar_pdf_assinado(contracheque)
+        filename = f"{_nome_pdf_assinado(contracheque.funcionario.id, contracheque.mes, contracheque.ano)}.pdf"
+        contracheque.arquivo.save(filename, ContentFile(conteudo), save=False)
+
+        # Só troca se ninguém mexeu no arquivo enquanto isso (reenvio, upload individual)
+        if Contracheque.objects.filter(pk=contracheque_id, arquivo=nome_original).update(
+            arquivo=contracheque.arquivo.name, layout_pdf=layout,
+            status_carimbo='Concluido', erro_carimbo='', carimbo_atualizado_em=timezone.now(),
+        ):
+            return True
+
+        # Arquivo trocado no meio: descarta a cópia assinada do antigo e carimba o novo
+        contracheque.arquivo.storage.delete(contracheque.arquivo.name)
+        Contracheque.objects.filter(pk=contracheque_id, status_carimbo='Processando').update(
+            status_carimbo='Pendente', carimbo_atualizado_em=timezone.now(),
+        )
+        enfileirar_carimbo(contracheque_id)
+        return False
+
+    except Exception as e:
+        tentativas = contracheque.tentativas_carimbo + 1
+        status = 'Falhou' if tentativas >= CARIMBO_MAX_TENTATIVAS else 'Pendente'
+        print(f"Erro ao gerar contracheque assinado {contracheque_id} (tentativa {tentativas}): {e}")
+        espera = _espera_nova_tentativa(tentativas) if status == 'Pendente' else None
+        agora = timezone.now()
+        Contracheque.objects.filter(pk=contracheque_id).update(
+            status_carimbo=status, tentativas_carimbo=tentativas, erro_carimbo=str(e),
+            carimbo_atualizado_em=agora, proxima_tentativa_carimbo=agora + espera if espera else None,
+        )
+        if espera:
+            _agendar_nova_tentativa(contracheque_id, espera)
+        return False
+
+
+def reprocessar_carimbos(queryset):
+    """Devolve para a fila os carimbos que falharam (dead letter). Retorna quantos."""
+    ids = list(queryset.filter(status_carimbo='Falhou').values_list('pk', flat=True))
+    Contracheque.objects.filter(pk__in=ids).update(
+        status_carimbo='Pendente', tentativas_carimbo=0, erro_carimbo='', proxima_tentativa_carimbo=None
+    )
+    for contracheque_id in ids:
+        enfileirar_carimbo(contracheque_id)
+    return len(ids)
+
+
+# ==========================================
+# RESUMO POR COMPETÊNCIA E EQUIPE (ROLLUP)
+# ==========================================
+# O painel de indicadores e o CSV leem só ResumoContracheque, nunca a tabela
+# de contracheques. Cada escrita em Contracheque recalcula a competência
+# afetada (um GROUP BY só dela, depois do commit); a assinatura soma 1 direto
+# na linha da equipe. A equipe é a principal do funcionário no momento do
+# cálculo; `manage.py atualizar_resumo_contracheques` refaz tudo.
+
+_CC_ENVIADO = Q(arquivo__isnull=False) & ~Q(arquivo='')
+
+
+def atualizar_resumo_competencia(mes, ano):
+    # Upsert pelas constraints únicas: dois recálculos do mesmo mês ao mesmo
+    # tempo não duplicam linhas. "Sem equipe" (NULL) só casa com o índice
+    # parcial, que o ON CONFLICT de bulk_create não alcança: vai por update_or_create.
+    with transaction.atomic():
+        # Trava as linhas da competência antes de contar: uma assinatura em
+        # andamento (_somar_assinatura_resumo, na mesma transação da ciência)
+        # ou termina antes e entra na contagem, ou espera e soma depois dela
+        list(ResumoContracheque.objects.select_for_update().filter(mes=mes, ano=ano).order_by('pk').values_list('pk'))
+        linhas = (
+            Contracheque.objects.filter(mes=mes, ano=ano).values('funcionario__equipe')
+            .annotate(
+                enviados=Count('id', filter=_CC_ENVIADO),
+                assinados=Count('id', filter=_CC_ENVIADO & Q(data_ciencia__isnull=False)),
+            )
+        )
+        resumos = [
+            ResumoContracheque(
+                mes=mes, ano=ano, equipe_id=linha['funcionario__equipe'],
+                enviados=linha['enviados'], assinados=linha['assinados'],
+            )
+            for linha in linhas if linha['enviados']
+        ]
+        com_equipe = [resumo for resumo in resumos if resumo.equipe_id]
+        sem_equipe = next((resumo for resumo in resumos if resumo.equipe_id is None), None)
+
+        antigas = ResumoContracheque.objects.filter(mes=mes, ano=ano)
+        antigas.filter(equipe__isnull=False).exclude(equipe_id__in=[r.equipe_id for r in com_equipe]).delete()
+        if sem_equipe is None:
+            antigas.filter(equipe__isnull=True).delete()
+        else:
+            ResumoContracheque.objects.update_or_create(
+                mes=mes, ano=ano, equipe=None,
+                defaults={'enviados': sem_equipe.enviados, 'assinados': sem_equipe.assinados},
+            )
+        ResumoContracheque.objects.bulk_create(
+            com_equipe, update_conflicts=True,
+            unique_fields=['mes', 'ano', 'equipe'], update_fields=['enviados', 'assinados', 'atualizado_em'],
+        )
+
+
+def agendar_resumo_competencia(mes, ano):
+    transaction.on_commit(lambda: atualizar_resumo_competencia(mes, ano))
+
+
+def _somar_assinatura_resumo(contracheque_id):
+    mes, ano, equipe_id = Contracheque.objects.filter(pk=contracheque_id).values_list(
+        'mes', 'ano', 'funcionario__equipe'
+    ).get()
+    somados = ResumoContracheque.objects.filter(mes=mes, ano=ano, equipe_id=equipe_id).update(
+        assinados=F('assinados') + 1, atualizado_em=timezone.now()
+    )
+    if not somados:
+        # Competência ainda sem resumo (ex: antes do primeiro cálculo): calcula inteira
+        agendar_resumo_competencia(mes, ano)
@@ -0,0 +1,128 @@
+import hashlib
+from types import SimpleNamespace
+
+import pdfplumber
+from pypdf import PdfReader
+
+from .compactacao_pdf import escrever_pdf_medindo
+from .identificacao import IndiceFuncionarios
+from .layout_pdf import carimbar_data_recebimento, carimbar_data_simples, extrair_ancoras
+
+# ==========================================
+# DIVISÃO DA FOLHA DE PAGAMENTO (LADO DO WORKER)
+# ==========================================
+# Este módulo roda dentro dos processos do pool (contexto "spawn") e por isso
+# não importa nada do Django: recebe o caminho do PDF e a lista de
+# funcionários, e devolve o PDF de cada página identificada. Gravar no
+# storage e no banco fica com o coordenador (contracheque_service).
+# Cada página identificada leva um hash do conteúdo de origem: se for igual ao
+# do contracheque já gravado (reenvio de folha corrigida), a página não é
+# carimbada nem regravada.
+
+ESTILO_RECIBO = 'recibo'    # Painel do RH: cobre o campo e escreve a data grande
+ESTILO_SIMPLES = 'simples'  # Importação pelo admin: data pequena sobre o campo
+
+
+def hash_pagina(page, texto, data_recebimento=None, estilo=ESTILO_RECIBO):
+    """SHA-256 da página antes do carimbo (conteúdo + texto) e do que vai ser carimbado nela."""
+    h = hashlib.sha256()
+    try:
+        conteudo = page.get_contents()
+        if conteudo is not None:
+            h.update(conteudo.get_data())
+    except Exception:
+        pass
+    h.update(texto.encode('utf-8'))
+    h.update(f"|{data_recebimento or ''}|{estilo}".encode('utf-8'))
+    return h.hexdigest()
+
+
+class DivisorFolha:
+    """Abre o PDF uma vez e processa faixas de páginas: extrai texto, identifica e carimba."""
+
+    def __init__(self, caminho_pdf, funcionarios, data_recebimento=None, estilo=ESTILO_RECIBO,
+                 hashes_atuais=None, compactar=True):
+        self.plumber_pdf = pdfplumber.open(caminho_pdf)
+        self.reader = PdfReader(caminho_pdf)
+        self.indice = IndiceFuncionarios(
+            SimpleNamespace(id=f_id, nome_completo=nome, cpf=cpf, matricula=matricula)
+            for f_id, nome, cpf, matricula in funcionarios
+        )
+        self.data_recebimento = data_recebimento
+        self.estilo = estilo
+        # {funcionario_id: hash} dos contracheques já gravados na competência
+        self.hashes_atuais = hashes_atuais or {}
+        self.compactar = compactar
+
+    def _carimbar(self, page, ancoras):
+        if not self.data_recebimento:
+            return
+        try:
+            if self.estilo == ESTILO_SIMPLES:
+                # Sem âncora a data vai na posição padrão, como antes
+                carimbar_data_simples(page, ancoras or {}, self.data_recebimento)
+            elif ancoras:
+                carimbar_data_recebimento(page, ancoras, self.data_recebimento)
+        except Exception:
+            pass
+
+    def processar(self, inicio, fim):
+        """
+        Lista de resultados das páginas [inicio, fim) — 'conteudo' e 'layout'
+        (âncoras usadas depois na assinatura) só vêm nas páginas identificadas
+        e alteradas; nas iguais ao contracheque atual vem 'inalterada'.
+        """
+        resultados = []
+        for i in range(inicio, fim):
+            page = self.reader.pages[i]
+            texto = page.extract_text() or ""
+            funcionario, motivo = self.indice.identificar(texto)
+
+            resultado = {
+                'pagina': i + 1, 'motivo': motivo, 'funcionario_id': None,
+                'conteudo': None, 'layout': None, 'aviso': None, 'hash': None, 'inalterada': False,
+                'bytes': 0, 'bytes_sem_compactar': 0,
+            }
+            if funcionario:
+                resultado['funcionario_id'] = funcionario.id
+                resultado['hash'] = hash_pagina(page, texto, self.data_recebimento, self.estilo)
+                if self.hashes_atuais.get(funcionario.id) == resultado['hash']:
+                    resultado['inalterada'] = True
+                    resultados.append(resultado)
+                    continue
+
+                # Única leitura de layout da página: serve para a data agora e a assinatura depois
+                try:
+                    ancoras = extrair_ancoras(self.plumber_pdf.pages[i], float(page.mediabox.height))
+                except Exception as e:
+                    ancoras = None
+                    resultado['aviso'] = f"Erro cálculo pos ({e})"
+                self._carimbar(page, ancoras)
+
+                # Sem compactar seria o gravado mais o que a compactação estima ter tirado
+                resultado['conteudo'], economia = escrever_pdf_medindo([page], self.compactar)
+                resultado['bytes'] = len(resultado['conteudo'])
+                resultado['bytes_sem_compactar'] = resultado['bytes'] + economia
+                resultado['layout'] = [ancoras] if ancoras else None
+            resultados.append(resultado)
+        return resultados
+
+    def fechar(self):
+        self.plumber_pdf.close()
+
+
+def total_paginas(caminho_pdf):
+    return len(PdfReader(caminho_pdf).pages)
+
+
+# --- Funções chamadas dentro dos processos do pool ---
+_divisor = None
+
+
+def iniciar_worker(caminho_pdf, funcionarios, data_recebimento, estilo, hashes_atuais=None, compactar=True):
+    global _divisor
+    _divisor = DivisorFolha(caminho_pdf, funcionarios, data_recebimento, estilo, hashes_atuais, compactar)
+
+
+def processar_faixa(inicio, fim):
+    return inicio, _divisor.processar(inicio, fim)
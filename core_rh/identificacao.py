@@ -0,0 +1,161 @@
+import re
+import unicodedata
+from collections import deque
+
+# ==========================================
+# IDENTIFICAÇÃO DO FUNCIONÁRIO NAS PÁGINAS DA FOLHA DE PAGAMENTO
+# ==========================================
+# O índice é montado uma vez por upload (autômato de Aho-Corasick sobre os
+# nomes normalizados e as matrículas) e cada página é lida uma única vez,
+# em vez de testar `nome in texto` para cada funcionário.
+# Ordem de decisão: CPF impresso na página > nome mais longo encontrado
+# (evita que "ANA SILVA" roube a página de "ANA SILVA SOUZA") > matrícula
+# como desempate entre homônimos.
+
+_REGEX_NAO_ALFANUMERICO = re.compile(r'[^A-Z0-9]+')
+_REGEX_CPF = re.compile(r'(?<!\d)(\d{3})\.?(\d{3})\.?(\d{3})-?(\d{2})(?!\d)')
+
+TIPO_NOME = 'nome'
+TIPO_MATRICULA = 'matricula'
+
+MOTIVO_NAO_ENCONTRADO = 'Nome não encontrado.'
+
+
+def normalizar_texto(texto):
+    """
+    Maiúsculas, sem acentos e só letras/dígitos separados por um espaço.
+    Retorna com espaço nas pontas para que as buscas casem palavras inteiras.
+    """
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    sem_acento = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    palavras = _REGEX_NAO_ALFANUMERICO.sub(' ', sem_acento.upper()).split()
+    return f" {' '.join(palavras)} " if palavras else ''
+
+
+def somente_digitos(valor):
+    return ''.join(c for c in (valor or '') if c.isdigit())
+
+
+class _AhoCorasick:
+    """Autômato de busca simultânea de vários padrões num único passe sobre o texto."""
+
+    def __init__(self):
+        self._transicoes = [{}]
+        self._falha = [0]
+        self._saidas = [[]]
+        # Próximo nó (pela cadeia de falhas) que tem alguma saída
+        self._proxima_saida = [0]
+
+    def adicionar(self, padrao, valor):
+        no = 0
+        for caractere in padrao:
+            proximo = self._transicoes[no].get(caractere)
+            if proximo is None:
+                proximo = len(self._transicoes)
+                self._transicoes.append({})
+                self._falha.append(0)
+                self._saidas.append([])
+                self._proxima_saida.append(0)
+                self._transicoes[no][caractere] = proximo
+            no = proximo
+        self._saidas[no].append(valor)
+
+    def construir(self):
+        fila = deque(self._transicoes[0].values())
+        while fila:
+            no = fila.popleft()
+            for caractere, filho in self._transicoes[no].items():
+                fila.append(filho)
+                falha = self._falha[no]
+                while falha and caractere not in self._transicoes[falha]:
+                    falha = self._falha[falha]
+                destino = self._transicoes[falha].get(caractere, 0)
+                self._falha[filho] = destino if destino != filho else 0
+                alvo = self._falha[filho]
+                self._proxima_saida[filho] = alvo if self._saidas[alvo] else self._proxima_saida[alvo]
+
+    def buscar(self, texto):
+        """Gera o valor de cada padrão encontrado (inclusive sobrepostos)."""
+        transicoes, falhas, saidas, proxima = self._transicoes, self._falha, self._saidas, self._proxima_saida
+        no = 0
+        for caractere in texto:
+            while no and caractere not in transicoes[no]:
+                no = falhas[no]
+            no = transicoes[no].get(caractere, 0)
+
+            atual = no
+            while atual:
+                yield from saidas[atual]
+                atual = proxima[atual]
+
+
+class IndiceFuncionarios:
+    """
+    Índice de nomes, matrículas e CPFs para localizar o dono de cada página.
+    Aceita qualquer iterável de objetos com id, nome_completo, cpf e matricula.
+    """
+
+    def __init__(self, funcionarios):
+        self.funcionarios = {}
+        self._por_cpf = {}
+        self._automato = _AhoCorasick()
+
+        for func in funcionarios:
+            self.funcionarios[func.id] = func
+
+            nome = normalizar_texto(func.nome_completo)
+            if nome:
+                # Comprimento do nome normalizado define o "mais específico"
+                self._automato.adicionar(nome, (TIPO_NOME, func.id, len(nome)))
+
+            matricula = normalizar_texto(getattr(func, 'matricula', None))
+            if matricula:
+                self._automato.adicionar(matricula, (TIPO_MATRICULA, func.id, len(matricula)))
+
+            cpf = somente_digitos(getattr(func, 'cpf', None))
+            if len(cpf) == 11:
+                self._por_cpf.setdefault(cpf, set()).add(func.id)
+
+        self._automato.construir()
+
+    def _cpfs_na_pagina(self, texto):
+        ids = set()
+        for partes in _REGEX_CPF.findall(texto):
+            ids |= self._por_cpf.get(''.join(partes), set())
+        return ids
+
+    def identificar(self, texto):
+        """
+        Retorna (funcionario, motivo). Quando não há um dono único,
+        funcionario é None e motivo explica o porquê (para o log do upload).
+        """
+        ids_cpf = self._cpfs_na_pagina(texto or '')
+        if len(ids_cpf) == 1:
+            return self.funcionarios[next(iter(ids_cpf))], 'CPF'
+
+        maior_nome = 0
+        ids_nome = set()
+        ids_matricula = set()
+        for tipo, func_id, comprimento in self._automato.buscar(normalizar_texto(texto)):
+            if tipo == TIPO_MATRICULA:
+                ids_matricula.add(func_id)
+            elif comprimento > maior_nome:
+                maior_nome, ids_nome = comprimento, {func_id}
+            elif comprimento == maior_nome:
+                ids_nome.add(func_id)
+
+        # Vários CPFs na página: fica com o que também tem o nome impresso
+        if ids_cpf and len(ids_cpf & ids_nome) == 1:
+            return self.funcionarios[next(iter(ids_cpf & ids_nome))], 'CPF + nome'
+
+        if len(ids_nome) == 1:
+            return self.funcionarios[next(iter(ids_nome))], 'Nome'
+
+        if ids_nome:
+            desempate = ids_nome & ids_matricula
+            if len(desempate) == 1:
+                return self.funcionarios[next(iter(desempate))], 'Nome + matrícula'
+            nomes = sorted(self.funcionarios[i].nome_completo for i in ids_nome)
+            return None, f"Nome ambíguo: {', '.join(nomes)}."
+
+        return None, MOTIVO_NAO_ENCONTRADO
@@ -0,0 +1,218 @@
+import re
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Q
+
+from .identificacao import normalizar_texto, somente_digitos
+from .models import Atestado, Contracheque, DocumentoIndice, Ferias, FolhaPontoStatus
+
+# ==========================================
+# ÍNDICE DE DOCUMENTOS DO RH (BUSCA ENTRE ANOS)
+# ==========================================
+# Uma linha por arquivo (contracheque, folha de ponto assinada, férias,
+# atestado) com o texto de busca pronto: nome, matrícula, CPF, tipo e
+# competência, em maiúsculas e sem acento. A busca é um LIKE '%termo%' por
+# termo; no Postgres a coluna tem índice trigram (pg_trgm, migração 0010) e a
+# consulta não varre a tabela. No SQLite (testes) a mesma consulta funciona,
+# só que sem o índice.
+# Mantido pelos signals de models.py; o upsert em lote dos contracheques não
+# dispara signal e chama reindexar_contracheques_competencia.
+# `manage.py reindexar_documentos` refaz tudo.
+
+LIMITE_PADRAO = 25
+LIMITE_MAXIMO = 100
+
+_REGEX_COMPETENCIA = re.compile(r'^(\d{1,2})[/-](\d{4})$')
+_REGEX_NUMERO_FORMATADO = re.compile(r'^[\d.\-/]+$')
+
+
+def _competencia(mes, ano):
+    # 13º salário fica em dezembro
+    return date(ano, min(mes, 12), 1)
+
+
+def _termo_competencia(competencia):
+    """'MMAAAA' numa palavra só: '05/2026' não casa com um '05' solto no CPF."""
+    return f"C{competencia.month:02d}{competencia.year}"
+
+
+def _documentos_contracheque(cc):
+    if cc.arquivo:
+        yield 'arquivo', _competencia(cc.mes, cc.ano), f"Contracheque {cc.get_mes_display()}/{cc.ano}"
+
+
+def _documentos_ponto(status):
+    if status.arquivo:
+        yield 'arquivo', _competencia(status.mes, status.ano), f"Folha de ponto {status.mes:02d}/{status.ano}"
+
+
+def _documentos_ferias(ferias):
+    competencia = ferias.data_inicio.replace(day=1)
+    for campo in ('arquivo_aviso', 'arquivo_recibo', 'aviso_assinado', 'recibo_assinado'):
+        if getattr(ferias, campo):
+            rotulo = Ferias._meta.get_field(campo).verbose_name
+            yield campo, competencia, f"{rotulo} - {ferias.periodo_aquisitivo}"
+
+
+def _documentos_atestado(atestado):
+    # O motivo (CID) fica de fora do índice de propósito
+    if atestado.arquivo:
+        yield 'arquivo', atestado.data_inicio.replace(day=1), f"{atestado.get_tipo_display()} {atestado.data_inicio:%d/%m/%Y}"
+
+
+# tipo -> (model, gerador de (campo, competência, título))
+FONTES = {
+    'contracheque': (Contracheque, _documentos_contracheque),
+    'ponto': (FolhaPontoStatus, _documentos_ponto),
+    'ferias': (Ferias, _documentos_ferias),
+    'atestado': (Atestado, _documentos_atestado),
+}
+TIPO_POR_MODEL = {model: tipo for tipo, (model, _) in FONTES.items()}
+
+
+def texto_funcionario(funcionario):
+    return normalizar_texto(f"{funcionario.nome_completo} {funcionario.matricula or ''} {somente_digitos(funcionario.cpf)}")
+
+
+def _entradas(instancia, funcionario=None):
+    tipo = TIPO_POR_MODEL[type(instancia)]
+    funcionario = funcionario or instancia.funcionario
+    identificacao = texto_funcionario(funcionario)
+    rotulo = dict(DocumentoIndice.TIPO_CHOICES)[tipo]
+    return [
+        DocumentoIndice(
+            tipo=tipo, objeto_id=instancia.pk, campo=campo, funcionario_id=funcionario.pk,
+            competencia=competencia, titulo=titulo[:150],
+            texto_busca=identificacao + normalizar_texto(f"{rotulo} {titulo} {_termo_competencia(competencia)}"),
+        )
+        for campo, competencia, titulo in FONTES[tipo][1](instancia)
+    ]
+
+
+def indexar(instancia):
+    tipo = TIPO_POR_MODEL[type(instancia)]
+    with transaction.atomic():
+        DocumentoIndice.objects.filter(tipo=tipo, objeto_id=instancia.pk).delete()
+        DocumentoIndice.objects.bulk_create(_entradas(instancia))
+
+
+def remover(instancia):
+    DocumentoIndice.objects.filter(tipo=TIPO_POR_MODEL[type(instancia)], objeto_id=instancia.pk).delete()
+
+
+def reindexar_funcionario(funcionario):
+    """Refaz os documentos do funcionário se nome, matrícula ou CPF mudaram (senão é um SELECT só)."""
+    identificacao = texto_funcionario(funcionario)
+    documentos = DocumentoIndice.objects.filter(funcionario=funcionario)
+    if not documentos.exclude(texto_busca__startswith=identificacao).exists():
+        return
+
+    entradas = []
+    for model, _ in FONTES.values():
+        for instancia in model.objects.filter(funcionario=funcionario):
+            entradas.extend(_entradas(instancia, funcionario))
+    with transaction.atomic():
+        documentos.delete()
+        DocumentoIndice.objects.bulk_create(entradas, batch_size=1000)
+
+
+def reindexar_contracheques_competencia(mes, ano):
+    """Depois do upsert em lote da importação (bulk_create não dispara post_save)."""
+    contracheques = list(Contracheque.objects.filter(mes=mes, ano=ano).select_related('funcionario'))
+    with transaction.atomic():
+        DocumentoIndice.objects.filter(tipo='contracheque', objeto_id__in=[cc.pk for cc in contracheques]).delete()
+        DocumentoIndice.objects.bulk_create(
+            [entrada for cc in contracheques for entrada in _entradas(cc)], batch_size=1000
+        )
+
+
+def reindexar(tipos=None, tamanho_lote=1000):
+    """Reconstrói o índice dos tipos informados (todos por padrão). Retorna quantos documentos."""
+    total = 0
+    for tipo in tipos or FONTES:
+        model, _ = FONTES[tipo]
+        with transaction.atomic():
+            DocumentoIndice.objects.filter(tipo=tipo).delete()
+            lote = []
+            for instancia in model.objects.select_related('funcionario').iterator(chunk_size=tamanho_lote):
+                lote.extend(_entradas(instancia))
+                if len(lote) >= tamanho_lote:
+                    DocumentoIndice.objects.bulk_create(lote)
+                    total += len(lote)
+                    lote = []
+            DocumentoIndice.objects.bulk_create(lote)
+            total += len(lote)
+    return total
+
+
+# --- Busca ---
+
+def _termos(consulta):
+    termos = []
+    for palavra in (consulta or '').split():
+        competencia = _REGEX_COMPETENCIA.match(palavra)
+        if competencia and 1 <= int(competencia.group(1)) <= 13:
+            termos.append(_termo_competencia(_competencia(int(competencia.group(1)), int(competencia.group(2)))))
+        elif _REGEX_NUMERO_FORMATADO.match(palavra):
+            # CPF/matrícula digitados com pontuação
+            termos.append(somente_digitos(palavra) or palavra)
+        else:
+            termos.extend(normalizar_texto(palavra).split())
+    return [termo for termo in termos if termo]
+
+
+def _ler_cursor(cursor):
+    competencia, _, documento_id = cursor.partition('_')
+    return date.fromisoformat(competencia), int(documento_id)
+
+
+def buscar(consulta='', tipo=None, ano=None, funcionario_id=None, cursor=None, limite=LIMITE_PADRAO):
+    """
+    Página de documentos (mais recentes primeiro) e o cursor da próxima página
+    (None na última). Paginação por chave (competência, id): o custo não cresce
+    com o número da página. Cursor inválido levanta ValueError.
+    """
+    documentos = DocumentoIndice.objects.select_related('funcionario').only(
+        'tipo', 'objeto_id', 'campo', 'competencia', 'titulo',
+        'funcionario', 'funcionario__nome_completo', 'funcionario__matricula',
+    )
+    for termo in _termos(consulta):
+        documentos = documentos.filter(texto_busca__contains=termo)
+    if tipo:
+        documentos = documentos.filter(tipo=tipo)
+    if ano:
+        documentos = documentos.filter(competencia__year=ano)
+    if funcionario_id:
+        documentos = documentos.filter(funcionario_id=funcionario_id)
+    if cursor:
+        competencia, documento_id = _ler_cursor(cursor)
+        documentos = documentos.filter(Q(competencia__lt=competencia) | Q(competencia=competencia, id__lt=documento_id))
+
+    limite = max(1, min(limite, LIMITE_MAXIMO))
+    pagina = list(documentos.order_by('-competencia', '-id')[:limite + 1])
+    proximo = None
+    if len(pagina) > limite:
+        pagina = pagina[:limite]
+        proximo = f"{pagina[-1].competencia.isoformat()}_{pagina[-1].pk}"
+    return pagina, proximo
+
+
+def urls_documentos(documentos):
+    """{documento.pk: url do arquivo}, com uma consulta por tipo presente na página."""
+    por_tipo = {}
+    for documento in documentos:
+        por_tipo.setdefault(documento.tipo, []).append(documento)
+
+    urls = {}
+    for tipo, lista in por_tipo.items():
+        model, _ = FONTES[tipo]
+        instancias = model.objects.in_bulk({documento.objeto_id for documento in lista})
+        for documento in lista:
+            instancia = instancias.get(documento.objeto_id)
+            arquivo = getattr(instancia, documento.campo, None) if instancia else None
+            try:
+                urls[documento.pk] = arquivo.url if arquivo else None
+            except ValueError:
+                urls[documento.pk] = None
+    return urls
@@ -0,0 +1,184 @@
+import io
+from functools import lru_cache
+
+from pypdf import PdfReader
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+# ==========================================
+# LAYOUT DOS CONTRACHEQUES (ÂNCORAS + OVERLAYS)
+# ==========================================
+# As posições de "DATA DO RECEBIMENTO" e da linha de "ASSINATURA" são lidas
+# com o pdfplumber uma única vez (na divisão da folha ou no upload individual)
+# e gravadas em Contracheque.layout_pdf. Carimbar a data e assinar passam a ser
+# só um merge com um overlay pronto, sem busca de texto.
+# Os overlays são gerados a partir dos parâmetros (texto + geometria) e ficam
+# em cache no processo: numa folha inteira a data e a posição se repetem.
+# Sem imports do Django: também roda nos workers da divisão.
+
+# Posição padrão da assinatura quando o texto não é encontrado na página
+ASSINATURA_PADRAO = {'x': 400, 'y': 50, 'largura': 250}
+
+
+def _caixa(palavra):
+    return {chave: float(palavra[chave]) for chave in ('x0', 'x1', 'top', 'bottom')}
+
+
+def _ancora_recebimento(p_page):
+    palavras_alvo = p_page.search("DATA DO RECEBIMENTO") or \
+                    p_page.search("DATA RECEBIMENTO") or \
+                    p_page.search("RECEBIMENTO")
+    if not palavras_alvo:
+        return None
+
+    ancora = _caixa(palavras_alvo[0])
+    palavras_limite = p_page.search("Declaro ter recebido") or \
+                      p_page.search("Declaro")
+    ancora['limite_top'] = float(palavras_limite[0]['bottom']) if palavras_limite else ancora['top'] - 40
+    return ancora
+
+
+def _ancora_assinatura(p_page, altura_pagina):
+    """Linha de assinatura do empregado (ou uma área proporcional ao texto, se não houver linha)."""
+    palavras = p_page.search("ASSINATURA") or \
+               p_page.search("EMPREGADO")
+    if not palavras:
+        return dict(ASSINATURA_PADRAO)
+
+    target = palavras[-1]
+    centro_texto = (target['x0'] + target['x1']) / 2
+
+    limite_busca_inferior = target['top'] - 25
+    limite_busca_superior = target['top']
+
+    for linha in p_page.lines:
+        if abs(linha['top'] - linha['bottom']) < 2:
+            if limite_busca_inferior < linha['bottom'] < limite_busca_superior:
+                if linha['x0'] < centro_texto < linha['x1']:
+                    return {
+                        'x': float(linha['x0']),
+                        'y': altura_pagina - float(linha['bottom']),
+                        'largura': float(linha['x1'] - linha['x0']),
+                    }
+
+    largura_final = max(200, (target['x1'] - target['x0']) * 3)
+    return {
+        'x': float(centro_texto - (largura_final / 2)),
+        'y': altura_pagina - float(target['bottom']),
+        'largura': float(largura_final),
+    }
+
+
+def extrair_ancoras(p_page, altura_pagina):
+    """Âncoras de uma página do pdfplumber, prontas para guardar em JSON."""
+    return {
+        'altura': float(altura_pagina),
+        'recebimento': _ancora_recebimento(p_page),
+        'assinatura': _ancora_assinatura(p_page, float(altura_pagina)),
+    }
+
+
+def extrair_layout(plumber_pdf, reader):
+    """Lista de âncoras por página de um PDF já aberto nas duas bibliotecas."""
+    return [
+        extrair_ancoras(plumber_pdf.pages[i], float(page.mediabox.height))
+        for i, page in enumerate(reader.pages)
+    ]
+
+
+# --- Overlays (gerados uma vez por combinação de parâmetros) ---
+
+def _desenhar(funcao, *args):
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=A4)
+    funcao(can, *args)
+    can.save()
+    return packet.getvalue()
+
+
+def _desenhar_data_recebimento(can, x0, x1, top, bottom, limite_top, altura_pagina, data_str):
+    rect_y = altura_pagina - bottom
+    rect_h = bottom - limite_top
+    rect_x = x0 - 20
+    rect_w = (x1 - x0) + 40
+    tamanho_fonte_data = max(12, min(18, (bottom - top) * 1.8))
+
+    can.setFillColor(colors.white)
+    can.rect(rect_x, rect_y - 2, rect_w, rect_h + 4, stroke=0, fill=1)
+
+    can.setFillColor(colors.black)
+    can.setFont("Helvetica-Bold", tamanho_fonte_data)
+    can.drawString(x0, rect_y + 10, data_str)
+
+    can.setLineWidth(0.5)
+    can.line(rect_x, rect_y + 8, rect_x + rect_w, rect_y + 8)
+    can.setFont("Helvetica", 6)
+    can.drawCentredString(rect_x + (rect_w / 2), rect_y, "DATA DO RECEBIMENTO")
+
+
+def _desenhar_data_simples(can, pos_x, pos_y, data_str):
+    can.setFont("Helvetica", 10)
+    can.drawString(pos_x, pos_y, data_str)
+    can.setFillColorRGB(1, 0, 0)
+    can.circle(pos_x, pos_y, 2, fill=1)
+
+
+def _desenhar_assinatura(can, pos_x, pos_y_base, largura_final, nome_assinatura):
+    rect_h = 32
+    rect_y = pos_y_base - 2
+
+    can.setFillColor(colors.white)
+    can.rect(pos_x, rect_y, largura_final, rect_h, stroke=0, fill=1)
+
+    font_size = 10
+    nome_width = can.stringWidth(nome_assinatura, "Helvetica-Bold", font_size)
+    if nome_width > largura_final:
+        font_size = font_size * (largura_final / nome_width) * 0.95
+
+    can.setFillColor(colors.black)
+    can.setFont("Helvetica-Bold", font_size)
+    centro_area = pos_x + (largura_final / 2)
+    can.drawCentredString(centro_area, rect_y + 12, nome_assinatura)
+
+    can.setLineWidth(0.5)
+    y_linha = rect_y + 10
+    can.line(pos_x, y_linha, pos_x + largura_final, y_linha)
+
+    can.setFont("Helvetica", 6)
+    can.drawCentredString(centro_area, rect_y + 2, "ASSINATURA")
+
+
+@lru_cache(maxsize=512)
+def _overlay(funcao, *args):
+    return _desenhar(funcao, *args)
+
+
+def _aplicar(page, overlay_bytes):
+    page.merge_page(PdfReader(io.BytesIO(overlay_bytes)).pages[0])
+
+
+def carimbar_data_recebimento(page, ancoras, data_recebimento):
+    """Cobre a área de 'DATA DO RECEBIMENTO' e escreve a data. Sem âncora, não faz nada."""
+    ancora = ancoras.get('recebimento')
+    if not ancora:
+        return
+    _aplicar(page, _overlay(
+        _desenhar_data_recebimento, ancora['x0'], ancora['x1'], ancora['top'], ancora['bottom'],
+        ancora['limite_top'], ancoras['altura'], data_recebimento.strftime("%d/%m/%Y"),
+    ))
+
+
+def carimbar_data_simples(page, ancoras, data_recebimento):
+    """Escreve só a data perto de 'DATA DO RECEBIMENTO' (posição padrão se não houver âncora)."""
+    ancora = ancoras.get('recebimento')
+    pos_x, pos_y = 130, 55
+    if ancora:
+        pos_x = ancora['x0'] + 15
+        pos_y = ancoras['altura'] - ancora['top'] + 12
+    _aplicar(page, _overlay(_desenhar_data_simples, pos_x, pos_y, data_recebimento.strftime("%d/%m/%Y")))
+
+
+def carimbar_assinatura(page, ancoras, nome_assinatura):
+    ancora = ancoras.get('assinatura') or ASSINATURA_PADRAO
+    _aplicar(page, _overlay(_desenhar_assinatura, ancora['x'], ancora['y'], ancora['largura'], nome_assinatura))
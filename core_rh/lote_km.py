@@ -0,0 +1,259 @@
+import io
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from . import arquivos
+from .miniaturas import enfileirar_miniatura
+from .models import ControleKM, DespesaDiversa
+from .planilha_km import gerar_planilha_km
+from .semana_km import lancamentos_da_equipe
+from .zip_stream import nome_sem_repetir
+
+# ==========================================
+# DOWNLOAD EM LOTE DE KM/DESPESAS (COORDENADOR)
+# ==========================================
+# Só os técnicos com lançamento na semana (LancamentoSemanalKM, ver semana_km)
+# têm KMs e despesas carregados, de uma vez; o valor a pagar do PDF de resumo
+# é o do lançamento semanal.
+# Cada planilha é montada num pool de processos (planilha_km, sem Django) e
+# o ZIP vai para o cliente em streaming, à medida que as planilhas ficam
+# prontas: a demora acompanha o número de núcleos, não o de técnicos.
+
+def _quantidade_processos():
+    return getattr(settings, 'RH_KM_LOTE_PROCESSOS', min(4, os.cpu_count() or 1))
+
+
+class TecnicoLote:
+    """Funcionário com os lançamentos da semana já carregados."""
+
+    def __init__(self, lancamento, kms, despesas):
+        self.lancamento = lancamento
+        self.funcionario = lancamento.funcionario
+        self.kms = kms
+        self.despesas = despesas
+
+    @property
+    def nome_arquivo(self):
+        return self.funcionario.nome_completo.strip().replace(' ', '_')
+
+    @property
+    def kms_validos(self):
+        return [k for k in self.kms if k.status != 'Rejeitado']
+
+    @property
+    def despesas_validas(self):
+        return [d for d in self.despesas if d.status != 'Rejeitado']
+
+    def valor_a_pagar(self):
+        return float(self.lancamento.valor_a_pagar)
+
+
+# --- Dados da planilha (lado do Django) ---
+
+def _itens_km(k, val_km):
+    obs_texto = k.observacao if k.observacao else ""
+    trechos = list(k.trechos.all())
+    if not trechos:
+        return [{
+            'data': k.data, 'chamado': k.numero_chamado, 'tipo': 'DESLOCAMENTO',
+            'origem': 'Registro Manual', 'destino': '-', 'km': float(k.total_km),
+            'valor': float(k.total_km) * val_km, 'obs': obs_texto, 'link': None,
+            'is_img': False, 'is_pdf': False, 'is_km': True,
+        }]
+    return [{
+        'data': k.data, 'chamado': k.numero_chamado, 'tipo': 'DESLOCAMENTO',
+        'origem': t.nome_origem if t.nome_origem else "Origem",
+        'destino': t.nome_destino if t.nome_destino else "Destino",
+        'km': float(t.km), 'valor': float(t.km) * val_km, 'obs': obs_texto,
+        'link': t.origem if t.origem and 'http' in t.origem else None,
+        'is_img': False, 'is_pdf': False, 'is_km': True,
+    } for t in trechos]
+
+
+def _item_despesa(d):
+    item = {
+        'data': d.data, 'chamado': d.numero_chamado, 'tipo': d.tipo.upper(),
+        'origem': '-', 'destino': '-', 'km': 0.0,
+        'valor': float(d.valor or 0), 'obs': d.especificacao or '', 'link': None,
+        'is_img': bool(d.comprovante), 'is_pdf': False, 'is_km': False,
+        'miniatura': None, 'erro_miniatura': None,
+    }
+    if not d.comprovante:
+        return item
+
+    try: item['link'] = d.comprovante.url
+    except Exception: pass
+    item['is_pdf'] = arquivos.extensao(d.comprovante) == 'pdf'
+    if d.miniatura:
+        # Só a miniatura gerada no upload (ver miniaturas.py); o original nunca é aberto aqui
+        try:
+            item['miniatura'] = arquivos.ler_bytes(d.miniatura)
+        except Exception as e:
+            print(f"Erro ao ler miniatura {d.miniatura.name}: {e}")
+            item['erro_miniatura'] = str(e)
+    elif not d.hash_comprovante:
+        # Ainda sem miniatura (upload recente ou registro antigo): fica para a próxima exportação.
+        # Com hash e sem miniatura o comprovante não converte; não adianta repetir.
+        enfileirar_miniatura(d.pk)
+    return item
+
+
+def dados_planilha_km(funcionario, dt_inicio, dt_fim, kms, despesas):
+    """Tudo que planilha_km.montar_planilha_km precisa, em tipos simples (vai para outro processo)."""
+    val_km = float(funcionario.valor_km) if funcionario.valor_km else 0.0
+    itens = [item for k in kms for item in _itens_km(k, val_km)]
+    itens.extend(_item_despesa(d) for d in despesas)
+    itens.sort(key=lambda x: x['data'])
+    return {
+        'funcionario': {
+            campo: getattr(funcionario, campo)
+            for campo in ('nome_completo', 'endereco', 'bairro', 'tipo_veiculo', 'banco', 'agencia', 'conta', 'chave_pix')
+        },
+        'dt_inicio': dt_inicio,
+        'dt_fim': dt_fim,
+        'itens': itens,
+    }
+
+
+def lancamentos_semana(funcionarios, dt_inicio, dt_fim):
+    """({funcionario_id: [ControleKM]}, {funcionario_id: [DespesaDiversa]}) em três consultas no total."""
+    kms = defaultdict(list)
+    for k in (ControleKM.objects.filter(funcionario__in=funcionarios, data__range=[dt_inicio, dt_fim])
+              .prefetch_related('trechos').order_by('data', 'id')):
+        kms[k.funcionario_id].append(k)
+    despesas = defaultdict(list)
+    for d in (DespesaDiversa.objects.filter(funcionario__in=funcionarios, data__range=[dt_inicio, dt_fim])
+              .order_by('data', 'id')):
+        despesas[d.funcionario_id].append(d)
+    return kms, despesas
+
+
+def preparar_lote_km(equipe, dt_inicio, dt_fim):
+    """Técnicos da equipe com algum lançamento não rejeitado na semana."""
+    lancamentos = lancamentos_da_equipe(equipe, dt_inicio)
+    kms, despesas = lancamentos_semana([l.funcionario for l in lancamentos], dt_inicio, dt_fim)
+    lote = [TecnicoLote(l, kms[l.funcionario_id], despesas[l.funcionario_id]) for l in lancamentos]
+    return [tecnico for tecnico in lote if tecnico.kms_validos or tecnico.despesas_validas]
+
+
+# --- PDF de resumo ---
+
+def pdf_resumo_lote(equipe, dt_inicio, dt_fim, lote):
+    pdf_buffer = io.BytesIO()
+    doc = SimpleDocTemplate(pdf_buffer, pagesize=landscape(A4), rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
+    styles = getSampleStyleSheet()
+    elements = [
+        Paragraph(f"Resumo de Pagamento - {equipe.nome}", styles['Title']),
+        Paragraph(f"Semana: {dt_inicio.strftime('%d/%m')} a {dt_fim.strftime('%d/%m/%Y')}", styles['Normal']),
+        Spacer(1, 20),
+    ]
+
+    data_pdf = [['Técnico', 'Banco', 'Ag/Conta', 'PIX', 'Total a Pagar']]
+    total_geral_pdf = 0.0
+    for tecnico in lote:
+        func = tecnico.funcionario
+        valor_final = tecnico.valor_a_pagar()
+        if valor_final > 0:
+            data_pdf.append([
+                func.nome_completo,
+                func.banco or "-",
+                f"{func.agencia}/{func.conta}",
+                func.chave_pix or "-",
+                f"R$ {valor_final:,.2f}"
+            ])
+            total_geral_pdf += valor_final
+    data_pdf.append(['', '', '', 'TOTAL GERAL:', f"R$ {total_geral_pdf:,.2f}"])
+
+    t = Table(data_pdf, colWidths=[200, 100, 150, 150, 100])
+    t.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    elements.append(t)
+    doc.build(elements)
+    return pdf_buffer.getvalue()
+
+
+# --- Planilhas no pool e entradas do ZIP ---
+
+def _gerar_planilhas(lote, dt_inicio, dt_fim):
+    """Gera (técnico, bytes do xlsx) conforme as planilhas forem ficando prontas."""
+    processos = min(_quantidade_processos(), len(lote))
+
+    if processos <= 1:
+        for tecnico in lote:
+            try:
+                dados = dados_planilha_km(tecnico.funcionario, dt_inicio, dt_fim, tecnico.kms, tecnico.despesas)
+                planilha = gerar_planilha_km(dados)
+            except Exception as e:
+                print(f"Erro ao gerar planilha de {tecnico.funcionario.nome_completo}: {e}")
+                continue
+            yield tecnico, planilha
+        return
+
+    # "spawn": os workers não herdam conexões de banco nem threads do gunicorn
+    pool = ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('spawn'))
+    pendentes = iter(lote)
+    futuros = {}
+
+    def _enviar_proximo():
+        # Os dados (com as miniaturas) só são montados quando há vaga na janela
+        for tecnico in pendentes:
+            try:
+                dados = dados_planilha_km(tecnico.funcionario, dt_inicio, dt_fim, tecnico.kms, tecnico.despesas)
+            except Exception as e:
+                print(f"Erro ao gerar planilha de {tecnico.funcionario.nome_completo}: {e}")
+                continue
+            futuros[pool.submit(gerar_planilha_km, dados)] = tecnico
+            return
+
+    try:
+        # No máximo 2 planilhas por processo na fila: a memória não cresce com o tamanho da equipe
+        for _ in range(2 * processos):
+            _enviar_proximo()
+        while futuros:
+            prontos, _ = wait(futuros, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                tecnico = futuros.pop(futuro)
+                _enviar_proximo()
+                try:
+                    planilha = futuro.result()
+                except Exception as e:
+                    print(f"Erro ao gerar planilha de {tecnico.funcionario.nome_completo}: {e}")
+                    continue
+                yield tecnico, planilha
+    finally:
+        # Download interrompido: não espera as planilhas que nem começaram
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _abridor_bytes(conteudo):
+    return lambda: io.BytesIO(conteudo)
+
+
+def entradas_zip_lote_km(equipe, dt_inicio, dt_fim, semana, lote):
+    """(nome no ZIP, abrir) do lote, no formato de gerar_zip_streaming."""
+    nome_filial = equipe.nome.replace('Campo ', '').strip()
+    yield f"RESUMO_PAGAMENTO_{nome_filial}.pdf", _abridor_bytes(pdf_resumo_lote(equipe, dt_inicio, dt_fim, lote))
+
+    planilhas = set()
+    for tecnico, planilha in _gerar_planilhas(lote, dt_inicio, dt_fim):
+        nome = nome_sem_repetir(f"Planilhas/{tecnico.nome_arquivo}_Semana{semana}.xlsx", planilhas, tecnico.funcionario.id)
+        yield nome, _abridor_bytes(planilha)
+        # Os originais também vão numa pasta, para facilitar a auditoria
+        for d in tecnico.despesas_validas:
+            if d.comprovante:
+                ext = d.comprovante.name.split('.')[-1]
+                yield f"Comprovantes/{tecnico.nome_arquivo}_{d.tipo}_{d.id}.{ext}", arquivos.abridor(d.comprovante)
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core_rh.models import LancamentoSemanalKM
+from core_rh.semana_km import inicio_semana, recalcular_semanas, semanas_com_lancamentos
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula os lançamentos semanais de KM/despesas por técnico "
+        "(ex: depois de cargas ou correções direto no banco)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help="Só as semanas a partir desta data (AAAA-MM-DD)")
+
+    def handle(self, *args, **options):
+        desde = None
+        if options['desde']:
+            try:
+                desde = inicio_semana(datetime.strptime(options['desde'], '%Y-%m-%d').date())
+            except ValueError:
+                raise CommandError("Data inválida em --desde (use AAAA-MM-DD).")
+
+        semanas = semanas_com_lancamentos(desde)
+        antigas = LancamentoSemanalKM.objects.all()
+        if desde:
+            antigas = antigas.filter(inicio__gte=desde)
+        # Linhas que já existem entram no recálculo: sem lançamentos, são apagadas
+        for funcionario_id, inicio in antigas.values_list('funcionario_id', 'inicio'):
+            semanas[inicio].add(funcionario_id)
+        for inicio in sorted(semanas):
+            recalcular_semanas(semanas[inicio], inicio)
+
+        self.stdout.write(self.style.SUCCESS(f"{len(semanas)} semana(s) recalculada(s)."))
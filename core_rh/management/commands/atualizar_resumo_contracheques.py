@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core_rh.contracheque_service import atualizar_resumo_competencia
+from core_rh.models import Contracheque, ResumoContracheque
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula o resumo de contracheques por competência e equipe "
+        "(ex: depois de transferências de equipe)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ano', type=int, help="Só as competências deste ano")
+
+    def handle(self, *args, **options):
+        competencias = Contracheque.objects.values_list('mes', 'ano').distinct()
+        antigas = ResumoContracheque.objects.all()
+        if options['ano']:
+            competencias = competencias.filter(ano=options['ano'])
+            antigas = antigas.filter(ano=options['ano'])
+
+        competencias = sorted(set(competencias))
+        # Competências que não têm mais contracheques
+        for mes, ano in set(antigas.values_list('mes', 'ano')) - set(competencias):
+            ResumoContracheque.objects.filter(mes=mes, ano=ano).delete()
+        for mes, ano in competencias:
+            atualizar_resumo_competencia(mes, ano)
+
+        self.stdout.write(self.style.SUCCESS(f"{len(competencias)} competência(s) recalculada(s)."))
@@ -0,0 +1,117 @@
+import random
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from core_rh.identificacao import IndiceFuncionarios, normalizar_texto
+
+PRENOMES = [
+    'ANA', 'JOÃO', 'JOSÉ', 'MARIA', 'ANTÔNIO', 'FRANCISCO', 'LUCAS', 'GABRIEL', 'JÚLIA', 'LETÍCIA',
+    'MÁRCIO', 'PAULO', 'CARLOS', 'PEDRO', 'RAFAEL', 'BEATRIZ', 'FÁBIO', 'CAMILA', 'SÉRGIO', 'LUÍS',
+]
+SOBRENOMES = [
+    'SILVA', 'SANTOS', 'OLIVEIRA', 'SOUZA', 'RODRIGUES', 'FERREIRA', 'ALVES', 'PEREIRA', 'LIMA', 'GOMES',
+    'CONCEIÇÃO', 'ARAÚJO', 'RIBEIRO', 'MARTINS', 'CARVALHO', 'ROCHA', 'DIAS', 'NASCIMENTO', 'ANDRADE', 'MOREIRA',
+    'CORRÊA', 'BRANDÃO', 'FALCÃO', 'GALVÃO', 'DA COSTA', 'DE JESUS', 'DOS REIS', 'MACHADO', 'TEIXEIRA', 'BARBOSA',
+]
+CABECALHO = (
+    "DIVIDATA PROCESSAMENTO DE DADOS LTDA CNPJ 20.914.172/0001-88\n"
+    "RECIBO DE PAGAMENTO DE SALÁRIO Referência: {mes:02d}/2026\n"
+)
+RODAPE = (
+    "SALÁRIO BASE 3.450,00 INSS 310,50 IRRF 45,20 FGTS 276,00\n"
+    "Declaro ter recebido a importância líquida discriminada neste recibo.\n"
+    "DATA DO RECEBIMENTO ____/____/______ ASSINATURA DO EMPREGADO\n"
+)
+
+
+def _gerar_cpf(rnd):
+    return ''.join(str(rnd.randint(0, 9)) for _ in range(11))
+
+
+def _formatar_cpf(cpf):
+    return f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+
+
+def _sem_acento(nome):
+    return normalizar_texto(nome).strip()
+
+
+def _gerar_funcionarios(rnd, quantidade):
+    """Nomes únicos; parte deles é prefixo de outro nome (ANA SILVA x ANA SILVA SOUZA)."""
+    nomes = set()
+    funcionarios = []
+    while len(funcionarios) < quantidade:
+        nome = f"{rnd.choice(PRENOMES)} {' '.join(rnd.sample(SOBRENOMES, rnd.randint(1, 3)))}"
+        if len(funcionarios) % 5 == 4:
+            # Nome mais longo que contém um nome já cadastrado
+            nome = f"{rnd.choice(funcionarios).nome_completo} {rnd.choice(SOBRENOMES)}"
+        if nome in nomes:
+            continue
+        nomes.add(nome)
+        funcionarios.append(SimpleNamespace(
+            id=len(funcionarios) + 1, nome_completo=nome.title(), cpf=_gerar_cpf(rnd),
+            matricula=str(1000 + len(funcionarios)),
+        ))
+    return funcionarios
+
+
+def _gerar_paginas(rnd, funcionarios, quantidade, com_cpf):
+    paginas = []
+    for _ in range(quantidade):
+        func = rnd.choice(funcionarios)
+        # Metade das folhas vem sem acento, como no export do sistema de folha
+        nome = func.nome_completo.upper() if rnd.random() < 0.5 else _sem_acento(func.nome_completo)
+        linha = f"Empregado: {nome}  Matrícula: {func.matricula}"
+        if com_cpf:
+            linha += f"  CPF: {_formatar_cpf(func.cpf)}"
+        paginas.append((CABECALHO.format(mes=rnd.randint(1, 12)) + linha + "\n" + RODAPE, func.id))
+    return paginas
+
+
+def _busca_linear(funcionarios, texto):
+    """Algoritmo anterior: primeiro nome contido no texto."""
+    texto_upper = texto.upper()
+    for func in funcionarios:
+        nome_busca = func.nome_completo.strip().upper()
+        if nome_busca and nome_busca in texto_upper:
+            return func
+    return None
+
+
+class Command(BaseCommand):
+    help = "Compara a busca linear de nomes com o índice de funcionários na divisão da folha de pagamento (dados sintéticos)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--funcionarios', type=int, default=1000)
+        parser.add_argument('--paginas', type=int, default=1000)
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument('--com-cpf', action='store_true', help="Imprime o CPF nas páginas geradas")
+
+    def _medir(self, titulo, paginas, identificar):
+        acertos = 0
+        inicio = time.perf_counter()
+        for texto, esperado in paginas:
+            func = identificar(texto)
+            if func is not None and func.id == esperado:
+                acertos += 1
+        duracao = time.perf_counter() - inicio
+        self.stdout.write(
+            f"{titulo:<22} {duracao:8.3f}s  {len(paginas) / duracao:10.0f} pág/s  "
+            f"acerto {acertos}/{len(paginas)} ({100 * acertos / len(paginas):.1f}%)"
+        )
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['semente'])
+        funcionarios = _gerar_funcionarios(rnd, options['funcionarios'])
+        paginas = _gerar_paginas(rnd, funcionarios, options['paginas'], options['com_cpf'])
+
+        self.stdout.write(f"{len(funcionarios)} funcionários, {len(paginas)} páginas")
+
+        inicio = time.perf_counter()
+        indice = IndiceFuncionarios(funcionarios)
+        self.stdout.write(f"{'Montagem do índice':<22} {time.perf_counter() - inicio:8.3f}s")
+
+        self._medir('Busca linear', paginas, lambda texto: _busca_linear(funcionarios, texto))
+        self._medir('Índice (Aho-Corasick)', paginas, lambda texto: indice.identificar(texto)[0])
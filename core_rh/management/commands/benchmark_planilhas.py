@@ -0,0 +1,102 @@
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from openpyxl import Workbook
+from openpyxl.styles import Font, PatternFill
+
+from core_rh.planilhas import BORDA_FINA, FORMATO_MOEDA, Celula, Planilha
+
+ESTILOS = {
+    'bench_cabecalho': dict(font=Font(bold=True, color="FFFFFF"), fill=PatternFill("solid", fgColor="4F81BD"), border=BORDA_FINA),
+    'bench_texto': dict(border=BORDA_FINA),
+    'bench_moeda': dict(border=BORDA_FINA, number_format=FORMATO_MOEDA),
+}
+CABECALHO = ['Data', 'Filial', 'Técnico', 'Chamado', 'Tipo', 'Origem', 'Destino', 'KM', 'Valor']
+FILIAIS = ['Matriz', 'Campo Norte', 'Campo Sul', 'Campo Leste', 'Campo Oeste']
+TIPOS = ['DESLOCAMENTO', 'PEDAGIO', 'ALIMENTACAO', 'ESTACIONAMENTO']
+
+
+def _linhas(quantidade, semente):
+    """Linhas sintéticas no formato do relatório de KM/despesas."""
+    rnd = random.Random(semente)
+    inicio = date(2026, 1, 1)
+    for i in range(quantidade):
+        km = round(rnd.uniform(1, 400), 1)
+        yield [
+            (inicio + timedelta(days=i % 365)).strftime('%d/%m/%Y'), rnd.choice(FILIAIS),
+            f"Tecnico {rnd.randint(1, 300)}", str(100000 + i), rnd.choice(TIPOS),
+            f"Rua {rnd.randint(1, 999)}, Bairro {rnd.randint(1, 80)}", f"Cliente {rnd.randint(1, 5000)}",
+            km, round(km * 0.9, 2),
+        ]
+
+
+def _streaming(quantidade, semente, destino):
+    planilha = Planilha(ESTILOS)
+
+    def preencher(ws):
+        ws.linha(*[Celula(c, 'bench_cabecalho') for c in CABECALHO])
+        for valores in _linhas(quantidade, semente):
+            ws.linha(*[Celula(v, 'bench_moeda' if isinstance(v, float) else 'bench_texto') for v in valores])
+
+    planilha.aba_ajustada('Relatório', preencher)
+    planilha.salvar(destino)
+
+
+def _em_memoria(quantidade, semente, destino):
+    """Como era antes: workbook comum, estilo célula a célula e larguras varrendo todas as células."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(CABECALHO)
+    for cell in ws[1]:
+        cell.font = ESTILOS['bench_cabecalho']['font']
+        cell.fill = ESTILOS['bench_cabecalho']['fill']
+        cell.border = BORDA_FINA
+    for valores in _linhas(quantidade, semente):
+        ws.append(valores)
+        for cell in ws[ws.max_row]:
+            cell.border = BORDA_FINA
+            if isinstance(cell.value, float):
+                cell.number_format = FORMATO_MOEDA
+    for coluna in ws.columns:
+        maior = max(len(str(cell.value)) for cell in coluna if cell.value)
+        ws.column_dimensions[coluna[0].column_letter].width = min(max((maior + 2) * 1.1, 12), 60)
+    wb.save(destino)
+
+
+MOTORES = {'streaming': _streaming, 'memoria': _em_memoria}
+
+
+class Command(BaseCommand):
+    help = "Mede tempo e pico de memória (tracemalloc) das planilhas Excel em streaming com N linhas (dados sintéticos)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, nargs='+', default=[1000, 5000, 20000])
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument('--comparar', action='store_true', help="Mede também o workbook em memória (modo antigo)")
+
+    def _medir(self, motor, quantidade, semente):
+        with tempfile.TemporaryFile() as destino:
+            tracemalloc.start()
+            inicio = time.perf_counter()
+            try:
+                MOTORES[motor](quantidade, semente, destino)
+                duracao = time.perf_counter() - inicio
+                _atual, pico = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            tamanho = destino.tell()
+        self.stdout.write(
+            f"{motor:<10} {quantidade:>7} linhas {duracao:8.3f}s  pico {pico / 1024 / 1024:8.2f} MB  "
+            f"arquivo {tamanho / 1024:8.0f} KB"
+        )
+        return pico
+
+    def handle(self, *args, **options):
+        motores = ['streaming', 'memoria'] if options['comparar'] else ['streaming']
+        for motor in motores:
+            for quantidade in options['linhas']:
+                self._medir(motor, quantidade, options['semente'])
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core_rh.contracheque_service import carimbar_contracheque, carimbos_livres
+from core_rh.models import Contracheque
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera os PDFs assinados que ficaram na fila (ou travados) e, opcionalmente, os que falharam. "
+        "Rodar no cron: pega também as novas tentativas vencidas que se perderam num restart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reprocessar-falhas', action='store_true',
+                            help="Devolve para a fila os contracheques com status Falhou antes de processar")
+
+    def handle(self, *args, **options):
+        if options['reprocessar_falhas']:
+            total = Contracheque.objects.filter(status_carimbo='Falhou').update(
+                status_carimbo='Pendente', tentativas_carimbo=0, erro_carimbo='', proxima_tentativa_carimbo=None
+            )
+            self.stdout.write(f"{total} falha(s) devolvida(s) para a fila.")
+
+        # Pendentes com a espera da nova tentativa ainda correndo ficam para a próxima rodada
+        ids = list(Contracheque.objects.filter(carimbos_livres()).values_list('pk', flat=True))
+
+        ok = sum(1 for contracheque_id in ids if carimbar_contracheque(contracheque_id))
+        self.stdout.write(self.style.SUCCESS(f"{ok} de {len(ids)} PDF(s) assinado(s) gerado(s)."))
@@ -0,0 +1,62 @@
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from core_rh import arquivos
+from core_rh.compactacao_pdf import compactar_pdf
+from core_rh.models import Contracheque
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompacta os PDFs de contracheques já gravados (só recursos usados pela página, "
+        "objetos repetidos unificados e conteúdo comprimido). Só troca o arquivo se ficar menor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ano', type=int)
+        parser.add_argument('--mes', type=int)
+        parser.add_argument('--dry-run', action='store_true', help="Só mede a economia, sem gravar")
+
+    def handle(self, *args, **options):
+        contracheques = Contracheque.objects.exclude(arquivo='').exclude(
+            # Assinatura em andamento: o arquivo vai ser trocado pela tarefa do carimbo
+            status_carimbo__in=['Pendente', 'Processando']
+        )
+        if options['ano']:
+            contracheques = contracheques.filter(ano=options['ano'])
+        if options['mes']:
+            contracheques = contracheques.filter(mes=options['mes'])
+
+        antes = depois = trocados = 0
+        for cc in contracheques.only('id', 'arquivo').iterator():
+            try:
+                conteudo = arquivos.ler_bytes(cc.arquivo)
+                compacto = compactar_pdf(conteudo)
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"  {cc.arquivo.name}: {e}"))
+                continue
+
+            antes += len(conteudo)
+            depois += len(compacto)
+            if compacto is conteudo or options['dry_run']:
+                continue
+
+            nome_antigo = cc.arquivo.name
+            storage = cc.arquivo.storage
+            # O storage gera outro nome na mesma pasta (o antigo ainda existe)
+            nome_novo = storage.save(nome_antigo, ContentFile(compacto))
+            # Só troca se ninguém mexeu no arquivo enquanto isso (novo upload, assinatura)
+            if Contracheque.objects.filter(pk=cc.pk, arquivo=nome_antigo).update(arquivo=nome_novo):
+                storage.delete(nome_antigo)
+                trocados += 1
+            else:
+                storage.delete(nome_novo)
+
+        economia = antes - depois
+        percentual = round(100 * economia / antes) if antes else 0
+        prefixo = "[dry-run] " if options['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefixo}{trocados} arquivo(s) recompactado(s): {filesizeformat(antes)} -> "
+            f"{filesizeformat(depois)} (economia de {filesizeformat(economia)}, {percentual}%)"
+        ))
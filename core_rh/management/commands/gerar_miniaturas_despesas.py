@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from core_rh.miniaturas import garantir_miniatura
+from core_rh.models import DespesaDiversa
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera as miniaturas dos comprovantes de despesa que ainda não têm "
+        "(registros anteriores à geração no upload)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refazer', action='store_true', help="Confere todas, inclusive as que já têm miniatura")
+
+    def handle(self, *args, **options):
+        despesas = DespesaDiversa.objects.exclude(comprovante='')
+        if not options['refazer']:
+            despesas = despesas.filter(miniatura='')
+
+        geradas = sem_miniatura = falhas = 0
+        for despesa_id in despesas.values_list('id', flat=True).iterator():
+            try:
+                if garantir_miniatura(despesa_id):
+                    geradas += 1
+                else:
+                    sem_miniatura += 1
+            except Exception as e:
+                falhas += 1
+                self.stdout.write(self.style.WARNING(f"  Despesa {despesa_id}: {e}"))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{geradas} miniatura(s) ok, {sem_miniatura} sem conversão possível, {falhas} falha(s)."
+        ))
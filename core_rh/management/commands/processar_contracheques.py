@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from core_rh.contracheque_service import processamento_interrompido, processar_lote_contracheques
+from core_rh.models import ProcessamentoContracheque
+
+
+class Command(BaseCommand):
+    help = (
+        "Processa importações de contracheques pendentes ou interrompidas, continuando "
+        "das faixas de páginas que ainda não foram gravadas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--id', type=int, help="Processa só este job (inclusive se terminou com erro)")
+
+    def handle(self, *args, **options):
+        if options['id']:
+            jobs = ProcessamentoContracheque.objects.filter(pk=options['id'])
+        else:
+            jobs = [
+                job for job in ProcessamentoContracheque.objects.filter(status__in=['Pendente', 'Processando'])
+                if job.status == 'Pendente' or processamento_interrompido(job)
+            ]
+
+        if not jobs:
+            self.stdout.write("Nenhum processamento pendente.")
+            return
+
+        for job in jobs:
+            self.stdout.write(f"Processamento {job.pk} ({job}): {job.paginas_processadas}/{job.total_paginas} páginas")
+            if processar_lote_contracheques(job.pk, incluir_erro=bool(options['id'])):
+                job.refresh_from_db()
+                self.stdout.write(self.style.SUCCESS(
+                    f"  Concluído: {len(job.resultado.get('sucesso', []))} enviados, "
+                    f"{len(job.resultado.get('erro', []))} não identificados"
+                ))
+            else:
+                job.refresh_from_db()
+                motivo = job.mensagem_erro or "outro processo já está cuidando dele"
+                self.stdout.write(self.style.WARNING(f"  Não processado: {motivo}"))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core_rh.indice_documentos import FONTES, reindexar
+
+
+class Command(BaseCommand):
+    help = "Reconstrói o índice de busca de documentos (contracheques, folhas de ponto, férias e atestados)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', choices=list(FONTES), action='append',
+                            help="Só este tipo (pode repetir). Padrão: todos")
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        total = reindexar(options['tipo'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} documento(s) indexado(s) em {time.perf_counter() - inicio:.1f}s."
+        ))
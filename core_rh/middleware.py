@@ -1,37 +1,91 @@
+from django.conf import settings
 from django.shortcuts import redirect
 from django.urls import reverse
 
+from .papeis import liberar_sessao, publicar_sessao
+
+# Chave da sessão com o estado de "primeiro acesso" já consultado no banco
+CHAVE_SESSAO_PRIMEIRO_ACESSO = 'core_rh_primeiro_acesso'
+
+
+def marcar_primeiro_acesso_sessao(request, pendente):
+    """Grava na sessão se o usuário logado ainda precisa trocar a senha."""
+    request.session[CHAVE_SESSAO_PRIMEIRO_ACESSO] = {
+        'user_id': request.user.pk,
+        'pendente': bool(pendente),
+    }
+
+
 class TrocaSenhaObrigatoriaMiddleware:
     """
     Middleware para forçar a troca de senha no primeiro acesso
     ou logout automático se necessário.
+
+    O funcionário só é consultado uma vez por sessão: o resultado fica em
+    request.session e é limpo por trocar_senha_obrigatoria quando a senha muda.
+    Cada request recebe `primeiro_acesso_origem` ('sessao' ou 'banco'); com
+    DEBUG ligado, o cabeçalho X-Primeiro-Acesso traz o mesmo valor, para medir
+    as consultas evitadas.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._urls_liberadas = None
+
+    @property
+    def urls_liberadas(self):
+        # Resolvidas uma única vez (na primeira requisição o urlconf já está carregado)
+        if self._urls_liberadas is None:
+            # CORREÇÃO: O nome da URL no urls.py é 'trocar_senha_obrigatoria'
+            self._urls_liberadas = frozenset([
+                reverse('trocar_senha_obrigatoria'),
+                reverse('logout'),
+                reverse('admin:logout'),
+            ])
+        return self._urls_liberadas
+
+    def _primeiro_acesso_pendente(self, request):
+        salvo = request.session.get(CHAVE_SESSAO_PRIMEIRO_ACESSO)
+        if salvo and salvo.get('user_id') == request.user.pk:
+            request.primeiro_acesso_origem = 'sessao'
+            return salvo['pendente']
+
+        # BLINDAGEM: Tenta pegar o funcionário, se não tiver (admin puro), ignora
+        try:
+            pendente = request.user.funcionario.primeiro_acesso
+        except AttributeError:
+            # O usuário logado não tem perfil de funcionário (ex: superuser puro)
+            pendente = False
+
+        request.primeiro_acesso_origem = 'banco'
+        marcar_primeiro_acesso_sessao(request, pendente)
+        return pendente
+
+    def __call__(self, request):
+        request.primeiro_acesso_origem = None
+
+        # Se não estiver na página de troca ou logout, redireciona
+        if (request.user.is_authenticated and self._primeiro_acesso_pendente(request)
+                and request.path not in self.urls_liberadas):
+            response = redirect('trocar_senha_obrigatoria')
+        else:
+            response = self.get_response(request)
+
+        if settings.DEBUG and request.primeiro_acesso_origem:
+            response['X-Primeiro-Acesso'] = request.primeiro_acesso_origem
+        return response
+
+
+class PapeisUsuarioMiddleware:
+    """
+    Publica a sessão do request para o resolvedor de papéis (core_rh.papeis),
+    que guarda ali os papéis já calculados do usuário.
     """
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        if request.user.is_authenticated:
-            # BLINDAGEM: Tenta pegar o funcionário, se não tiver (admin puro), ignora
-            try:
-                funcionario = request.user.funcionario
-                
-                # Se for o primeiro acesso, força a troca de senha
-                if funcionario.primeiro_acesso:
-                    current_url = request.path
-                    # Define as URLs permitidas (para não criar loop infinito de redirecionamento)
-                    # CORREÇÃO: O nome da URL no urls.py é 'trocar_senha_obrigatoria'
-                    url_troca = reverse('trocar_senha_obrigatoria')
-                    url_logout = reverse('logout')
-                    url_admin_logout = reverse('admin:logout') 
-                    
-                    # Se não estiver na página de troca ou logout, redireciona
-                    if current_url not in [url_troca, url_logout, url_admin_logout]:
-                        return redirect('trocar_senha_obrigatoria')
-            
-            except AttributeError:
-                # O usuário logado não tem perfil de funcionário (ex: superuser puro)
-                # Segue o fluxo normal
-                pass
-
-        response = self.get_response(request)
-        return response
\ No newline at end of file
+        token = publicar_sessao(request)
+        try:
+            return self.get_response(request)
+        finally:
+            liberar_sessao(token)
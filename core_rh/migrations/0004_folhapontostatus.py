@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-18 14:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0003_alter_peca_codigo_material'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FolhaPontoStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.PositiveSmallIntegerField(verbose_name='Mês')),
+                ('ano', models.PositiveSmallIntegerField(verbose_name='Ano')),
+                ('assinado_funcionario', models.BooleanField(default=False)),
+                ('assinado_gestor', models.BooleanField(default=False)),
+                ('arquivo', models.FileField(blank=True, null=True, upload_to='ponto_assinado/', verbose_name='Folha Assinada')),
+                ('data_assinatura_funcionario', models.DateTimeField(blank=True, null=True)),
+                ('data_assinatura_gestor', models.DateTimeField(blank=True, null=True)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_folhas', to='core_rh.funcionario')),
+            ],
+            options={
+                'verbose_name': 'Status da Folha de Ponto',
+                'verbose_name_plural': 'Status das Folhas de Ponto',
+                'ordering': ['-ano', '-mes'],
+                'unique_together': {('funcionario', 'mes', 'ano')},
+            },
+        ),
+    ]
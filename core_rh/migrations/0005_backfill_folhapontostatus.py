@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 14:10
+
+from django.db import migrations
+from django.db.models import Q
+
+
+def competencia_da_data(data):
+    # Competência vai do dia 16 ao dia 15: a partir do dia 16 já conta para o mês seguinte
+    if data.day >= 16:
+        return (1, data.year + 1) if data.month == 12 else (data.month + 1, data.year)
+    return data.month, data.year
+
+
+def preencher_status(apps, schema_editor):
+    RegistroPonto = apps.get_model('core_rh', 'RegistroPonto')
+    FolhaPontoStatus = apps.get_model('core_rh', 'FolhaPontoStatus')
+
+    situacoes = {}
+    registros = (
+        RegistroPonto.objects
+        .filter(
+            Q(assinado_funcionario=True) | Q(assinado_gestor=True)
+            | (Q(arquivo_anexo__isnull=False) & ~Q(arquivo_anexo=''))
+        )
+        .order_by('funcionario_id', 'data')
+        .values_list('funcionario_id', 'data', 'assinado_funcionario', 'assinado_gestor', 'arquivo_anexo')
+    )
+    for func_id, data, ass_func, ass_gest, arquivo in registros.iterator():
+        mes, ano = competencia_da_data(data)
+        situacao = situacoes.setdefault((func_id, mes, ano), {
+            'assinado_funcionario': False, 'assinado_gestor': False, 'arquivo': None,
+        })
+        situacao['assinado_funcionario'] |= ass_func
+        situacao['assinado_gestor'] |= ass_gest
+        # Fica o anexo mais recente da competência
+        if arquivo:
+            situacao['arquivo'] = arquivo
+
+    FolhaPontoStatus.objects.bulk_create(
+        [
+            FolhaPontoStatus(funcionario_id=func_id, mes=mes, ano=ano, **situacao)
+            for (func_id, mes, ano), situacao in situacoes.items()
+        ],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0004_folhapontostatus'),
+    ]
+
+    operations = [
+        migrations.RunPython(preencher_status, migrations.RunPython.noop),
+    ]
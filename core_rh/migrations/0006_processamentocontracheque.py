@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-18 14:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0005_backfill_folhapontostatus'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessamentoContracheque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('arquivo', models.FileField(upload_to='contracheques/lotes/%Y/%m/', verbose_name='PDF da Folha')),
+                ('mes', models.IntegerField(choices=[(1, 'Janeiro'), (2, 'Fevereiro'), (3, 'Março'), (4, 'Abril'), (5, 'Maio'), (6, 'Junho'), (7, 'Julho'), (8, 'Agosto'), (9, 'Setembro'), (10, 'Outubro'), (11, 'Novembro'), (12, 'Dezembro'), (13, '13º Salário')])),
+                ('ano', models.IntegerField()),
+                ('data_recebimento', models.DateField(blank=True, null=True)),
+                ('origem', models.CharField(choices=[('painel', 'Painel do RH'), ('admin', 'Admin')], default='painel', max_length=10)),
+                ('status', models.CharField(choices=[('Pendente', 'Pendente'), ('Processando', 'Processando'), ('Concluido', 'Concluído'), ('Erro', 'Erro')], default='Pendente', max_length=15)),
+                ('total_paginas', models.PositiveIntegerField(default=0)),
+                ('paginas_processadas', models.PositiveIntegerField(default=0)),
+                ('faixas_concluidas', models.JSONField(blank=True, default=list)),
+                ('resultado', models.JSONField(blank=True, default=dict)),
+                ('mensagem_erro', models.TextField(blank=True, default='')),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('criado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Processamento de Contracheques',
+                'verbose_name_plural': 'Processamentos de Contracheques',
+                'ordering': ['-criado_em'],
+            },
+        ),
+    ]
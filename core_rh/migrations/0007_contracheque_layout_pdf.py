@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0006_processamentocontracheque'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contracheque',
+            name='layout_pdf',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
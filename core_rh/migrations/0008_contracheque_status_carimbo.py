@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0007_contracheque_layout_pdf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contracheque',
+            name='carimbo_atualizado_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='contracheque',
+            name='chave_assinatura',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='contracheque',
+            name='erro_carimbo',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='contracheque',
+            name='status_carimbo',
+            field=models.CharField(blank=True, choices=[('', '-'), ('Pendente', 'Na fila'), ('Processando', 'Gerando PDF'), ('Concluido', 'PDF assinado'), ('Falhou', 'Falhou')], default='', max_length=12, verbose_name='PDF Assinado'),
+        ),
+        migrations.AddField(
+            model_name='contracheque',
+            name='tentativas_carimbo',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0008_contracheque_status_carimbo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contracheque',
+            name='hash_conteudo',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-18 16:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def criar_indice_trigram(apps, schema_editor):
+    # LIKE '%termo%' com índice: só no Postgres (no SQLite a busca roda sem índice)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS docindice_texto_trgm_idx "
+        "ON core_rh_documentoindice USING gin (texto_busca gin_trgm_ops)"
+    )
+
+
+def remover_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS docindice_texto_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0009_contracheque_hash_conteudo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentoIndice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('contracheque', 'Contracheque'), ('ponto', 'Folha de Ponto'), ('ferias', 'Férias'), ('atestado', 'Atestado')], max_length=20)),
+                ('objeto_id', models.PositiveBigIntegerField()),
+                ('campo', models.CharField(max_length=30)),
+                ('competencia', models.DateField()),
+                ('titulo', models.CharField(max_length=150)),
+                ('texto_busca', models.TextField()),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='documentos_indice', to='core_rh.funcionario')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-competencia', '-id'], name='docindice_competencia_idx')],
+                'unique_together': {('tipo', 'objeto_id', 'campo')},
+            },
+        ),
+        migrations.RunPython(criar_indice_trigram, remover_indice_trigram),
+    ]
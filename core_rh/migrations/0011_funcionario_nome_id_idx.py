@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 17:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0010_documentoindice'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='funcionario',
+            index=models.Index(fields=['nome_completo', 'id'], name='funcionario_nome_id_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 17:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def preencher_resumo(apps, schema_editor):
+    Contracheque = apps.get_model('core_rh', 'Contracheque')
+    ResumoContracheque = apps.get_model('core_rh', 'ResumoContracheque')
+
+    enviado = Q(arquivo__isnull=False) & ~Q(arquivo='')
+    linhas = (
+        Contracheque.objects.values('mes', 'ano', 'funcionario__equipe')
+        .annotate(
+            enviados=Count('id', filter=enviado),
+            assinados=Count('id', filter=enviado & Q(data_ciencia__isnull=False)),
+        )
+    )
+    ResumoContracheque.objects.bulk_create(
+        [
+            ResumoContracheque(
+                mes=linha['mes'], ano=linha['ano'], equipe_id=linha['funcionario__equipe'],
+                enviados=linha['enviados'], assinados=linha['assinados'],
+            )
+            for linha in linhas if linha['enviados']
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0011_funcionario_nome_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoContracheque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.IntegerField(choices=[(1, 'Janeiro'), (2, 'Fevereiro'), (3, 'Março'), (4, 'Abril'), (5, 'Maio'), (6, 'Junho'), (7, 'Julho'), (8, 'Agosto'), (9, 'Setembro'), (10, 'Outubro'), (11, 'Novembro'), (12, 'Dezembro'), (13, '13º Salário')])),
+                ('ano', models.IntegerField()),
+                ('enviados', models.PositiveIntegerField(default=0)),
+                ('assinados', models.PositiveIntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('equipe', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='resumos_contracheque', to='core_rh.equipe')),
+            ],
+            options={
+                'verbose_name': 'Resumo de Contracheques',
+                'verbose_name_plural': 'Resumos de Contracheques',
+                'indexes': [models.Index(fields=['ano', 'mes'], name='resumocc_competencia_idx')],
+            },
+        ),
+        migrations.RunPython(preencher_resumo, migrations.RunPython.noop),
+    ]
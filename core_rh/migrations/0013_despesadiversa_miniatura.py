@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0012_resumocontracheque'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='despesadiversa',
+            name='hash_comprovante',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='despesadiversa',
+            name='miniatura',
+            field=models.FileField(blank=True, default='', editable=False, upload_to='despesas_diversas/miniaturas/'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 6.0 on 2026-10-18 18:10
+
+import django.db.models.deletion
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+from django.db.models.functions import TruncWeek
+
+PRIORIDADE_STATUS = [
+    ('Rejeitado', 'Rejeitado'), ('Pendente', 'Pendente'), ('Aprovado_Regional', 'Aprovado_Regional'),
+    ('Aprovado_Matriz', 'Aprovado_Matriz'), ('Aprovado_Financeiro', 'Aprovado_Financeiro'),
+    ('Pago', 'Pago'), ('Aprovado', 'Aprovado_Matriz'),
+]
+
+
+def preencher_lancamentos(apps, schema_editor):
+    # Mesma conta de semana_km.recalcular_semanas, para todas as semanas de uma vez.
+    # Ainda não há valor gravado: semanas já pagas recebem o valor do KM atual
+    Funcionario = apps.get_model('core_rh', 'Funcionario')
+    ControleKM = apps.get_model('core_rh', 'ControleKM')
+    DespesaDiversa = apps.get_model('core_rh', 'DespesaDiversa')
+    LancamentoSemanalKM = apps.get_model('core_rh', 'LancamentoSemanalKM')
+
+    semanas = defaultdict(lambda: {'km': [], 'despesas': []})
+    for modelo, campo, chave in ((ControleKM, 'total_km', 'km'), (DespesaDiversa, 'valor', 'despesas')):
+        linhas = (
+            modelo.objects.values('funcionario_id', 'status', inicio=TruncWeek('data'))
+            .annotate(total=Sum(campo), qtd=Count('id'), menor_id=Min('id')).order_by()
+        )
+        for linha in linhas:
+            semanas[(linha['funcionario_id'], linha['inicio'])][chave].append(linha)
+
+    valores_km = dict(Funcionario.objects.values_list('id', 'valor_km'))
+    lancamentos = []
+    for (funcionario_id, inicio), dados in semanas.items():
+        valor_km = valores_km[funcionario_id]
+        valor_km = valor_km if valor_km and valor_km > 0 else Decimal('1.20')
+        total_km = sum(l['total'] or 0 for l in dados['km'] if l['status'] != 'Rejeitado')
+        total_despesas = sum(l['total'] or 0 for l in dados['despesas'] if l['status'] != 'Rejeitado')
+        presentes = {l['status'] for l in dados['km'] + dados['despesas']}
+        lancamentos.append(LancamentoSemanalKM(
+            funcionario_id=funcionario_id, inicio=inicio,
+            total_km=total_km, total_despesas=total_despesas, valor_km=valor_km,
+            valor_a_pagar=total_km * valor_km + total_despesas,
+            status=next((exibido for status, exibido in PRIORIDADE_STATUS if status in presentes), 'Vazio'),
+            qtd_kms=sum(l['qtd'] for l in dados['km']),
+            qtd_despesas=sum(l['qtd'] for l in dados['despesas']),
+            primeiro_km_id=min((l['menor_id'] for l in dados['km']), default=None),
+        ))
+    LancamentoSemanalKM.objects.bulk_create(lancamentos, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0013_despesadiversa_miniatura'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LancamentoSemanalKM',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateField(verbose_name='Início da Semana')),
+                ('total_km', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_despesas', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('valor_km', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('valor_a_pagar', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('status', models.CharField(default='Vazio', max_length=50)),
+                ('qtd_kms', models.PositiveIntegerField(default=0)),
+                ('qtd_despesas', models.PositiveIntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lancamentos_semanais_km', to='core_rh.funcionario')),
+                ('primeiro_km', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core_rh.controlekm')),
+            ],
+            options={
+                'verbose_name': 'Lançamento Semanal de KM',
+                'verbose_name_plural': 'Lançamentos Semanais de KM',
+                'indexes': [models.Index(fields=['inicio'], name='lancsemkm_inicio_idx')],
+                'unique_together': {('funcionario', 'inicio')},
+            },
+        ),
+        migrations.RunPython(preencher_lancamentos, migrations.RunPython.noop),
+    ]
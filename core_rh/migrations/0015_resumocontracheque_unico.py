@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-18 19:05
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remover_duplicados(apps, schema_editor):
+    # Recálculos simultâneos podem ter deixado mais de uma linha por competência
+    # e equipe: fica a mais recente (as contagens se acertam no próximo
+    # `manage.py atualizar_resumo_contracheques`)
+    ResumoContracheque = apps.get_model('core_rh', 'ResumoContracheque')
+    duplicados = (
+        ResumoContracheque.objects.values('mes', 'ano', 'equipe_id')
+        .annotate(qtd=Count('id'), manter=Max('id')).filter(qtd__gt=1).order_by()
+    )
+    for linha in duplicados:
+        ResumoContracheque.objects.filter(
+            mes=linha['mes'], ano=linha['ano'], equipe_id=linha['equipe_id']
+        ).exclude(id=linha['manter']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0014_lancamentosemanalkm'),
+    ]
+
+    operations = [
+        migrations.RunPython(remover_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='resumocontracheque',
+            constraint=models.UniqueConstraint(fields=('mes', 'ano', 'equipe'), name='resumocc_competencia_equipe_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='resumocontracheque',
+            constraint=models.UniqueConstraint(condition=models.Q(('equipe__isnull', True)), fields=('mes', 'ano'), name='resumocc_competencia_sem_equipe_uniq'),
+        ),
+    ]
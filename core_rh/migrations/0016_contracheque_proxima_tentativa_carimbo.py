@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core_rh', '0015_resumocontracheque_unico'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contracheque',
+            name='proxima_tentativa_carimbo',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,92 @@
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from . import arquivos
+from .models import DespesaDiversa
+from .tarefas import executar_em_segundo_plano
+
+try:
+    from pdf2image import convert_from_bytes
+    HAS_PDF_CONVERTER = True
+except ImportError:
+    HAS_PDF_CONVERTER = False
+
+# ==========================================
+# MINIATURAS DOS COMPROVANTES DE DESPESA
+# ==========================================
+# O comprovante é convertido uma vez, logo depois do upload (signal de
+# DespesaDiversa, em segundo plano), para um JPEG de tamanho limitado. As
+# planilhas de KM só embutem essa miniatura: nada de abrir o original,
+# rasterizar PDF (poppler) ou recodificar imagem a cada exportação.
+# O nome do arquivo é o sha256 do comprovante, então o mesmo comprovante
+# enviado duas vezes usa uma miniatura só.
+# JPEG e não WebP: o Excel não exibe imagens WebP embutidas.
+# `manage.py gerar_miniaturas_despesas` gera as que faltam (registros antigos).
+
+PASTA_MINIATURAS = 'despesas_diversas/miniaturas'
+LADO_MAXIMO = 1000  # px; na planilha a imagem entra com 400 de altura
+QUALIDADE_JPEG = 80
+DPI_PDF = 100
+
+
+def gerar_miniatura(conteudo, is_pdf):
+    """Bytes do JPEG reduzido, ou None se o PDF não puder ser rasterizado aqui."""
+    if is_pdf:
+        if not HAS_PDF_CONVERTER:
+            return None
+        paginas = convert_from_bytes(conteudo, dpi=DPI_PDF, first_page=1, last_page=1)
+        if not paginas:
+            return None
+        imagem = paginas[0]
+    else:
+        imagem = Image.open(io.BytesIO(conteudo))
+        # Foto de celular: aplica a rotação do EXIF antes de descartar os metadados
+        imagem = ImageOps.exif_transpose(imagem)
+
+    # RGB trata PNG com transparência, MPO, CMYK etc
+    imagem = imagem.convert('RGB')
+    imagem.thumbnail((LADO_MAXIMO, LADO_MAXIMO))
+    saida = io.BytesIO()
+    imagem.save(saida, format='JPEG', quality=QUALIDADE_JPEG, optimize=True)
+    return saida.getvalue()
+
+
+def garantir_miniatura(despesa_id):
+    """Gera (ou reaproveita) a miniatura da despesa e grava no registro. Devolve o nome ou ''."""
+    despesa = DespesaDiversa.objects.filter(pk=despesa_id).only(
+        'comprovante', 'miniatura', 'hash_comprovante'
+    ).first()
+    if despesa is None or not despesa.comprovante:
+        return ''
+
+    conteudo = arquivos.ler_bytes(despesa.comprovante)
+    hash_comprovante = hashlib.sha256(conteudo).hexdigest()
+    if despesa.miniatura and despesa.hash_comprovante == hash_comprovante:
+        return despesa.miniatura.name
+
+    storage = despesa.miniatura.storage
+    nome = f"{PASTA_MINIATURAS}/{hash_comprovante[:2]}/{hash_comprovante}.jpg"
+    if not storage.exists(nome):
+        miniatura = gerar_miniatura(conteudo, arquivos.extensao(despesa.comprovante) == 'pdf')
+        nome = storage.save(nome, ContentFile(miniatura)) if miniatura else ''
+
+    # Só grava se o comprovante não foi trocado enquanto isso
+    DespesaDiversa.objects.filter(pk=despesa_id, comprovante=despesa.comprovante.name).update(
+        miniatura=nome, hash_comprovante=hash_comprovante
+    )
+    return nome
+
+
+def _gerar_em_segundo_plano(despesa_id):
+    try:
+        garantir_miniatura(despesa_id)
+    except Exception as e:
+        print(f"Erro ao gerar miniatura da despesa {despesa_id}: {e}")
+
+
+def enfileirar_miniatura(despesa_id):
+    transaction.on_commit(lambda: executar_em_segundo_plano(_gerar_em_segundo_plano, despesa_id))
@@ -1,11 +1,13 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models.signals import post_delete, post_init, post_save, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import Group
 from django.db.models import Max
 
+from .papeis import NOMES_EQUIPE_RH, invalidar_papeis_todos, invalidar_papeis_usuario
+
 # ==========================================
 # MÓDULO: RH (RECURSOS HUMANOS)
 # ==========================================
@@ -89,6 +91,8 @@ class Funcionario(models.Model):
     class Meta:
         verbose_name = "Funcionário"
         verbose_name_plural = "Funcionários"
+        # Paginação por chave (nome, id) no painel de contracheques
+        indexes = [models.Index(fields=['nome_completo', 'id'], name='funcionario_nome_id_idx')]
 
     def __str__(self):
         return f"{self.nome_completo} - {self.cargo.titulo}"
@@ -142,6 +146,30 @@ class RegistroPonto(models.Model):
     def __str__(self):
         return f"{self.funcionario.nome_completo} - {self.data}"
 
+
+# 4.1 Situação da Folha de Ponto por competência (assinaturas e arquivo assinado)
+class FolhaPontoStatus(models.Model):
+    funcionario = models.ForeignKey(Funcionario, on_delete=models.CASCADE, related_name='status_folhas')
+    mes = models.PositiveSmallIntegerField("Mês")
+    ano = models.PositiveSmallIntegerField("Ano")
+
+    assinado_funcionario = models.BooleanField(default=False)
+    assinado_gestor = models.BooleanField(default=False)
+    arquivo = models.FileField("Folha Assinada", upload_to='ponto_assinado/', null=True, blank=True)
+
+    data_assinatura_funcionario = models.DateTimeField(null=True, blank=True)
+    data_assinatura_gestor = models.DateTimeField(null=True, blank=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('funcionario', 'mes', 'ano')
+        verbose_name = "Status da Folha de Ponto"
+        verbose_name_plural = "Status das Folhas de Ponto"
+        ordering = ['-ano', '-mes']
+
+    def __str__(self):
+        return f"{self.funcionario.nome_completo} - {self.mes:02d}/{self.ano}"
+
 def user_string_representation(self):
     if self.first_name:
         return f"{self.first_name} {self.last_name}".strip()
@@ -149,7 +177,6 @@ def user_string_representation(self):
 
 User.__str__ = user_string_representation
 
-NOMES_EQUIPE_RH = ['RH', 'Recursos Humanos', 'Gestão de Pessoas']
 
 def garantir_acesso_rh(funcionario):
     eh_rh = False
@@ -178,11 +205,38 @@ def garantir_acesso_rh(funcionario):
 @receiver(post_save, sender=Funcionario)
 def signal_equipe_principal(sender, instance, created, **kwargs):
     garantir_acesso_rh(instance)
+    invalidar_papeis_usuario(instance.usuario_id)
 
 @receiver(m2m_changed, sender=Funcionario.outras_equipes.through)
 def signal_equipes_secundarias(sender, instance, action, **kwargs):
     if action in ["post_add", "post_remove", "post_clear"]:
-        garantir_acesso_rh(instance)
+        if isinstance(instance, Funcionario):
+            garantir_acesso_rh(instance)
+            invalidar_papeis_usuario(instance.usuario_id)
+        else:
+            # Alterado pelo lado da Equipe: afeta vários funcionários
+            invalidar_papeis_todos()
+
+@receiver(m2m_changed, sender=User.groups.through)
+def signal_grupos_usuario(sender, instance, action, **kwargs):
+    if action in ["post_add", "post_remove", "post_clear"]:
+        if isinstance(instance, User):
+            invalidar_papeis_usuario(instance.pk)
+        else:
+            invalidar_papeis_todos()
+
+@receiver(post_save, sender=User)
+def signal_usuario_alterado(sender, instance, update_fields=None, **kwargs):
+    # Login só atualiza last_login: não mexe em papéis
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    invalidar_papeis_usuario(instance.pk)
+
+@receiver(post_save, sender=Equipe)
+def signal_equipe_alterada(sender, instance, created, **kwargs):
+    # Nome da equipe define papéis (RH, Financeiro, Campo...) de todos os membros
+    if not created:
+        invalidar_papeis_todos()
 
 class Ferias(models.Model):
     funcionario = models.ForeignKey(Funcionario, on_delete=models.CASCADE, verbose_name="Funcionário")
@@ -207,9 +261,12 @@ class Ferias(models.Model):
     def __str__(self):
         return f"{self.funcionario.nome_completo} - {self.periodo_aquisitivo}"
 
+def pasta_contracheques(mes, ano):
+    return f'contracheques/{ano}/{mes}'
+
 def contracheque_upload_path(instance, filename):
     identificador = getattr(instance.funcionario, 'matricula', instance.funcionario.id)
-    return f'contracheques/{instance.ano}/{instance.mes}/{identificador}_{filename}'
+    return f'{pasta_contracheques(instance.mes, instance.ano)}/{identificador}_{filename}'
 
 class Contracheque(models.Model):
     MESES = [
@@ -225,6 +282,26 @@ class Contracheque(models.Model):
     data_upload = models.DateTimeField(auto_now_add=True)
     data_ciencia = models.DateTimeField(null=True, blank=True, verbose_name="Data de Recebimento")
     ip_ciencia = models.GenericIPAddressField(null=True, blank=True)
+    # Âncoras por página (data de recebimento / assinatura) lidas no upload; ver layout_pdf
+    layout_pdf = models.JSONField(null=True, blank=True, editable=False)
+    # Hash da página de origem na folha importada: reenvios pulam as páginas iguais
+    hash_conteudo = models.CharField(max_length=64, blank=True, default='', editable=False)
+
+    # Assinatura: a ciência é gravada na hora; o PDF assinado é gerado em segundo plano
+    STATUS_CARIMBO_CHOICES = [
+        ('', '-'),
+        ('Pendente', 'Na fila'),
+        ('Processando', 'Gerando PDF'),
+        ('Concluido', 'PDF assinado'),
+        ('Falhou', 'Falhou'),
+    ]
+    chave_assinatura = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
+    status_carimbo = models.CharField("PDF Assinado", max_length=12, choices=STATUS_CARIMBO_CHOICES, blank=True, default='')
+    tentativas_carimbo = models.PositiveSmallIntegerField(default=0)
+    erro_carimbo = models.TextField(blank=True, default='')
+    carimbo_atualizado_em = models.DateTimeField(null=True, blank=True)
+    # Nova tentativa agendada após uma falha: gravada no banco para sobreviver a um restart
+    proxima_tentativa_carimbo = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-ano', '-mes']
@@ -237,6 +314,96 @@ class Contracheque(models.Model):
     def assinado(self):
         return self.data_ciencia is not None
 
+    @property
+    def gerando_pdf_assinado(self):
+        return self.status_carimbo in ('Pendente', 'Processando')
+
+
+# Importação em lote da folha de pagamento (processada em segundo plano)
+class ProcessamentoContracheque(models.Model):
+    STATUS_CHOICES = [
+        ('Pendente', 'Pendente'),
+        ('Processando', 'Processando'),
+        ('Concluido', 'Concluído'),
+        ('Erro', 'Erro'),
+    ]
+    ORIGEM_CHOICES = [
+        ('painel', 'Painel do RH'),
+        ('admin', 'Admin'),
+    ]
+
+    arquivo = models.FileField("PDF da Folha", upload_to='contracheques/lotes/%Y/%m/')
+    mes = models.IntegerField(choices=Contracheque.MESES)
+    ano = models.IntegerField()
+    data_recebimento = models.DateField(null=True, blank=True)
+    origem = models.CharField(max_length=10, choices=ORIGEM_CHOICES, default='painel')
+    criado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='Pendente')
+    total_paginas = models.PositiveIntegerField(default=0)
+    paginas_processadas = models.PositiveIntegerField(default=0)
+    # Início de cada faixa de páginas já gravada (permite retomar após queda)
+    faixas_concluidas = models.JSONField(default=list, blank=True)
+    # {'sucesso': [...], 'erro': [...], 'avisos': [...], 'arquivos': {pagina: [funcionario_id, nome_no_storage, layout]}}
+    resultado = models.JSONField(default=dict, blank=True)
+    mensagem_erro = models.TextField(blank=True, default='')
+
+    criado_em = models.DateTimeField(auto_now_add=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Processamento de Contracheques"
+        verbose_name_plural = "Processamentos de Contracheques"
+        ordering = ['-criado_em']
+
+    def __str__(self):
+        return f"{self.get_mes_display()}/{self.ano} - {self.get_status_display()}"
+
+    @property
+    def finalizado(self):
+        return self.status in ('Concluido', 'Erro')
+
+    @property
+    def percentual(self):
+        if not self.total_paginas:
+            return 0
+        return int(100 * self.paginas_processadas / self.total_paginas)
+
+# Contagens de contracheques por competência e equipe principal (ver contracheque_service)
+class ResumoContracheque(models.Model):
+    mes = models.IntegerField(choices=Contracheque.MESES)
+    ano = models.IntegerField()
+    equipe = models.ForeignKey(Equipe, on_delete=models.CASCADE, null=True, blank=True, related_name='resumos_contracheque')
+    enviados = models.PositiveIntegerField(default=0)
+    assinados = models.PositiveIntegerField(default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Resumo de Contracheques"
+        verbose_name_plural = "Resumos de Contracheques"
+        indexes = [models.Index(fields=['ano', 'mes'], name='resumocc_competencia_idx')]
+        # Uma linha por competência e equipe; NULL não conflita no índice comum, daí o parcial
+        constraints = [
+            models.UniqueConstraint(fields=['mes', 'ano', 'equipe'], name='resumocc_competencia_equipe_uniq'),
+            models.UniqueConstraint(
+                fields=['mes', 'ano'], condition=models.Q(equipe__isnull=True), name='resumocc_competencia_sem_equipe_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_mes_display()}/{self.ano} - {self.equipe or 'Sem equipe'}"
+
+    @property
+    def pendentes(self):
+        return self.enviados - self.assinados
+
+@receiver(post_save, sender=Contracheque)
+@receiver(post_delete, sender=Contracheque)
+def signal_resumo_contracheque(sender, instance, **kwargs):
+    from .contracheque_service import agendar_resumo_competencia
+    agendar_resumo_competencia(instance.mes, instance.ano)
+
 class Atestado(models.Model):
     TIPO_CHOICES = [
         ('DIAS', 'Atestado Médico (Afastamento em Dias)'),
@@ -259,6 +426,54 @@ class Atestado(models.Model):
     def __str__(self):
         return f"{self.funcionario.nome_completo} - {self.get_tipo_display()}"
 
+# Índice de busca dos documentos do RH (ver indice_documentos)
+class DocumentoIndice(models.Model):
+    TIPO_CHOICES = [
+        ('contracheque', 'Contracheque'),
+        ('ponto', 'Folha de Ponto'),
+        ('ferias', 'Férias'),
+        ('atestado', 'Atestado'),
+    ]
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    objeto_id = models.PositiveBigIntegerField()
+    # Nome do FileField de origem (Férias tem até quatro arquivos)
+    campo = models.CharField(max_length=30)
+    funcionario = models.ForeignKey(Funcionario, on_delete=models.CASCADE, related_name='documentos_indice')
+    competencia = models.DateField()
+    titulo = models.CharField(max_length=150)
+    # Nome, matrícula, CPF, tipo e competência normalizados (maiúsculas, sem acento)
+    texto_busca = models.TextField()
+
+    class Meta:
+        unique_together = ['tipo', 'objeto_id', 'campo']
+        indexes = [models.Index(fields=['-competencia', '-id'], name='docindice_competencia_idx')]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - {self.titulo}"
+
+@receiver(post_save, sender=Contracheque)
+@receiver(post_save, sender=FolhaPontoStatus)
+@receiver(post_save, sender=Ferias)
+@receiver(post_save, sender=Atestado)
+def signal_indexar_documento(sender, instance, **kwargs):
+    from .indice_documentos import indexar
+    indexar(instance)
+
+@receiver(post_delete, sender=Contracheque)
+@receiver(post_delete, sender=FolhaPontoStatus)
+@receiver(post_delete, sender=Ferias)
+@receiver(post_delete, sender=Atestado)
+def signal_remover_documento(sender, instance, **kwargs):
+    from .indice_documentos import remover
+    remover(instance)
+
+@receiver(post_save, sender=Funcionario)
+def signal_reindexar_funcionario(sender, instance, created, **kwargs):
+    # Nome, matrícula ou CPF alterados: atualiza o texto de busca dos documentos dele
+    if not created:
+        from .indice_documentos import reindexar_funcionario
+        reindexar_funcionario(instance)
+
 class ControleKM(models.Model):
     STATUS_CHOICES = [
         ('Pendente', 'Pendente'),
@@ -294,6 +509,9 @@ class DespesaDiversa(models.Model):
     tipo = models.CharField(max_length=20, choices=TIPOS)
     especificacao = models.CharField(max_length=255, blank=True, null=True)
     comprovante = models.FileField(upload_to='despesas_diversas/%Y/%m/')
+    # JPEG reduzido do comprovante (gerado uma vez no upload, ver miniaturas.py)
+    miniatura = models.FileField(upload_to='despesas_diversas/miniaturas/', blank=True, default='', editable=False)
+    hash_comprovante = models.CharField(max_length=64, blank=True, default='', editable=False)
     valor = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     status = models.CharField(max_length=50, default='Pendente')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -302,6 +520,13 @@ class DespesaDiversa(models.Model):
     def __str__(self):
         return f"{self.tipo} - {self.numero_chamado}"
 
+@receiver(post_save, sender=DespesaDiversa)
+def signal_miniatura_despesa(sender, instance, **kwargs):
+    # hash preenchido sem miniatura: já tentou (ex: PDF sem poppler), não fica repetindo
+    if instance.comprovante and not instance.miniatura and not instance.hash_comprovante:
+        from .miniaturas import enfileirar_miniatura
+        enfileirar_miniatura(instance.pk)
+
 class TrechoKM(models.Model):
     controle = models.ForeignKey(ControleKM, related_name='trechos', on_delete=models.CASCADE)
     origem = models.TextField(verbose_name="Link ou Origem")
@@ -313,6 +538,58 @@ class TrechoKM(models.Model):
     def __str__(self):
         return f"{self.origem} -> {self.destino}"
 
+# Totais da semana (ISO, segunda a domingo) de cada técnico: KM, despesas, valor a pagar e status (ver semana_km)
+class LancamentoSemanalKM(models.Model):
+    funcionario = models.ForeignKey(Funcionario, on_delete=models.CASCADE, related_name='lancamentos_semanais_km')
+    inicio = models.DateField("Início da Semana")  # segunda-feira
+    # KM e despesas que entram no pagamento (sem os rejeitados)
+    total_km = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_despesas = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Valor do KM usado no cálculo (o do funcionário na época, 1.20 se não tinha)
+    valor_km = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    valor_a_pagar = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    status = models.CharField(max_length=50, default='Vazio')
+    qtd_kms = models.PositiveIntegerField(default=0)
+    qtd_despesas = models.PositiveIntegerField(default=0)
+    # KM usado nos botões de aprovar/rejeitar a semana
+    primeiro_km = models.ForeignKey(ControleKM, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Lançamento Semanal de KM"
+        verbose_name_plural = "Lançamentos Semanais de KM"
+        unique_together = ['funcionario', 'inicio']
+        indexes = [models.Index(fields=['inicio'], name='lancsemkm_inicio_idx')]
+
+    def __str__(self):
+        return f"{self.funcionario.nome_completo} - S{self.inicio.isocalendar()[1]}/{self.inicio.isocalendar()[0]}"
+
+@receiver(post_init, sender=ControleKM)
+@receiver(post_init, sender=DespesaDiversa)
+def signal_semana_original_km(sender, instance, **kwargs):
+    # Semana em que o lançamento estava ao ser carregado (a edição pode trocar a data).
+    # Pelo __dict__ para não disparar consulta em campos adiados (.only/.defer)
+    instance._semana_km_original = (instance.__dict__.get('funcionario_id'), instance.__dict__.get('data'))
+
+@receiver(post_save, sender=ControleKM)
+@receiver(post_delete, sender=ControleKM)
+@receiver(post_save, sender=DespesaDiversa)
+@receiver(post_delete, sender=DespesaDiversa)
+def signal_lancamento_semanal_km(sender, instance, **kwargs):
+    from .semana_km import agendar_semana
+    atual = (instance.funcionario_id, instance.data)
+    funcionario_id, data = getattr(instance, '_semana_km_original', (None, None))
+    if funcionario_id and data and (funcionario_id, data) != atual:
+        agendar_semana(funcionario_id, data)
+    agendar_semana(*atual)
+    instance._semana_km_original = atual
+
+@receiver(post_save, sender=Funcionario)
+def signal_valor_km_semanas(sender, instance, created, **kwargs):
+    if not created:
+        from .semana_km import aplicar_valor_km
+        aplicar_valor_km([instance.pk], instance.valor_km)
+
 # ==========================================
 # MÓDULO: ALMOXARIFADO / ESTOQUE DE TI
 # ==========================================
@@ -1,14 +1,15 @@
-import os
+import io
 import random
 import string
-from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 
 def emitir_nfe_saida(movimentacao):
     """
-    GERA UM PDF SIMULANDO UMA DANFE E SALVA NA PASTA MEDIA.
+    GERA UM PDF SIMULANDO UMA DANFE E SALVA NO STORAGE DE MÍDIA (PASTA nfe/).
     """
     
     # 1. Gera dados aleatórios da Nota
@@ -19,15 +20,11 @@ def emitir_nfe_saida(movimentacao):
     # 2. Define o caminho do arquivo
     nome_arquivo = f"NFE_{numero_nota}_{movimentacao.id}.pdf"
     
-    # Garante que a pasta media/nfe existe
-    pasta_destino = os.path.join(settings.MEDIA_ROOT, 'nfe')
-    os.makedirs(pasta_destino, exist_ok=True)
-    
-    caminho_completo = os.path.join(pasta_destino, nome_arquivo)
-    url_publica = f"{settings.MEDIA_URL}nfe/{nome_arquivo}"
+    # Desenha em memória e grava pelo storage (disco local ou bucket)
+    buffer_pdf = io.BytesIO()
 
     # 3. Desenha o PDF (Layout Simplificado de DANFE)
-    c = canvas.Canvas(caminho_completo, pagesize=A4)
+    c = canvas.Canvas(buffer_pdf, pagesize=A4)
     width, height = A4
     
     # --- CABEÇALHO ---
@@ -108,6 +105,9 @@ def emitir_nfe_saida(movimentacao):
 
     c.save()
 
+    nome_salvo = default_storage.save(f"nfe/{nome_arquivo}", ContentFile(buffer_pdf.getvalue()))
+    url_publica = default_storage.url(nome_salvo)
+
     return {
         'sucesso': True,
         'status': 'Emitida (Ambiente de Teste)',
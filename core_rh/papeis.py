@@ -0,0 +1,140 @@
+import time
+from contextvars import ContextVar
+
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+
+# ==========================================
+# PAPÉIS DO USUÁRIO (RH, GESTÃO, FINANCEIRO, CAMPO, ESTOQUE)
+# ==========================================
+# Grupos e equipes (principal + secundárias) são lidos uma vez por usuário e o
+# resultado fica memorizado no próprio objeto user (request) e na sessão.
+# Os signals de Funcionario/Equipe/grupos trocam a versão no cache e forçam
+# o recálculo no próximo acesso. O cache é o compartilhado (CACHES no
+# settings): um papel revogado vale para todos os workers no request seguinte.
+
+NOMES_EQUIPE_RH = ['RH', 'Recursos Humanos', 'Gestão de Pessoas']
+NOMES_EQUIPE_GESTAO = ['Gestão', 'Gestao', 'Matriz', 'Diretoria', 'Administrativo']
+NOMES_EQUIPE_FINANCEIRO = ['Financeiro', 'Financeira', 'Finanças']
+# Como sempre foi: "Campo" exato na equipe principal, sem diferenciar maiúsculas nas secundárias
+TERMO_EQUIPE_CAMPO = 'Campo'
+NOME_EQUIPE_ESTOQUE = 'estoque'
+
+CHAVE_SESSAO_PAPEIS = 'core_rh_papeis'
+# Rede de segurança caso a versão se perca no cache (ex: limpeza de entradas)
+PAPEIS_TTL_SESSAO = 300
+
+PAPEIS_VAZIOS = {
+    'rh': False, 'gestao': False, 'financeiro': False, 'campo': False, 'estoque': False,
+    'grupos': [],
+}
+
+# Sessão do request atual, publicada pelo PapeisUsuarioMiddleware
+_sessao_atual = ContextVar('core_rh_sessao_atual', default=None)
+
+
+def _chave_versao(user_id=None):
+    return f"core_rh:papeis_versao:{user_id if user_id is not None else 'global'}"
+
+
+def _versao_atual(user_id):
+    versoes = cache.get_many([_chave_versao(), _chave_versao(user_id)])
+    return [versoes.get(_chave_versao(), 0), versoes.get(_chave_versao(user_id), 0)]
+
+
+def _renovar(chave):
+    # Valor que nunca se repete (não um contador): se a chave for descartada
+    # pelo cache e recriada, nenhuma sessão antiga volta a bater com ela
+    cache.set(chave, time.time_ns(), None)
+
+
+def invalidar_papeis_usuario(user_id):
+    """Força o recálculo dos papéis de um usuário (ex: mudou de equipe ou de grupo)."""
+    _renovar(_chave_versao(user_id))
+
+
+def invalidar_papeis_todos():
+    """Força o recálculo para todos (ex: equipe renomeada)."""
+    _renovar(_chave_versao())
+
+
+def _calcular_papeis(user):
+    from .models import Equipe, Funcionario
+
+    grupos = sorted(user.groups.values_list('name', flat=True))
+
+    if user.is_superuser:
+        return {'rh': True, 'gestao': True, 'financeiro': True, 'campo': True, 'estoque': True, 'grupos': grupos}
+
+    # Equipe principal e secundárias numa única consulta (campo e estoque comparam diferente em cada uma)
+    try:
+        funcionario = user.funcionario
+        equipe_principal_id = funcionario.equipe_id
+        secundaria = Funcionario.outras_equipes.through.objects.filter(funcionario=funcionario, equipe=OuterRef('pk'))
+        linhas = list(Equipe.objects.filter(
+            Q(funcionario=funcionario) | Q(funcionarios_secundarios=funcionario)
+        ).annotate(secundaria=Exists(secundaria)).values_list('pk', 'nome', 'secundaria').distinct())
+    except AttributeError:
+        equipe_principal_id, linhas = None, []
+
+    equipes = [nome for _, nome, _ in linhas]
+    principal = [nome for pk, nome, _ in linhas if pk == equipe_principal_id]
+    secundarias = [nome for _, nome, eh_secundaria in linhas if eh_secundaria]
+
+    return {
+        'rh': 'RH' in grupos or any(nome in NOMES_EQUIPE_RH for nome in equipes),
+        'gestao': any(nome in NOMES_EQUIPE_GESTAO for nome in equipes),
+        'financeiro': any(nome in NOMES_EQUIPE_FINANCEIRO for nome in equipes),
+        'campo': (
+            any(TERMO_EQUIPE_CAMPO in nome for nome in principal)
+            or any(TERMO_EQUIPE_CAMPO.lower() in nome.lower() for nome in secundarias)
+        ),
+        'estoque': (
+            'Estoque' in grupos
+            or any(nome.strip().lower() == NOME_EQUIPE_ESTOQUE for nome in principal)
+            or any(nome.lower() == NOME_EQUIPE_ESTOQUE for nome in secundarias)
+        ),
+        'grupos': grupos,
+    }
+
+
+def papeis_do_usuario(user):
+    """
+    Dict com os papéis do usuário: rh, gestao, financeiro, campo, estoque e grupos.
+    Primeiro olha o objeto user (mesmo request), depois a sessão e só então o banco.
+    """
+    if not user or not user.is_authenticated:
+        return PAPEIS_VAZIOS
+
+    papeis = getattr(user, '_core_rh_papeis', None)
+    if papeis is not None:
+        return papeis
+
+    versao = _versao_atual(user.pk)
+    sessao = _sessao_atual.get()
+    salvo = sessao.get(CHAVE_SESSAO_PAPEIS) if sessao is not None else None
+
+    if (salvo and salvo.get('user_id') == user.pk and salvo.get('versao') == versao
+            and salvo.get('expira', 0) > time.time()):
+        papeis = salvo['papeis']
+    else:
+        papeis = _calcular_papeis(user)
+        if sessao is not None:
+            sessao[CHAVE_SESSAO_PAPEIS] = {
+                'user_id': user.pk,
+                'versao': versao,
+                'expira': time.time() + PAPEIS_TTL_SESSAO,
+                'papeis': papeis,
+            }
+
+    user._core_rh_papeis = papeis
+    return papeis
+
+
+def publicar_sessao(request):
+    """Disponibiliza a sessão do request para o resolvedor; devolve o token para reset."""
+    return _sessao_atual.set(getattr(request, 'session', None))
+
+
+def liberar_sessao(token):
+    _sessao_atual.reset(token)
@@ -0,0 +1,136 @@
+import base64
+import hashlib
+import os
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .tarefas import executar_em_segundo_plano
+
+# PDFs prontos ficam no storage de mídia, endereçados pelo hash do HTML renderizado.
+# Qualquer mudança nos registros, observações ou cabeçalho gera outra chave.
+# Uma pasta por funcionário e competência: a invalidação lista só ela.
+PASTA_CACHE_PONTO = 'cache_pdf/ponto'
+
+# <funcionario>_<ano>_<mes>_<sha256 truncado>
+REGEX_CHAVE_PDF = re.compile(r'^(\d+)_(\d{4})_(\d{2})_([0-9a-f]{40})$')
+
+STATUS_PRONTO = 'pronto'
+STATUS_PROCESSANDO = 'processando'
+STATUS_ERRO = 'erro'
+
+# Situação das renderizações no cache compartilhado (CACHES no settings), visível a todos os workers:
+# "processando" enquanto algum processo gera o PDF, "erro" se a geração falhou.
+# Se o worker morre no meio, a marca expira e a chave pode ser pedida de novo.
+STATUS_PDF_TTL = 600
+
+
+def _chave_status(chave):
+    return f"core_rh:pdf_ponto:{chave}"
+
+
+@lru_cache(maxsize=1)
+def logo_base64():
+    """Logo da empresa em base64 para o cabeçalho do PDF (lida do disco uma vez por processo)."""
+    possiveis_caminhos = [
+        os.path.join(settings.BASE_DIR, 'core', 'static', 'images', 'Logo.png'),
+        os.path.join(settings.BASE_DIR, 'staticfiles', 'images', 'Logo.png'),
+        os.path.join(settings.BASE_DIR, 'static', 'images', 'Logo.png')
+    ]
+    for path in possiveis_caminhos:
+        if os.path.exists(path):
+            try:
+                with open(path, "rb") as image_file:
+                    return base64.b64encode(image_file.read()).decode('utf-8')
+            except Exception: pass
+    return None
+
+
+def weasyprint_disponivel():
+    try:
+        import weasyprint  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def chave_pdf(funcionario_id, mes, ano, html_string):
+    digest = hashlib.sha256(html_string.encode('utf-8')).hexdigest()[:40]
+    return f"{funcionario_id}_{ano}_{mes:02d}_{digest}"
+
+
+def ler_chave(chave):
+    """Retorna (funcionario_id, mes, ano) de uma chave válida, ou None."""
+    match = REGEX_CHAVE_PDF.match(chave or '')
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(3)), int(match.group(2))
+
+
+def _pasta_competencia(funcionario_id, mes, ano):
+    return f"{PASTA_CACHE_PONTO}/{funcionario_id}/{ano}_{int(mes):02d}"
+
+
+def caminho_pdf(chave):
+    funcionario_id, mes, ano = ler_chave(chave)
+    return f"{_pasta_competencia(funcionario_id, mes, ano)}/{chave}.pdf"
+
+
+def pdf_em_cache(chave):
+    return default_storage.exists(caminho_pdf(chave))
+
+
+def _renderizar(chave, html_string):
+    from weasyprint import HTML
+
+    try:
+        if not pdf_em_cache(chave):
+            conteudo = HTML(string=html_string, base_url=str(settings.BASE_DIR)).write_pdf()
+            default_storage.save(caminho_pdf(chave), ContentFile(conteudo))
+    except Exception:
+        cache.set(_chave_status(chave), STATUS_ERRO, STATUS_PDF_TTL)
+        raise
+    cache.delete(_chave_status(chave))
+
+
+def status_pdf(chave):
+    """Situação da renderização: pronto, processando, erro ou None (nunca solicitado ou expirado)."""
+    # A marca é lida antes do arquivo: ela só some depois que o PDF foi salvo
+    marca = cache.get(_chave_status(chave))
+    if pdf_em_cache(chave):
+        return STATUS_PRONTO
+    return marca
+
+
+def solicitar_pdf(chave, html_string):
+    """
+    Garante que o PDF da chave exista ou esteja sendo gerado.
+    Uma mesma chave nunca é renderizada duas vezes em paralelo, nem em workers diferentes.
+    Retorna (status, future) — future é None quando já estava pronto ou outro
+    processo já está gerando.
+    """
+    if pdf_em_cache(chave):
+        return STATUS_PRONTO, None
+
+    # cache.add é atômico: só quem grava a marca dispara a renderização
+    if not cache.add(_chave_status(chave), STATUS_PROCESSANDO, STATUS_PDF_TTL):
+        if cache.get(_chave_status(chave)) != STATUS_ERRO:
+            return STATUS_PROCESSANDO, None
+        # Falhou antes: tenta de novo
+        cache.set(_chave_status(chave), STATUS_PROCESSANDO, STATUS_PDF_TTL)
+    return STATUS_PROCESSANDO, executar_em_segundo_plano(_renderizar, chave, html_string)
+
+
+def invalidar_cache_ponto(funcionario_id, mes, ano):
+    """Apaga os PDFs em cache de uma competência (chamado quando a folha muda)."""
+    pasta = _pasta_competencia(funcionario_id, mes, ano)
+    try:
+        _, arquivos = default_storage.listdir(pasta)
+    except (FileNotFoundError, OSError):
+        return
+    for nome in arquivos:
+        default_storage.delete(f"{pasta}/{nome}")
@@ -0,0 +1,142 @@
+import io
+
+from openpyxl.drawing.image import Image as ExcelImage
+from openpyxl.styles import Alignment, Font, PatternFill
+
+from .planilhas import BORDA_FINA, FORMATO_MOEDA, Celula, Planilha
+
+# ==========================================
+# PLANILHA DE KM/DESPESAS DO TÉCNICO (MONTAGEM)
+# ==========================================
+# Recebe só dados prontos (dicionários, datas e os bytes das miniaturas) e
+# não importa nada do Django: roda no request (download individual) e nos
+# processos do pool do download em lote (lote_km). Consultar o banco e ler o
+# storage fica com quem chama (lote_km.dados_planilha_km).
+
+# --- ESTILOS (registrados uma vez por arquivo) ---
+_AZUL_ESCURO = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
+_AZUL_CLARO = PatternFill(start_color="DCE6F1", end_color="DCE6F1", fill_type="solid")
+_FONTE_NEGRITO = Font(name='Arial', size=10, bold=True)
+_FONTE_NORMAL = Font(name='Arial', size=10)
+_CENTRO = Alignment(horizontal='center', vertical='center', wrap_text=True)
+_ESQUERDA = Alignment(horizontal='left', vertical='center', wrap_text=True)
+
+ESTILOS_PLANILHA_KM = {
+    'km_titulo': dict(border=BORDA_FINA, fill=_AZUL_ESCURO, font=Font(name='Arial', size=14, bold=True, color="FFFFFF"), alignment=_CENTRO),
+    'km_cabecalho': dict(border=BORDA_FINA, fill=_AZUL_ESCURO, font=Font(name='Arial', size=11, bold=True, color="FFFFFF"), alignment=_CENTRO),
+    'km_destaque': dict(border=BORDA_FINA, fill=_AZUL_CLARO, font=_FONTE_NEGRITO, alignment=_CENTRO),
+    'km_semana': dict(border=BORDA_FINA, font=_FONTE_NEGRITO, alignment=_CENTRO),
+    'km_rotulo': dict(border=BORDA_FINA, font=_FONTE_NEGRITO, alignment=_ESQUERDA),
+    'km_texto': dict(border=BORDA_FINA, font=_FONTE_NORMAL, alignment=_ESQUERDA),
+    'km_centro': dict(border=BORDA_FINA, font=_FONTE_NORMAL, alignment=_CENTRO),
+    'km_item': dict(border=BORDA_FINA, font=_FONTE_NORMAL, alignment=_CENTRO),
+    'km_item_esquerda': dict(border=BORDA_FINA, font=_FONTE_NORMAL, alignment=_ESQUERDA),
+    'km_item_moeda': dict(border=BORDA_FINA, font=_FONTE_NORMAL, alignment=_CENTRO, number_format=FORMATO_MOEDA),
+    'km_link': dict(border=BORDA_FINA, font=Font(color="0000FF", underline="single"), alignment=_CENTRO),
+    'km_ver_aba': dict(border=BORDA_FINA, font=Font(color="FF0000", italic=True), alignment=_CENTRO),
+    'km_obs': dict(border=BORDA_FINA, alignment=_CENTRO),
+    'km_total': dict(border=BORDA_FINA, fill=_AZUL_CLARO, font=_FONTE_NEGRITO, alignment=_CENTRO),
+    'km_total_moeda': dict(border=BORDA_FINA, fill=_AZUL_CLARO, font=_FONTE_NEGRITO, alignment=_CENTRO, number_format=FORMATO_MOEDA),
+    'km_ref': dict(font=_FONTE_NEGRITO),
+    'km_aviso': dict(font=Font(italic=True)),
+    'km_erro': dict(font=Font(color="FF0000")),
+}
+LARGURAS_PLANILHA_KM = {'A': 18, 'B': 15, 'C': 20, 'D': 30, 'E': 30, 'F': 10, 'G': 15, 'H': 25}
+
+ALTURA_COMPROVANTE = 400
+
+
+def _bloco(valor, estilo, colunas):
+    """Célula mesclada: o valor na primeira, as outras vazias só para a borda."""
+    return [Celula(valor, estilo)] + [Celula(None, estilo) for _ in range(colunas - 1)]
+
+
+def _comprovante(ws_gal, item):
+    ws_gal.linha(Celula(f"REF: {item['data'].strftime('%d/%m')} - R$ {item['valor']} ({item['tipo']})", 'km_ref'))
+
+    if item['erro_miniatura']:
+        ws_gal.linha(Celula(f"[Erro ao carregar imagem: {item['erro_miniatura']}]", 'km_erro'))
+        ws_gal.pular()
+        return
+    if not item['miniatura']:
+        ws_gal.linha(Celula("[Visualização indisponível no Excel - Use o Link]", 'km_aviso'))
+        ws_gal.pular()
+        return
+
+    try:
+        imagem = ExcelImage(io.BytesIO(item['miniatura']))
+        proporcao = imagem.width / imagem.height
+        imagem.height = ALTURA_COMPROVANTE
+        imagem.width = ALTURA_COMPROVANTE * proporcao
+    except Exception as e:
+        print(f"Erro ao processar imagem do comprovante de {item['data']}: {e}")
+        ws_gal.linha(Celula(f"[Erro ao carregar imagem: {str(e)}]", 'km_erro'))
+        ws_gal.pular()
+        return
+    ws_gal.imagem(imagem, f'A{ws_gal.linha_atual}')
+    ws_gal.pular(21)
+
+
+def montar_planilha_km(dados):
+    """Planilha (write-only) de um técnico a partir de `dados` (ver lote_km.dados_planilha_km)."""
+    funcionario = dados['funcionario']
+    dt_inicio, dt_fim = dados['dt_inicio'], dados['dt_fim']
+
+    planilha = Planilha(ESTILOS_PLANILHA_KM)
+    ws = planilha.aba("Relatório", larguras=LARGURAS_PLANILHA_KM, sem_grade=True)
+    ws_gal = planilha.aba("Comprovantes", larguras={'A': 80})
+
+    # Cabeçalho
+    semana = f"{dt_inicio.isocalendar()[1]}/{dt_inicio.year}"
+    ws.linha(*_bloco("PLANILHA DE DESPESA", 'km_titulo', 6), Celula("SEMANA", 'km_destaque'), Celula(semana, 'km_semana'))
+    ws.linha(*_bloco(None, 'km_titulo', 6), Celula(None, 'km_destaque'), Celula(None, 'km_semana'))
+    ws.mesclar(1, 1, 2, 6); ws.mesclar(1, 7, 2, 7); ws.mesclar(1, 8, 2, 8)
+
+    labels = [
+        ('FUNCIONÁRIO:', funcionario['nome_completo'].upper()),
+        ('RESIDÊNCIA:', f"{funcionario['endereco']} - {funcionario['bairro']}"),
+        ('TRANSPORTE:', funcionario['tipo_veiculo'].upper() if funcionario['tipo_veiculo'] else "PARTICULAR"),
+        ('PERÍODO:', f"DE {dt_inicio.strftime('%d/%m/%Y')} A {dt_fim.strftime('%d/%m/%Y')}")
+    ]
+    banco_data = [('BANCO', funcionario['banco']), ('AGÊNCIA', funcionario['agencia']), ('CONTA', funcionario['conta']), ('PIX', funcionario['chave_pix'])]
+    for (lbl, val), (k, v) in zip(labels, banco_data):
+        r = ws.linha_atual
+        ws.linha(*_bloco(lbl, 'km_rotulo', 2), *_bloco(val, 'km_texto', 4), Celula(k, 'km_destaque'), Celula(v or '-', 'km_centro'))
+        ws.mesclar(r, 1, r, 2); ws.mesclar(r, 3, r, 6)
+
+    headers_table = ["Data", "Chamado", "Tipo", "Origem / Descrição", "Destino", "KM", "Valor", "Obs / Link"]
+    ws.linha(*[Celula(h, 'km_cabecalho') for h in headers_table])
+    ws.linha(*[Celula(None, 'km_cabecalho') for _ in headers_table])
+    for i in range(1, len(headers_table) + 1):
+        ws.mesclar(7, i, 8, i)
+
+    total_val = 0.0
+    for item in dados['itens']:
+        obs_final = item['obs']
+        vals = [item['data'].strftime('%d/%m/%Y'), item['chamado'], item['tipo'], item['origem'] if item['is_km'] else obs_final, item['destino'], item['km'] if item['km'] > 0 else "-"]
+        celulas = [Celula(val, 'km_item_esquerda' if col in [4, 5] else 'km_item') for col, val in enumerate(vals, 1)]
+        celulas.append(Celula(item['valor'], 'km_item_moeda'))
+
+        if item['link']:
+            txt = "Abrir PDF" if item['is_pdf'] else ("Ver Mapa" if item['is_km'] else "Abrir Anexo")
+            if item['is_km'] and obs_final: txt = f"{obs_final} (Ver Mapa)"
+            celulas.append(Celula(txt, 'km_link', link=item['link']))
+        elif item['is_img']:
+            celulas.append(Celula("Ver Aba Comprovantes", 'km_ver_aba'))
+        else:
+            celulas.append(Celula(obs_final if obs_final else "-", 'km_obs'))
+        ws.linha(*celulas)
+
+        if item['is_img']:
+            _comprovante(ws_gal, item)
+        total_val += item['valor']
+
+    ws.linha(*[None] * 5, Celula("TOTAL", 'km_total'), Celula(total_val, 'km_total_moeda'))
+    return planilha
+
+
+def gerar_planilha_km(dados):
+    """Bytes do .xlsx (chamada nos processos do pool do lote)."""
+    saida = io.BytesIO()
+    montar_planilha_km(dados).salvar(saida)
+    return saida.getvalue()
@@ -0,0 +1,166 @@
+import tempfile
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Border, NamedStyle, Side
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+
+# ==========================================
+# PLANILHAS EXCEL EM STREAMING (openpyxl write-only)
+# ==========================================
+# As linhas vão direto para o arquivo temporário do openpyxl, sem manter um
+# objeto Cell por célula na memória: o consumo fica estável com o número de
+# linhas. Os estilos são NamedStyle registrados uma vez por planilha e as
+# células só apontam para eles pelo nome.
+# No modo write-only as larguras das colunas são gravadas antes das linhas,
+# então abas com largura automática são preenchidas duas vezes pela mesma
+# função: a primeira só mede (MedidorLarguras), a segunda escreve (Aba).
+# Sem imports do Django no topo: também roda nos workers do lote de KM.
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+BORDA_FINA = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+FORMATO_MOEDA = 'R$ #,##0.00'
+
+LARGURA_MINIMA = 12
+LARGURA_MAXIMA = 60
+
+
+class Celula:
+    """Valor com estilo nomeado (e link opcional). Valores soltos entram sem estilo."""
+    __slots__ = ('valor', 'estilo', 'link')
+
+    def __init__(self, valor=None, estilo=None, link=None):
+        self.valor = valor
+        self.estilo = estilo
+        self.link = link
+
+
+def _partes(celula):
+    if isinstance(celula, Celula):
+        return celula.valor, celula.estilo, celula.link
+    return celula, None, None
+
+
+class Planilha:
+    """Workbook write-only com os estilos nomeados já registrados."""
+
+    def __init__(self, estilos):
+        self.wb = Workbook(write_only=True)
+        self._negrito = {}
+        for nome, atributos in estilos.items():
+            # Sem fonte explícita fica a padrão da planilha (Calibri 11), como numa célula comum
+            estilo = NamedStyle(name=nome, **{'font': DEFAULT_FONT, **atributos})
+            self.wb.add_named_style(estilo)
+            self._negrito[nome] = bool(estilo.font and estilo.font.b)
+
+    def negrito(self, estilo):
+        return self._negrito.get(estilo, False)
+
+    def aba(self, titulo, larguras=None, sem_grade=False):
+        ws = self.wb.create_sheet(titulo)
+        if sem_grade:
+            ws.sheet_view.showGridLines = False
+        for coluna, largura in (larguras or {}).items():
+            if isinstance(coluna, int):
+                coluna = get_column_letter(coluna)
+            ws.column_dimensions[coluna].width = largura
+        return Aba(ws)
+
+    def aba_ajustada(self, titulo, preencher):
+        """Aba com largura automática: `preencher(saida)` roda uma vez medindo e outra escrevendo."""
+        medidor = MedidorLarguras(self)
+        preencher(medidor)
+        aba = self.aba(titulo, larguras=medidor.larguras())
+        preencher(aba)
+        return aba
+
+    def salvar(self, destino):
+        self.wb.save(destino)
+
+    def resposta(self, nome_arquivo):
+        """Resposta de download lida em blocos de um arquivo temporário (não monta o .xlsx na memória)."""
+        from django.http import FileResponse
+
+        arquivo = tempfile.TemporaryFile()
+        self.wb.save(arquivo)
+        arquivo.seek(0)
+        return FileResponse(arquivo, as_attachment=True, filename=nome_arquivo, content_type=CONTENT_TYPE_XLSX)
+
+
+class Aba:
+    """Escreve linha a linha numa aba write-only, contando a linha atual (base 1)."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.linha_atual = 1
+
+    def linha(self, *celulas):
+        saida = []
+        for celula in celulas:
+            valor, estilo, link = _partes(celula)
+            if estilo is None and link is None:
+                saida.append(valor)
+                continue
+            cell = WriteOnlyCell(self.ws, value=valor)
+            if estilo:
+                cell.style = estilo
+            if link:
+                cell.hyperlink = link
+            saida.append(cell)
+        self.ws.append(saida)
+        self.linha_atual += 1
+
+    def pular(self, linhas=1):
+        for _ in range(linhas):
+            self.ws.append([])
+        self.linha_atual += linhas
+
+    def mesclar(self, linha_inicio, coluna_inicio, linha_fim, coluna_fim):
+        self.ws.merged_cells.add(CellRange(
+            min_row=linha_inicio, min_col=coluna_inicio, max_row=linha_fim, max_col=coluna_fim
+        ))
+
+    def imagem(self, imagem, ancora):
+        self.ws.add_image(imagem, ancora)
+
+
+class MedidorLarguras:
+    """
+    Mesma interface da Aba, mas só mede: maior texto de cada coluna (negrito
+    conta 20% a mais), com a mesma fórmula do antigo auto_adjust_width.
+    """
+
+    def __init__(self, planilha):
+        self.planilha = planilha
+        self.linha_atual = 1
+        self._maiores = {}
+
+    def linha(self, *celulas):
+        for coluna, celula in enumerate(celulas, 1):
+            valor, estilo, _link = _partes(celula)
+            if not valor:
+                continue
+            tamanho = len(str(valor))
+            if self.planilha.negrito(estilo):
+                tamanho *= 1.2
+            if tamanho > self._maiores.get(coluna, 0):
+                self._maiores[coluna] = tamanho
+        self.linha_atual += 1
+
+    def pular(self, linhas=1):
+        self.linha_atual += linhas
+
+    def mesclar(self, *args):
+        pass
+
+    def imagem(self, *args):
+        pass
+
+    def larguras(self):
+        return {
+            coluna: min(max((maior + 2) * 1.1, LARGURA_MINIMA), LARGURA_MAXIMA)
+            for coluna, maior in self._maiores.items()
+        }
@@ -0,0 +1,287 @@
+from datetime import time, timedelta
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, Func, IntegerField, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .calendario import get_datas_competencia
+from .models import Equipe, FolhaPontoStatus, Funcionario, RegistroPonto
+
+# Resumo por equipe fica pouco tempo em cache; assinaturas derrubam a entrada na hora
+RESUMO_EQUIPES_TTL = 60
+
+# Mapeia o prefixo do campo no POST (ex: entrada_1_16) para o campo do model
+CAMPOS_HORARIO = [
+    ('entrada_1', 'entrada_manha'),
+    ('saida_1', 'saida_almoco'),
+    ('entrada_2', 'volta_almoco'),
+    ('saida_2', 'saida_tarde'),
+    ('entrada_extra', 'extra_entrada'),
+    ('saida_extra', 'extra_saida'),
+]
+
+CAMPOS_REGISTRO = [campo for _, campo in CAMPOS_HORARIO] + ['observacao']
+
+
+def _ler_dia_post(dados, dia_num, eh_feriado):
+    """
+    Lê os campos de um dia do POST.
+    Retorna None se o dia veio vazio, False se algum horário é inválido
+    ou um dict {campo_model: valor} pronto para gravar.
+    """
+    brutos = {prefixo: dados.get(f'{prefixo}_{dia_num}', '').strip() for prefixo, _ in CAMPOS_HORARIO}
+    observacoes = dados.get(f'observacoes_{dia_num}', '').strip()
+
+    # Se o campo estiver VAZIO e for FERIADO, preenche automático.
+    # Se o usuário escreveu algo (ex: "Hora Extra"), MANTÉM o que ele escreveu.
+    if not observacoes and eh_feriado:
+        observacoes = "Feriado"
+
+    if not any(brutos.values()) and not observacoes:
+        return None
+
+    valores = {}
+    try:
+        for prefixo, campo in CAMPOS_HORARIO:
+            valor = brutos[prefixo]
+            valores[campo] = time.fromisoformat(valor) if valor else None
+    except ValueError:
+        return False
+
+    valores['observacao'] = observacoes
+    return valores
+
+
+def salvar_registros_competencia(funcionario, data_inicio, data_fim, dados, feriados):
+    """
+    Salva a folha de ponto da competência em lote.
+
+    Carrega os registros do período uma única vez, compara em memória com o
+    POST e aplica inserções, atualizações e remoções com bulk_create,
+    bulk_update e um único delete, tudo dentro de uma transação.
+    Retorna um dict com as quantidades de criados, atualizados e removidos.
+    """
+    with transaction.atomic():
+        existentes = {
+            r.data: r for r in RegistroPonto.objects.select_for_update().filter(
+                funcionario=funcionario,
+                data__range=[data_inicio, data_fim]
+            )
+        }
+
+        novos = []
+        alterados = []
+        ids_remover = []
+
+        delta_dias = (data_fim - data_inicio).days
+        for i in range(delta_dias + 1):
+            data_ponto = data_inicio + timedelta(days=i)
+            valores = _ler_dia_post(dados, data_ponto.day, data_ponto in feriados)
+            registro = existentes.get(data_ponto)
+
+            if valores is None:
+                if registro:
+                    ids_remover.append(registro.id)
+                continue
+
+            # Horário inválido: mantém o que já estava gravado
+            if valores is False:
+                continue
+
+            if registro is None:
+                novos.append(RegistroPonto(funcionario=funcionario, data=data_ponto, **valores))
+                continue
+
+            if any(getattr(registro, campo) != valor for campo, valor in valores.items()):
+                for campo, valor in valores.items():
+                    setattr(registro, campo, valor)
+                alterados.append(registro)
+
+        if novos:
+            RegistroPonto.objects.bulk_create(novos)
+        if alterados:
+            RegistroPonto.objects.bulk_update(alterados, CAMPOS_REGISTRO)
+        if ids_remover:
+            RegistroPonto.objects.filter(id__in=ids_remover).delete()
+
+        if novos or ids_remover:
+            # Muda quem "enviou ponto" na competência (a competência termina em data_fim)
+            invalidar_resumo_equipes(data_fim.month, data_fim.year)
+
+    return {
+        'criados': len(novos),
+        'atualizados': len(alterados),
+        'removidos': len(ids_remover),
+    }
+
+
+# --- SITUAÇÃO DA FOLHA (ASSINATURAS POR COMPETÊNCIA) ---
+# A fonte da verdade é o FolhaPontoStatus. As flags e o anexo em RegistroPonto
+# continuam sendo atualizados para o admin e o download em lote.
+
+def mapa_status_folhas(funcionarios, mes, ano):
+    """{funcionario_id: FolhaPontoStatus} da competência, em uma única consulta."""
+    return {
+        s.funcionario_id: s for s in FolhaPontoStatus.objects.filter(
+            funcionario__in=funcionarios, mes=mes, ano=ano
+        )
+    }
+
+
+def anotar_status_folha(funcionarios, mes, ano):
+    """
+    Anota no queryset de Funcionario a situação da folha da competência
+    (folha_assinada_func, folha_assinada_gestor, folha_arquivo) sem consultas extras por linha.
+    """
+    status = FolhaPontoStatus.objects.filter(funcionario=OuterRef('pk'), mes=mes, ano=ano)
+    return funcionarios.annotate(
+        folha_assinada_func=Exists(status.filter(assinado_funcionario=True)),
+        folha_assinada_gestor=Exists(status.filter(assinado_gestor=True)),
+        folha_arquivo=Subquery(status.values('arquivo')[:1]),
+    )
+
+
+def folha_travada(funcionario, mes, ano):
+    """Folha assinada pelo gestor não pode mais ser editada pelo colaborador."""
+    return FolhaPontoStatus.objects.filter(
+        funcionario=funcionario, mes=mes, ano=ano, assinado_gestor=True
+    ).exists()
+
+
+def _registros_competencia(funcionario, mes, ano):
+    data_inicio, data_fim = get_datas_competencia(mes, ano)
+    return RegistroPonto.objects.filter(funcionario=funcionario, data__range=[data_inicio, data_fim])
+
+
+def registrar_assinatura_funcionario(funcionario, mes, ano, arquivo):
+    """
+    Grava a folha assinada pelo colaborador. Reseta a assinatura do gestor.
+    Retorna False se não há registros de ponto na competência.
+    """
+    with transaction.atomic():
+        registros = _registros_competencia(funcionario, mes, ano)
+        primeiro_reg = registros.select_for_update().first()
+        if primeiro_reg is None:
+            return False
+
+        registros.update(assinado_funcionario=True, assinado_gestor=False)
+        primeiro_reg.arquivo_anexo = arquivo
+        primeiro_reg.save(update_fields=['arquivo_anexo'])
+
+        FolhaPontoStatus.objects.update_or_create(
+            funcionario=funcionario, mes=mes, ano=ano,
+            defaults={
+                'assinado_funcionario': True,
+                'assinado_gestor': False,
+                'arquivo': primeiro_reg.arquivo_anexo.name,
+                'data_assinatura_funcionario': timezone.now(),
+                'data_assinatura_gestor': None,
+            }
+        )
+        invalidar_resumo_equipes(mes, ano)
+    return True
+
+
+def registrar_assinatura_gestor(funcionario, mes, ano, arquivo):
+    """
+    Grava a folha assinada pelo gestor, que trava a edição da competência.
+    Retorna False se não há registros de ponto na competência.
+    """
+    with transaction.atomic():
+        registros = _registros_competencia(funcionario, mes, ano)
+        if not registros.select_for_update().exists():
+            return False
+
+        registros.update(assinado_gestor=True)
+        registro_com_arquivo = registros.exclude(arquivo_anexo='').first()
+        target_reg = registro_com_arquivo if registro_com_arquivo else registros.first()
+        target_reg.arquivo_anexo = arquivo
+        target_reg.save(update_fields=['arquivo_anexo'])
+
+        FolhaPontoStatus.objects.update_or_create(
+            funcionario=funcionario, mes=mes, ano=ano,
+            defaults={
+                'assinado_gestor': True,
+                'arquivo': target_reg.arquivo_anexo.name,
+                'data_assinatura_gestor': timezone.now(),
+            }
+        )
+        invalidar_resumo_equipes(mes, ano)
+    return True
+
+
+def desbloquear_folha(funcionario, mes, ano):
+    """Remove a assinatura do gestor (liberação pelo RH). Retorna False se não havia o que liberar."""
+    with transaction.atomic():
+        registros = _registros_competencia(funcionario, mes, ano)
+        alterados = registros.update(assinado_gestor=False)
+        status_alterados = FolhaPontoStatus.objects.filter(
+            funcionario=funcionario, mes=mes, ano=ano
+        ).update(assinado_gestor=False, data_assinatura_gestor=None)
+        invalidar_resumo_equipes(mes, ano)
+    return bool(alterados or status_alterados)
+
+
+# --- RESUMO POR EQUIPE (DASHBOARDS DO RH) ---
+
+class _Contagem(Func):
+    """COUNT(*) de uma subconsulta correlacionada (sem GROUP BY no query externo)."""
+    template = 'COUNT(*)'
+    output_field = IntegerField()
+
+
+def _contar(queryset):
+    return Subquery(queryset.order_by().annotate(n=_Contagem()).values('n')[:1], output_field=IntegerField())
+
+
+def _chave_resumo(mes, ano):
+    return f"core_rh:resumo_equipes:{ano}:{int(mes):02d}"
+
+
+def invalidar_resumo_equipes(mes, ano):
+    chave = _chave_resumo(mes, ano)
+    transaction.on_commit(lambda: cache.delete(chave))
+
+
+def resumo_equipes_competencia(mes, ano):
+    """
+    {equipe_id: {'total_membros', 'total_com_ponto', 'total_assinados'}} de todas as
+    equipes visíveis, contando membros da equipe principal e das secundárias.
+    Tudo sai de uma única consulta agregada, guardada em cache por competência.
+    """
+    chave = _chave_resumo(mes, ano)
+    resumo = cache.get(chave)
+    if resumo is not None:
+        return resumo
+
+    data_inicio, data_fim = get_datas_competencia(mes, ano)
+
+    # Membro = equipe principal OU vínculo em outras_equipes (via EXISTS, sem duplicar linhas)
+    vinculo_secundario = Funcionario.outras_equipes.through.objects.filter(
+        funcionario=OuterRef('pk'), equipe=OuterRef(OuterRef('pk'))
+    )
+    membros = Funcionario.objects.filter(Q(equipe=OuterRef('pk')) | Exists(vinculo_secundario))
+
+    com_ponto = RegistroPonto.objects.filter(
+        funcionario=OuterRef('pk'), data__range=[data_inicio, data_fim]
+    )
+    assinados = FolhaPontoStatus.objects.filter(
+        funcionario=OuterRef('pk'), mes=mes, ano=ano, assinado_gestor=True
+    )
+
+    linhas = Equipe.objects.filter(oculta=False).annotate(
+        total_membros=_contar(membros),
+        total_com_ponto=_contar(membros.filter(Exists(com_ponto))),
+        total_assinados=_contar(membros.filter(Exists(assinados))),
+    ).values_list('id', 'total_membros', 'total_com_ponto', 'total_assinados')
+
+    resumo = {
+        equipe_id: {
+            'total_membros': total_membros or 0,
+            'total_com_ponto': total_com_ponto or 0,
+            'total_assinados': total_assinados or 0,
+        }
+        for equipe_id, total_membros, total_com_ponto, total_assinados in linhas
+    }
+    cache.set(chave, resumo, RESUMO_EQUIPES_TTL)
+    return resumo
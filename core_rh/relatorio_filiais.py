@@ -0,0 +1,131 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, ExtractYear, TruncMonth, TruncWeek
+
+from .models import ControleKM, DespesaDiversa, Equipe, Funcionario
+
+# ==========================================
+# TOTAIS DO RELATÓRIO CUSTOMIZADO (POR FILIAL)
+# ==========================================
+# Os totais por mês, semana e dia saem de consultas agrupadas no banco
+# (funcionário x tipo x período), não de um loop sobre cada lançamento: a
+# memória acompanha funcionários x períodos, não o número de KMs/despesas.
+# A filial de cada funcionário é resolvida antes, numa passada só pelas
+# equipes (principal primeiro, depois outras_equipes).
+
+_ZERO = Value(Decimal('0'))
+
+# granularidade -> (campos do GROUP BY, chave do período usada nas abas)
+PERIODOS = {
+    'mensal': (
+        lambda: {'periodo': TruncMonth('data')},
+        lambda linha: linha['periodo'].strftime('%m/%Y'),
+    ),
+    # Semana ISO com o ano civil da data, como o relatório sempre rotulou
+    'semanal': (
+        lambda: {'periodo': TruncWeek('data'), 'ano': ExtractYear('data')},
+        lambda linha: f"{linha['periodo'].isocalendar()[1]}/{linha['ano']}",
+    ),
+    # "data" já é o dia (DateField): agrupa por ela direto
+    'diario': (
+        lambda: {'periodo': F('data')},
+        lambda linha: linha['periodo'].strftime('%d/%m/%Y'),
+    ),
+}
+
+
+def _nome_filial(nome_equipe):
+    # Ex: "Campo CIAUSRE" -> "CIAUSRE"
+    return nome_equipe.replace("Campo ", "").replace("campo ", "")
+
+
+def filiais_dos_funcionarios(equipes_ids):
+    """{funcionario_id: (nome, filial)} de quem está nas equipes escolhidas."""
+    equipes = dict(Equipe.objects.filter(id__in=equipes_ids).values_list('id', 'nome'))
+    funcionarios = {
+        funcionario_id: (nome, _nome_filial(equipes[equipe_id]))
+        for funcionario_id, nome, equipe_id in Funcionario.objects.filter(equipe_id__in=equipes)
+        .values_list('id', 'nome_completo', 'equipe_id')
+    }
+    membros = (
+        Funcionario.outras_equipes.through.objects.filter(equipe_id__in=equipes)
+        .order_by('equipe_id').values_list('funcionario_id', 'funcionario__nome_completo', 'equipe_id')
+    )
+    for funcionario_id, nome, equipe_id in membros:
+        # A equipe principal tem prioridade; entre as outras, vale a de menor id
+        funcionarios.setdefault(funcionario_id, (nome, _nome_filial(equipes[equipe_id])))
+    return funcionarios
+
+
+def _valor_km():
+    return ExpressionWrapper(
+        F('total_km') * Coalesce(F('funcionario__valor_km'), _ZERO),
+        output_field=DecimalField(max_digits=16, decimal_places=4),
+    )
+
+
+def _somas(kms, despesas, granularidade):
+    """(funcionario_id, tipo, período, valor) agrupados no banco."""
+    campos, chave = PERIODOS[granularidade]
+    for linha in kms.values('funcionario_id', **campos()).annotate(total=Sum(_valor_km())).order_by():
+        yield linha['funcionario_id'], 'KM', chave(linha), float(linha['total'] or 0)
+    for linha in (despesas.values('funcionario_id', 'tipo', **campos())
+                  .annotate(total=Sum(Coalesce('valor', _ZERO))).order_by()):
+        yield linha['funcionario_id'], linha['tipo'], chave(linha), float(linha['total'] or 0)
+
+
+def totais_relatorio_filiais(equipes_ids, data_inicio, data_fim):
+    """
+    Totais do período por filial e por funcionário, no formato que as abas do
+    relatório customizado usam: {'global', 'filiais', 'meses', 'semanas',
+    'dias', 'tipos'} (listas já ordenadas, KM primeiro entre os tipos).
+    """
+    funcionarios = filiais_dos_funcionarios(equipes_ids)
+    no_periodo = dict(
+        funcionario__in=Funcionario.objects.filter(Q(equipe_id__in=equipes_ids) | Q(outras_equipes__in=equipes_ids)).values('id'),
+        data__range=[data_inicio, data_fim],
+    )
+    kms = ControleKM.objects.filter(**no_periodo).exclude(status='Rejeitado')
+    despesas = DespesaDiversa.objects.filter(**no_periodo).exclude(status='Rejeitado')
+
+    global_data = defaultdict(lambda: {
+        'total_periodo': 0.0,
+        'mensal': defaultdict(float),
+        'semanal': defaultdict(float),
+        'diario': defaultdict(float)
+    })
+    team_data = defaultdict(lambda: defaultdict(lambda: {
+        'total_periodo': 0.0,
+        'tipos': defaultdict(float),
+        'mensal': defaultdict(lambda: defaultdict(float)),
+        'semanal': defaultdict(lambda: defaultdict(float)),
+        'diario': defaultdict(lambda: defaultdict(float))
+    }))
+    periodos = {granularidade: set() for granularidade in PERIODOS}
+    tipos = set()
+
+    for granularidade in PERIODOS:
+        for funcionario_id, tipo, periodo, valor in _somas(kms, despesas, granularidade):
+            nome, filial = funcionarios.get(funcionario_id, ('', 'Indefinida'))
+            ref = team_data[filial][nome]
+            global_data[filial][granularidade][periodo] += valor
+            ref[granularidade][periodo][tipo] += valor
+            if granularidade == 'mensal':
+                # Cada lançamento cai em um mês só: os totais saem daqui
+                global_data[filial]['total_periodo'] += valor
+                ref['total_periodo'] += valor
+                ref['tipos'][tipo] += valor
+            periodos[granularidade].add(periodo)
+            tipos.add(tipo)
+
+    return {
+        'global': global_data,
+        'filiais': team_data,
+        'meses': sorted(periodos['mensal'], key=lambda x: datetime.strptime(x, '%m/%Y')),
+        'semanas': sorted(periodos['semanal'], key=lambda x: (int(x.split('/')[1]), int(x.split('/')[0]))),
+        'dias': sorted(periodos['diario'], key=lambda x: datetime.strptime(x, '%d/%m/%Y')),
+        'tipos': (['KM'] if 'KM' in tipos else []) + sorted(tipos - {'KM'}),
+    }
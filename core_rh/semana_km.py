@@ -0,0 +1,178 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.db.models.functions import TruncWeek
+
+from .models import ControleKM, DespesaDiversa, Funcionario, LancamentoSemanalKM
+
+# ==========================================
+# LANÇAMENTO SEMANAL DE KM/DESPESAS (POR TÉCNICO E SEMANA)
+# ==========================================
+# Área do gestor, PDF de pagamento, lote de KM e aprovação em lote leem os
+# totais da semana de LancamentoSemanalKM (uma linha por técnico), em vez de
+# somar KMs e despesas de cada um. Cada escrita em ControleKM/DespesaDiversa
+# recalcula só a semana afetada (signal, depois do commit); quem atualiza em
+# massa com .update() chama agendar_semanas. Os totais vêm de
+# ControleKM.total_km: trechos não entram na conta.
+# O valor do KM fica gravado na linha; mudar o do funcionário só atualiza as
+# semanas ainda não pagas, e o recálculo de uma semana paga (signal, .update()
+# ou `manage.py atualizar_lancamentos_km`) mantém o valor que já estava nela.
+
+# Padrão quando o funcionário não tem valor do KM cadastrado
+VALOR_KM_PADRAO = Decimal('1.20')
+
+# Ordem de prioridade do status consolidado da semana (o primeiro encontrado vence)
+PRIORIDADE_STATUS_KM = [
+    ('Rejeitado', 'Rejeitado'),
+    ('Pendente', 'Pendente'),
+    ('Aprovado_Regional', 'Aprovado_Regional'),
+    ('Aprovado_Matriz', 'Aprovado_Matriz'),
+    ('Aprovado_Financeiro', 'Aprovado_Financeiro'),
+    ('Pago', 'Pago'),
+    ('Aprovado', 'Aprovado_Matriz'),
+]
+
+CAMPOS_CALCULADOS = [
+    'total_km', 'total_despesas', 'valor_km', 'valor_a_pagar', 'status',
+    'qtd_kms', 'qtd_despesas', 'primeiro_km', 'atualizado_em',
+]
+
+
+def inicio_semana(data):
+    """Segunda-feira da semana ISO da data (aceita 'AAAA-MM-DD', como vem do formulário)."""
+    if isinstance(data, str):
+        data = datetime.strptime(data, '%Y-%m-%d').date()
+    elif isinstance(data, datetime):
+        data = data.date()
+    return data - timedelta(days=data.weekday())
+
+
+def valor_km_efetivo(valor_km):
+    return valor_km if valor_km and valor_km > 0 else VALOR_KM_PADRAO
+
+
+def status_consolidado(status_presentes):
+    """O status mais "atrasado" entre os lançamentos da semana."""
+    for status, exibido in PRIORIDADE_STATUS_KM:
+        if status in status_presentes:
+            return exibido
+    return 'Vazio'
+
+
+def _somar_por_status(modelo, campo_valor, funcionario_ids, inicio):
+    """{funcionario_id: [(status, total, qtd, menor id)]} da semana, num GROUP BY só."""
+    linhas = defaultdict(list)
+    consulta = (
+        modelo.objects.filter(funcionario_id__in=funcionario_ids, data__range=[inicio, inicio + timedelta(days=6)])
+        .values('funcionario_id', 'status')
+        .annotate(total=Sum(campo_valor), qtd=Count('id'), menor_id=Min('id'))
+        .order_by()
+    )
+    for linha in consulta:
+        linhas[linha['funcionario_id']].append((linha['status'], linha['total'] or 0, linha['qtd'], linha['menor_id']))
+    return linhas
+
+
+def recalcular_semanas(funcionario_ids, inicio):
+    """Recalcula a semana de `inicio` de cada funcionário com cinco consultas, qualquer que seja a equipe."""
+    funcionario_ids = set(funcionario_ids)
+    inicio = inicio_semana(inicio)
+    kms = _somar_por_status(ControleKM, 'total_km', funcionario_ids, inicio)
+    despesas = _somar_por_status(DespesaDiversa, 'valor', funcionario_ids, inicio)
+    valores_km = dict(Funcionario.objects.filter(id__in=funcionario_ids).values_list('id', 'valor_km'))
+    # Semana paga (agora ou antes) guarda o valor do KM da época
+    valores_pagos = dict(
+        LancamentoSemanalKM.objects.filter(funcionario_id__in=funcionario_ids, inicio=inicio, status='Pago')
+        .values_list('funcionario_id', 'valor_km')
+    )
+
+    lancamentos = []
+    for funcionario_id, valor_km in valores_km.items():
+        linhas_km = kms.get(funcionario_id, [])
+        linhas_despesa = despesas.get(funcionario_id, [])
+        if not linhas_km and not linhas_despesa:
+            continue
+        valor_km = valores_pagos.get(funcionario_id) or valor_km_efetivo(valor_km)
+        total_km = sum(total for status, total, _, _ in linhas_km if status != 'Rejeitado')
+        total_despesas = sum(total for status, total, _, _ in linhas_despesa if status != 'Rejeitado')
+        lancamentos.append(LancamentoSemanalKM(
+            funcionario_id=funcionario_id, inicio=inicio,
+            total_km=total_km, total_despesas=total_despesas, valor_km=valor_km,
+            valor_a_pagar=total_km * valor_km + total_despesas,
+            status=status_consolidado({linha[0] for linha in linhas_km + linhas_despesa}),
+            qtd_kms=sum(linha[2] for linha in linhas_km),
+            qtd_despesas=sum(linha[2] for linha in linhas_despesa),
+            primeiro_km_id=min((linha[3] for linha in linhas_km), default=None),
+        ))
+
+    with transaction.atomic():
+        # Semana que ficou sem lançamentos (excluídos ou movidos de data) sai do livro
+        (LancamentoSemanalKM.objects.filter(funcionario_id__in=funcionario_ids, inicio=inicio)
+         .exclude(funcionario_id__in=[lancamento.funcionario_id for lancamento in lancamentos]).delete())
+        LancamentoSemanalKM.objects.bulk_create(
+            lancamentos, update_conflicts=True,
+            unique_fields=['funcionario', 'inicio'], update_fields=CAMPOS_CALCULADOS,
+        )
+    return lancamentos
+
+
+def agendar_semanas(funcionario_ids, data):
+    funcionario_ids = list(funcionario_ids)
+    transaction.on_commit(lambda: recalcular_semanas(funcionario_ids, data))
+
+
+def agendar_semana(funcionario_id, data):
+    agendar_semanas([funcionario_id], data)
+
+
+def agendar_recalculo(lancamentos):
+    """Agenda o recálculo das semanas de vários (funcionario_id, data), agrupados por semana."""
+    semanas = defaultdict(set)
+    for funcionario_id, data in lancamentos:
+        semanas[inicio_semana(data)].add(funcionario_id)
+    for inicio, funcionario_ids in semanas.items():
+        agendar_semanas(funcionario_ids, inicio)
+
+
+def aplicar_valor_km(funcionario_ids, valor_km):
+    """Novo valor do KM nas semanas ainda não pagas (as pagas guardam o valor da época)."""
+    if valor_km is not None:
+        valor_km = Decimal(str(valor_km)).quantize(Decimal('0.01'))
+    valor_km = valor_km_efetivo(valor_km)
+    return (
+        LancamentoSemanalKM.objects.filter(funcionario_id__in=funcionario_ids)
+        .exclude(status='Pago').exclude(valor_km=valor_km)
+        .update(valor_km=valor_km, valor_a_pagar=F('total_km') * valor_km + F('total_despesas'))
+    )
+
+
+def lancamentos_da_semana(funcionarios, inicio):
+    """{funcionario_id: LancamentoSemanalKM} da semana (uma consulta)."""
+    return {
+        lancamento.funcionario_id: lancamento
+        for lancamento in LancamentoSemanalKM.objects.filter(funcionario__in=funcionarios, inicio=inicio_semana(inicio))
+    }
+
+
+def lancamentos_da_equipe(equipe, inicio):
+    """Lançamentos da semana dos técnicos da equipe (principal ou secundária), por nome."""
+    membros = Funcionario.objects.filter(Q(equipe=equipe) | Q(outras_equipes=equipe)).values('id')
+    return list(
+        LancamentoSemanalKM.objects.filter(funcionario__in=membros, inicio=inicio_semana(inicio))
+        .select_related('funcionario').order_by('funcionario__nome_completo', 'funcionario_id')
+    )
+
+
+def semanas_com_lancamentos(desde=None):
+    """{segunda-feira: {funcionario_id}} de tudo que tem KM ou despesa (para o recálculo completo)."""
+    semanas = defaultdict(set)
+    for modelo in (ControleKM, DespesaDiversa):
+        consulta = modelo.objects.all()
+        if desde:
+            consulta = consulta.filter(data__gte=desde)
+        for funcionario_id, inicio in consulta.values_list('funcionario_id', TruncWeek('data')).distinct().order_by():
+            semanas[inicio_semana(inicio)].add(funcionario_id)
+    return semanas
@@ -0,0 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+# Pool compartilhado do processo para trabalhos pesados fora da thread do request
+# (renderização de PDF, carimbos etc). O tamanho pode ser ajustado no settings.
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'RH_TAREFAS_WORKERS', 2),
+    thread_name_prefix='core_rh_tarefa',
+)
+
+
+def _executar(funcao, args, kwargs):
+    # Cada thread do pool abre sua própria conexão; fecha as velhas antes e depois
+    close_old_connections()
+    try:
+        return funcao(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def executar_em_segundo_plano(funcao, *args, **kwargs):
+    """Agenda `funcao` no pool de tarefas e devolve o Future."""
+    return _executor.submit(_executar, funcao, args, kwargs)
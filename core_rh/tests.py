@@ -1,3 +1,724 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
+from . import arquivos, contracheque_service, indice_documentos, lote_km, pdf_ponto
+from .papeis import papeis_do_usuario
+from .contracheque_service import atualizar_resumo_competencia
+from .divisao_contracheques import DivisorFolha
+from .models import (
+    Cargo, Contracheque, ControleKM, DespesaDiversa, Equipe, FolhaPontoStatus, Funcionario, LancamentoSemanalKM,
+    ProcessamentoContracheque, ResumoContracheque,
+)
+from .zip_stream import gerar_zip_streaming
+
+try:
+    import boto3
+    from moto import mock_aws
+    from storages.backends.s3 import S3Storage
+except ImportError:
+    mock_aws = None
+
+
+def criar_funcionario(nome, equipe=None, **campos):
+    usuario = User.objects.create_user(nome.replace(' ', '').lower(), password='x')
+    cargo, _ = Cargo.objects.get_or_create(titulo='Técnico')
+    return Funcionario.objects.create(
+        usuario=usuario, nome_completo=nome, email=f'{usuario.username}@teste.com',
+        cpf=str(usuario.id).zfill(11), cargo=cargo, equipe=equipe, primeiro_acesso=False, **campos
+    )
+
+
+# ==========================================
+# ACESSO A ANEXOS (arquivos)
+# ==========================================
+
+class _LeituraArquivosMixin:
+    conteudo = os.urandom(3 * arquivos.TAMANHO_BLOCO + 10)
+
+    def anexo(self, nome):
+        return SimpleNamespace(name=nome, storage=self.storage)
+
+    def test_ler_blocos_devolve_o_arquivo_em_blocos(self):
+        blocos = list(arquivos.ler_blocos(self.anexo(self.nome)))
+        self.assertGreater(len(blocos), 1)
+        self.assertTrue(all(len(bloco) <= arquivos.TAMANHO_BLOCO for bloco in blocos))
+        self.assertEqual(b''.join(blocos), self.conteudo)
+
+    def test_ler_intervalo_le_so_a_faixa(self):
+        anexo = self.anexo(self.nome)
+        self.assertEqual(arquivos.ler_intervalo(anexo, 10, 20), self.conteudo[10:20])
+        self.assertEqual(arquivos.ler_intervalo(anexo, len(self.conteudo) - 5), self.conteudo[-5:])
+        self.assertEqual(arquivos.ler_intervalo(anexo, 20, 20), b'')
+
+    def test_abridor_alimenta_o_zip(self):
+        entradas = [
+            ('anexo.bin', arquivos.abridor(self.anexo(self.nome))),
+            ('falta.bin', arquivos.abridor(self.anexo('nao/existe.bin'))),
+        ]
+        with zipfile.ZipFile(io.BytesIO(b''.join(gerar_zip_streaming(entradas)))) as zip_file:
+            self.assertEqual(zip_file.namelist(), ['anexo.bin'])
+            self.assertEqual(zip_file.read('anexo.bin'), self.conteudo)
+
+
+class FaixaSolicitadaTests(SimpleTestCase):
+    def test_cabecalho_range(self):
+        self.assertIsNone(arquivos.faixa_solicitada(None, 100))
+        self.assertIsNone(arquivos.faixa_solicitada('bytes=0-1,5-9', 100))
+        self.assertEqual(arquivos.faixa_solicitada('bytes=10-19', 100), (10, 20))
+        self.assertEqual(arquivos.faixa_solicitada('bytes=90-', 100), (90, 100))
+        self.assertEqual(arquivos.faixa_solicitada('bytes=-30', 100), (70, 100))
+        self.assertEqual(arquivos.faixa_solicitada('bytes=95-500', 100), (95, 100))
+        with self.assertRaises(ValueError):
+            arquivos.faixa_solicitada('bytes=100-', 100)
+
+
+class ArquivosDiscoTests(_LeituraArquivosMixin, SimpleTestCase):
+    def setUp(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        self.storage = FileSystemStorage(location=pasta)
+        self.nome = self.storage.save('comprovantes/teste.bin', ContentFile(self.conteudo))
+
+
+@skipUnless(mock_aws, "boto3, moto e django-storages não estão instalados")
+class ArquivosS3Tests(_LeituraArquivosMixin, SimpleTestCase):
+    def setUp(self):
+        simulacao = mock_aws()
+        simulacao.start()
+        self.addCleanup(simulacao.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='anexos')
+        self.storage = S3Storage(bucket_name='anexos', region_name='us-east-1', access_key='x', secret_key='x')
+        self.nome = self.storage.save('comprovantes/teste.bin', ContentFile(self.conteudo))
+        # storage.open baixa o objeto inteiro: a leitura tem que ir pelo corpo da resposta
+        bloqueio = mock.patch.object(S3Storage, 'open', side_effect=AssertionError("storage.open no S3"))
+        bloqueio.start()
+        self.addCleanup(bloqueio.stop)
+
+
+# ==========================================
+# PAPÉIS DO USUÁRIO
+# ==========================================
+
+class PapelCampoTests(TestCase):
+    def papeis(self, funcionario):
+        return papeis_do_usuario(User.objects.get(pk=funcionario.usuario_id))
+
+    def test_campo_exato_na_principal_e_sem_caixa_nas_secundarias(self):
+        minuscula = Equipe.objects.create(nome='campo sul')
+        self.assertTrue(self.papeis(criar_funcionario('Principal Campo', equipe=Equipe.objects.create(nome='Campo Sul')))['campo'])
+        self.assertFalse(self.papeis(criar_funcionario('Principal Minuscula', equipe=minuscula))['campo'])
+
+        secundario = criar_funcionario('Secundario Campo')
+        secundario.outras_equipes.add(minuscula)
+        self.assertTrue(self.papeis(secundario)['campo'])
+
+
+    def test_papel_revogado_vale_no_request_seguinte(self):
+        # A versão dos papéis precisa estar num cache que todos os workers enxergam
+        self.assertNotIsInstance(cache, LocMemCache)
+        funcionario = criar_funcionario('Ex RH')
+        rh, _ = Group.objects.get_or_create(name='RH')
+        funcionario.usuario.groups.add(rh)
+        self.client.force_login(funcionario.usuario)
+        self.assertTrue(self.client.get(reverse('home')).context['can_access_rh_area'])
+
+        funcionario.usuario.groups.remove(rh)
+        self.assertFalse(self.client.get(reverse('home')).context['can_access_rh_area'])
+
+
+# ==========================================
+# PRIMEIRO ACESSO (middleware)
+# ==========================================
+
+class PrimeiroAcessoMiddlewareTests(TestCase):
+    def setUp(self):
+        # Desligado no settings do projeto: liga só aqui
+        self.enterContext(self.modify_settings(MIDDLEWARE={'append': 'core_rh.middleware.TrocaSenhaObrigatoriaMiddleware'}))
+
+    def test_cabecalho_de_diagnostico_so_com_debug(self):
+        self.client.force_login(criar_funcionario('Acesso Debug').usuario)
+        self.assertNotIn('X-Primeiro-Acesso', self.client.get(reverse('home')))
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse('home'))['X-Primeiro-Acesso'], 'sessao')
+
+
+# ==========================================
+# ÁREA DO GESTOR
+# ==========================================
+
+class AreaGestorConsultasTests(TestCase):
+    def setUp(self):
+        self.gestor = criar_funcionario('Gestor Area')
+        self.equipe_ponto = Equipe.objects.create(nome='Equipe Ponto', gestor=self.gestor)
+        self.equipe_km = Equipe.objects.create(nome='Campo Km', gestor=self.gestor, oculta=True)
+        self.client.force_login(self.gestor.usuario)
+        self.url = reverse('area_gestor') + '?mes=5&ano=2026&semana=1&km_team=%d' % self.equipe_km.id
+
+    def adicionar_tecnicos(self, quantidade):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(quantidade):
+                tecnico = criar_funcionario(f'Tecnico {Funcionario.objects.count()}', equipe=self.equipe_ponto)
+                tecnico.outras_equipes.add(self.equipe_km)
+                FolhaPontoStatus.objects.create(funcionario=tecnico, mes=5, ano=2026, assinado_funcionario=True)
+                ControleKM.objects.create(
+                    funcionario=tecnico, data=date(2026, 4, 27), total_km=Decimal('10'), numero_chamado='1'
+                )
+
+    def test_consultas_nao_crescem_com_a_equipe(self):
+        self.adicionar_tecnicos(2)
+        self.client.get(self.url)  # sessão e cache de papéis já aquecidos nas duas medições
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(self.url)
+        self.assertEqual(len(resposta.context['lista_ponto']), 2)
+        self.assertEqual(len(resposta.context['dados_km_semana_atual']), 2)
+
+        self.adicionar_tecnicos(18)
+        with self.assertNumQueries(len(consultas)):
+            resposta = self.client.get(self.url)
+        self.assertEqual(len(resposta.context['lista_ponto']), 20)
+        self.assertEqual(len(resposta.context['dados_km_semana_atual']), 20)
+
+
+# ==========================================
+# IMPORTAÇÃO DE CONTRACHEQUES
+# ==========================================
+
+class _MidiaTemporariaMixin:
+    def setUp(self):
+        super().setUp()
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        self.enterContext(self.settings(MEDIA_ROOT=pasta))
+
+    def gravar(self, nome, idade=None):
+        """Grava um arquivo na mídia; `idade` (timedelta) envelhece a data de modificação."""
+        nome = default_storage.save(nome, ContentFile(b'%PDF-1.4'))
+        if idade:
+            antigo = (timezone.now() - idade).timestamp()
+            os.utime(default_storage.path(nome), (antigo, antigo))
+        return nome
+
+
+
+def _folha_pagamento(paginas):
+    """PDF de folha com uma página por (nome, linha de proventos)."""
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, invariant=1)
+    for nome, provento in paginas:
+        pdf.drawString(50, 760, 'RECIBO DE PAGAMENTO DE SALARIO')
+        pdf.drawString(50, 740, f'Empregado: {nome.upper()}')
+        pdf.drawString(50, 700, provento)
+        pdf.drawString(60, 120, 'DATA DO RECEBIMENTO')
+        pdf.drawString(360, 120, 'ASSINATURA DO EMPREGADO')
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+class _DivisaoFolhaMixin(_MidiaTemporariaMixin):
+    """Processamentos de verdade (divisor no próprio processo, uma página por faixa)."""
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(self.settings(RH_CONTRACHEQUE_PROCESSOS=1))
+        self.enterContext(mock.patch.object(contracheque_service, 'PAGINAS_POR_FAIXA', 1))
+
+    def criar_processamento(self, paginas, mes=5, ano=2026):
+        processamento = ProcessamentoContracheque(mes=mes, ano=ano)
+        processamento.arquivo.save('folha.pdf', ContentFile(_folha_pagamento(paginas)), save=False)
+        processamento.save()
+        return processamento
+
+    def processar(self, paginas, mes=5, ano=2026):
+        processamento = self.criar_processamento(paginas, mes, ano)
+        self.assertTrue(contracheque_service.processar_lote_contracheques(processamento.pk))
+        processamento.refresh_from_db()
+        return processamento
+
+
+class RetomadaProcessamentoTests(_DivisaoFolhaMixin, TestCase):
+    def test_retoma_so_as_faixas_que_faltavam(self):
+        nomes = ['Alice Retomada', 'Bruno Retomada', 'Carla Retomada']
+        for nome in nomes:
+            criar_funcionario(nome)
+        processamento = self.criar_processamento([(nome, 'SALARIO BASE 3.450,00') for nome in nomes])
+
+        gravar_faixa = contracheque_service._gravar_faixa
+
+        def cair_na_segunda(processamento, inicio, *args):
+            if inicio == 1:
+                raise RuntimeError('worker reiniciado')
+            return gravar_faixa(processamento, inicio, *args)
+
+        with mock.patch.object(contracheque_service, '_gravar_faixa', cair_na_segunda), mock.patch('builtins.print'):
+            self.assertFalse(contracheque_service.processar_lote_contracheques(processamento.pk))
+        processamento.refresh_from_db()
+        self.assertEqual(processamento.status, 'Erro')
+        self.assertEqual(processamento.faixas_concluidas, [0])
+
+        processar = DivisorFolha.processar
+        faixas = []
+
+        def registrar(divisor, inicio, fim):
+            faixas.append(inicio)
+            return processar(divisor, inicio, fim)
+
+        with mock.patch.object(DivisorFolha, 'processar', registrar):
+            self.assertTrue(contracheque_service.processar_lote_contracheques(processamento.pk, incluir_erro=True))
+        processamento.refresh_from_db()
+
+        self.assertEqual(faixas, [1, 2])
+        self.assertEqual(processamento.status, 'Concluido')
+        self.assertEqual(processamento.paginas_processadas, 3)
+        self.assertCountEqual(
+            Contracheque.objects.filter(mes=5, ano=2026).values_list('funcionario__nome_completo', flat=True), nomes
+        )
+
+class ConsolidacaoContrachequesTests(_DivisaoFolhaMixin, TestCase):
+    def test_reenvio_grava_num_upsert_e_apaga_os_arquivos_antigos(self):
+        nomes = ['Ana Upsert', 'Beto Upsert']
+        for nome in nomes:
+            criar_funcionario(nome)
+        self.processar([(nome, 'SALARIO BASE 1.000,00') for nome in nomes])
+        antigos = dict(Contracheque.objects.values_list('pk', 'arquivo'))
+        antigo = (timezone.now() - timedelta(days=1)).timestamp()
+        for nome in antigos.values():
+            os.utime(default_storage.path(nome), (antigo, antigo))
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as consultas:
+            self.processar([(nome, 'SALARIO BASE 2.000,00') for nome in nomes])
+
+        escritas = [
+            q['sql'] for q in consultas.captured_queries
+            if '"core_rh_contracheque"' in q['sql'] and q['sql'].startswith(('INSERT', 'UPDATE'))
+        ]
+        self.assertEqual(len(escritas), 1)
+        self.assertIn('ON CONFLICT', escritas[0])
+
+        atuais = dict(Contracheque.objects.values_list('pk', 'arquivo'))
+        self.assertEqual(atuais.keys(), antigos.keys())
+        for pk, nome in antigos.items():
+            self.assertNotEqual(atuais[pk], nome)
+            self.assertFalse(default_storage.exists(nome), nome)
+            self.assertTrue(default_storage.exists(atuais[pk]), atuais[pk])
+
+class ReenvioIncrementalTests(_DivisaoFolhaMixin, TestCase):
+    def test_pula_paginas_iguais_e_monta_o_comparativo(self):
+        for nome in ('Igual Reenvio', 'Muda Reenvio', 'Some Reenvio', 'Novo Reenvio'):
+            criar_funcionario(nome)
+        self.processar([
+            ('Igual Reenvio', 'SALARIO BASE 1.000,00'),
+            ('Muda Reenvio', 'SALARIO BASE 1.000,00'),
+            ('Some Reenvio', 'SALARIO BASE 1.000,00'),
+        ])
+        antes = dict(Contracheque.objects.values_list('funcionario__nome_completo', 'arquivo'))
+
+        processamento = self.processar([
+            ('Igual Reenvio', 'SALARIO BASE 1.000,00'),
+            ('Muda Reenvio', 'SALARIO BASE 1.500,00'),
+            ('Novo Reenvio', 'SALARIO BASE 1.000,00'),
+        ])
+
+        self.assertEqual(processamento.resultado['comparativo'], {
+            'novos': ['Novo Reenvio'], 'alterados': ['Muda Reenvio'],
+            'inalterados': ['Igual Reenvio'], 'ausentes': ['Some Reenvio'],
+        })
+        # A página igual não foi regravada: nenhum arquivo novo, o contracheque aponta para o mesmo
+        self.assertEqual(list(processamento.resultado['inalterados']), ['1'])
+        self.assertNotIn('1', processamento.resultado['arquivos'])
+        depois = dict(Contracheque.objects.values_list('funcionario__nome_completo', 'arquivo'))
+        self.assertEqual(depois['Igual Reenvio'], antes['Igual Reenvio'])
+        self.assertNotEqual(depois['Muda Reenvio'], antes['Muda Reenvio'])
+        self.assertEqual(depois['Some Reenvio'], antes['Some Reenvio'])
+
+class LimpezaArquivosOrfaosTests(_MidiaTemporariaMixin, TestCase):
+    def test_apaga_so_orfaos_antigos_fora_do_carimbo(self):
+        velho = timedelta(days=1)
+        em_uso = self.gravar('contracheques/2026/5/em_uso.pdf', velho)
+        Contracheque.objects.create(funcionario=criar_funcionario('Com Arquivo'), mes=5, ano=2026, arquivo=em_uso)
+        carimbando = criar_funcionario('Carimbando')
+        Contracheque.objects.create(
+            funcionario=carimbando, mes=5, ano=2026, arquivo=self.gravar('contracheques/2026/5/original.pdf', velho),
+            status_carimbo='Processando',
+        )
+        # Carimbo salvou o PDF assinado, mas ainda não fez o UPDATE que aponta para ele
+        assinado = self.gravar(f'contracheques/2026/5/1_holerite_{carimbando.id}_5_2026_assinado.pdf', velho)
+        recente = self.gravar('contracheques/2026/5/recente.pdf')
+        orfao = self.gravar('contracheques/2026/5/substituido.pdf', velho)
+
+        self.assertEqual(contracheque_service.limpar_arquivos_orfaos(5, 2026), 1)
+
+        self.assertFalse(default_storage.exists(orfao))
+        for nome in (em_uso, 'contracheques/2026/5/original.pdf', assinado, recente):
+            self.assertTrue(default_storage.exists(nome), nome)
+
+
+
+def _folha_com_imagens(paginas):
+    """PDF em que todas as páginas compartilham as imagens de todas, mas cada uma desenha só a sua."""
+    from PIL import Image
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import DictionaryObject, NameObject
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pageCompression=0)
+    for i in range(paginas):
+        imagem = Image.frombytes('RGB', (64, 64), os.urandom(64 * 64 * 3))
+        pdf.drawImage(ImageReader(imagem), 50, 600)
+        pdf.drawString(50, 500, f'Empregado {i}')
+        pdf.showPage()
+    pdf.save()
+
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(buffer.getvalue())))
+    todas = DictionaryObject()
+    for page in writer.pages:
+        todas.update(page['/Resources']['/XObject'].get_object())
+    referencia = writer._add_object(todas)
+    for page in writer.pages:
+        page['/Resources'][NameObject('/XObject')] = referencia
+    saida = io.BytesIO()
+    writer.write(saida)
+    return saida.getvalue()
+
+
+class CompactacaoPdfTests(SimpleTestCase):
+    def test_economia_estimada_sem_gravar_de_novo(self):
+        from pypdf import PdfReader
+
+        from .compactacao_pdf import escrever_pdf, escrever_pdf_medindo
+
+        folha = _folha_com_imagens(4)
+        simples = len(escrever_pdf([PdfReader(io.BytesIO(folha)).pages[0]], compactar=False))
+        conteudo, economia = escrever_pdf_medindo([PdfReader(io.BytesIO(folha)).pages[0]])
+
+        self.assertLess(len(conteudo), simples)
+        # Três das quatro imagens ficam de fora: a estimativa tem que chegar perto da cópia simples
+        self.assertAlmostEqual(len(conteudo) + economia, simples, delta=simples * 0.1)
+        self.assertEqual(escrever_pdf_medindo([PdfReader(io.BytesIO(folha)).pages[0]], compactar=False)[1], 0)
+
+# ==========================================
+# DOWNLOAD DAS FOLHAS ASSINADAS (ZIP)
+# ==========================================
+
+class DownloadFolhasEquipeTests(_MidiaTemporariaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.gestor = criar_funcionario('Gestor Zip')
+        self.equipe = Equipe.objects.create(nome='Equipe Zip', gestor=self.gestor)
+        self.url = reverse('rh_batch_download', args=[self.equipe.id]) + '?mes=5&ano=2026'
+        for i in range(2):
+            funcionario = criar_funcionario(f'Homonimo {i}', equipe=self.equipe)
+            FolhaPontoStatus.objects.create(
+                funcionario=funcionario, mes=5, ano=2026, arquivo=self.gravar(f'ponto_assinado/folha_{i}.pdf')
+            )
+        Funcionario.objects.filter(equipe=self.equipe).update(nome_completo='Jose Silva')
+
+    def test_gestor_baixa_as_folhas_de_homonimos(self):
+        self.client.force_login(self.gestor.usuario)
+        resposta = self.client.get(self.url)
+        self.assertEqual(resposta.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b''.join(resposta.streaming_content))) as zip_file:
+            self.assertEqual(len(zip_file.namelist()), 2)
+
+    def test_quem_nao_e_rh_nem_gestor_da_equipe_nao_baixa(self):
+        self.client.force_login(criar_funcionario('Outro Gestor').usuario)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+# ==========================================
+# CARIMBO DO CONTRACHEQUE (NOVAS TENTATIVAS)
+# ==========================================
+
+class NovaTentativaCarimboTests(TestCase):
+    def setUp(self):
+        self.contracheque = Contracheque.objects.create(
+            funcionario=criar_funcionario('Assina Depois'), mes=5, ano=2026, arquivo='contracheques/teste.pdf',
+            data_ciencia=timezone.now(), status_carimbo='Pendente',
+        )
+
+    def test_nova_tentativa_sobrevive_sem_o_timer(self):
+        # O timer nunca dispara: é o que acontece quando o processo reinicia
+        with mock.patch.object(contracheque_service, '_agendar_nova_tentativa'), \
+                mock.patch.object(contracheque_service, 'gerar_pdf_assinado', side_effect=RuntimeError('falhou')):
+            self.assertFalse(contracheque_service.carimbar_contracheque(self.contracheque.pk))
+        self.contracheque.refresh_from_db()
+        self.assertEqual(self.contracheque.status_carimbo, 'Pendente')
+        self.assertGreater(self.contracheque.proxima_tentativa_carimbo, timezone.now())
+
+        comando = 'core_rh.management.commands.carimbar_contracheques.carimbar_contracheque'
+        with mock.patch(comando, return_value=True) as carimbar:
+            call_command('carimbar_contracheques', stdout=io.StringIO())
+            carimbar.assert_not_called()
+
+            Contracheque.objects.filter(pk=self.contracheque.pk).update(
+                proxima_tentativa_carimbo=timezone.now() - timedelta(seconds=1)
+            )
+            call_command('carimbar_contracheques', stdout=io.StringIO())
+        carimbar.assert_called_once_with(self.contracheque.pk)
+
+
+class CarimboArquivoTrocadoTests(_MidiaTemporariaMixin, TestCase):
+    def test_reenvio_durante_o_carimbo_nao_e_sobrescrito(self):
+        contracheque = Contracheque.objects.create(
+            funcionario=criar_funcionario('Reenviado'), mes=5, ano=2026,
+            arquivo=self.gravar('contracheques/2026/5/antigo.pdf'), data_ciencia=timezone.now(), status_carimbo='Pendente',
+        )
+        novo = self.gravar('contracheques/2026/5/novo.pdf')
+
+        def reenviar_no_meio(cc):
+            Contracheque.objects.filter(pk=cc.pk).update(arquivo=novo)
+            return b'%PDF-1.4 assinado', None
+
+        with mock.patch.object(contracheque_service, 'gerar_pdf_assinado', side_effect=reenviar_no_meio), \
+                mock.patch.object(contracheque_service, 'enfileirar_carimbo') as enfileirar:
+            self.assertFalse(contracheque_service.carimbar_contracheque(contracheque.pk))
+
+        contracheque.refresh_from_db()
+        self.assertEqual(contracheque.arquivo.name, novo)
+        self.assertEqual(contracheque.status_carimbo, 'Pendente')
+        enfileirar.assert_called_once_with(contracheque.pk)
+        _, nomes = default_storage.listdir('contracheques/2026/5')
+        self.assertFalse([nome for nome in nomes if '_assinado' in nome])
+
+
+# ==========================================
+# ÍNDICE DE DOCUMENTOS (indice_documentos)
+# ==========================================
+
+class IndiceDocumentosTests(TestCase):
+    def criar_contracheque(self, funcionario, mes=5, ano=2026):
+        return Contracheque.objects.create(funcionario=funcionario, mes=mes, ano=ano, arquivo='contracheques/teste.pdf')
+
+    def test_termos_normaliza_competencia_cpf_e_acentos(self):
+        self.assertEqual(
+            indice_documentos._termos('05/2026 5-2026 123.456.789-09 José  CONCEIÇÃO'),
+            ['C052026', 'C052026', '12345678909', 'JOSE', 'CONCEICAO'],
+        )
+        # 13º vai para dezembro; mês inválido vira só dígitos
+        self.assertEqual(indice_documentos._termos('13/2025 14/2025'), ['C122025', '142025'])
+
+    def test_cursor_percorre_empates_de_competencia_sem_repetir(self):
+        ids = {
+            self.criar_contracheque(criar_funcionario(f'Funcionario {i}')).pk
+            for i in range(5)
+        }
+        vistos, cursor = [], None
+        while True:
+            pagina, cursor = indice_documentos.buscar(tipo='contracheque', cursor=cursor, limite=2)
+            vistos.extend(documento.objeto_id for documento in pagina)
+            if cursor is None:
+                break
+        self.assertEqual(len(vistos), 5)
+        self.assertEqual(set(vistos), ids)
+
+    def test_reindexa_documentos_quando_o_nome_muda(self):
+        funcionario = criar_funcionario('Maria Souza')
+        contracheque = self.criar_contracheque(funcionario)
+        self.assertEqual(indice_documentos.buscar('maria 05/2026')[0][0].objeto_id, contracheque.pk)
+
+        funcionario.nome_completo = 'Maria Ângela Lima'
+        funcionario.save()
+
+        self.assertEqual(indice_documentos.buscar('souza')[0], [])
+        self.assertEqual(indice_documentos.buscar('angela lima')[0][0].objeto_id, contracheque.pk)
+
+
+# ==========================================
+# PDF DA FOLHA DE PONTO (CACHE)
+# ==========================================
+
+class StatusPdfPontoTests(TestCase):
+    chave = '1_2026_05_' + 'a' * 40
+
+    def setUp(self):
+        cache.clear()
+
+    def test_marca_de_outro_worker_conta_como_processando(self):
+        self.assertIsNone(pdf_ponto.status_pdf(self.chave))
+        # Outro processo começou a renderizar a mesma chave
+        cache.add(pdf_ponto._chave_status(self.chave), pdf_ponto.STATUS_PROCESSANDO, pdf_ponto.STATUS_PDF_TTL)
+
+        self.assertEqual(pdf_ponto.status_pdf(self.chave), pdf_ponto.STATUS_PROCESSANDO)
+        self.assertEqual(pdf_ponto.solicitar_pdf(self.chave, '<html></html>'), (pdf_ponto.STATUS_PROCESSANDO, None))
+
+
+class InvalidarPdfPontoTests(_MidiaTemporariaMixin, SimpleTestCase):
+    def test_apaga_so_a_competencia_do_funcionario(self):
+        chaves = ['1_2026_05_' + 'a' * 40, '1_2026_05_' + 'b' * 40, '1_2026_06_' + 'a' * 40, '2_2026_05_' + 'a' * 40]
+        for chave in chaves:
+            default_storage.save(pdf_ponto.caminho_pdf(chave), ContentFile(b'%PDF-1.4'))
+
+        pdf_ponto.invalidar_cache_ponto(1, 5, 2026)
+
+        self.assertEqual([pdf_ponto.pdf_em_cache(chave) for chave in chaves], [False, False, True, True])
+
+
+
+class DownloadPdfPontoTests(_MidiaTemporariaMixin, TestCase):
+    def test_range_devolve_so_a_faixa(self):
+        funcionario = criar_funcionario('Baixa Folha')
+        chave = f'{funcionario.id}_2026_05_' + 'c' * 40
+        conteudo = b'%PDF-1.4 ' + bytes(range(256)) * 4
+        default_storage.save(pdf_ponto.caminho_pdf(chave), ContentFile(conteudo))
+        self.client.force_login(funcionario.usuario)
+        url = reverse('baixar_pdf_ponto', args=[chave])
+
+        inteiro = self.client.get(url)
+        self.assertEqual(b''.join(inteiro.streaming_content), conteudo)
+        self.assertEqual(inteiro['Accept-Ranges'], 'bytes')
+
+        parcial = self.client.get(url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(parcial.status_code, 206)
+        self.assertEqual(parcial.content, conteudo[100:200])
+        self.assertEqual(parcial['Content-Range'], f'bytes 100-199/{len(conteudo)}')
+
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(conteudo)}-').status_code, 416)
+
+# ==========================================
+# LANÇAMENTO SEMANAL DE KM (semana_km)
+# ==========================================
+
+class LancamentoSemanalKMTests(TestCase):
+    def setUp(self):
+        self.equipe = Equipe.objects.create(nome='Campo Teste', oculta=True)
+        self.funcionario = criar_funcionario('Tecnico Km', equipe=self.equipe, valor_km=Decimal('1.00'))
+        self.inicio = date(2026, 5, 4)
+
+    def lancamento(self):
+        return LancamentoSemanalKM.objects.get(funcionario=self.funcionario, inicio=self.inicio)
+
+    def test_semana_paga_guarda_valor_km_da_epoca(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ControleKM.objects.create(
+                funcionario=self.funcionario, data=self.inicio, total_km=Decimal('100'), numero_chamado='1', status='Pago'
+            )
+        self.assertEqual(self.lancamento().valor_a_pagar, Decimal('100'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.funcionario.valor_km = Decimal('2.00')
+            self.funcionario.save()
+            DespesaDiversa.objects.create(
+                funcionario=self.funcionario, data=self.inicio, numero_chamado='2', tipo='Pedagio',
+                valor=Decimal('10'), status='Pago', comprovante=''
+            )
+        self.assertEqual(self.lancamento().valor_km, Decimal('1.00'))
+        self.assertEqual(self.lancamento().valor_a_pagar, Decimal('110'))
+
+        call_command('atualizar_lancamentos_km', stdout=io.StringIO())
+        self.assertEqual(self.lancamento().valor_km, Decimal('1.00'))
+        self.assertEqual(self.lancamento().valor_a_pagar, Decimal('110'))
+
+    def test_semana_aberta_usa_valor_km_novo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ControleKM.objects.create(
+                funcionario=self.funcionario, data=self.inicio, total_km=Decimal('10'), numero_chamado='1'
+            )
+            self.funcionario.valor_km = Decimal('2.00')
+            self.funcionario.save()
+        self.assertEqual(self.lancamento().valor_a_pagar, Decimal('20'))
+
+
+
+# ==========================================
+# DOWNLOAD EM LOTE DE KM (lote_km)
+# ==========================================
+
+class GerarPlanilhasLoteTests(SimpleTestCase):
+    def lote(self, quantidade):
+        return [
+            SimpleNamespace(funcionario=SimpleNamespace(nome_completo=f'Tecnico {i}'), kms=[], despesas=[])
+            for i in range(quantidade)
+        ]
+
+    def test_serial_pula_so_o_tecnico_com_erro(self):
+        def gerar(dados):
+            if dados == 'Tecnico 1':
+                raise ValueError('planilha quebrada')
+            return dados.encode()
+
+        with self.settings(RH_KM_LOTE_PROCESSOS=1), \
+                mock.patch.object(lote_km, 'dados_planilha_km', lambda f, *args: f.nome_completo), \
+                mock.patch.object(lote_km, 'gerar_planilha_km', gerar), \
+                mock.patch('builtins.print'):
+            gerados = [planilha for _, planilha in lote_km._gerar_planilhas(self.lote(3), None, None)]
+        self.assertEqual(gerados, [b'Tecnico 0', b'Tecnico 2'])
+
+    def test_pool_monta_os_dados_numa_janela(self):
+        montados = []
+
+        def dados(funcionario, *args):
+            montados.append(funcionario.nome_completo)
+            return funcionario.nome_completo
+
+        processos = 2
+        entregues = 0
+        with self.settings(RH_KM_LOTE_PROCESSOS=processos), \
+                mock.patch.object(lote_km, 'ProcessPoolExecutor', lambda max_workers, mp_context: ThreadPoolExecutor(max_workers)), \
+                mock.patch.object(lote_km, 'dados_planilha_km', dados), \
+                mock.patch.object(lote_km, 'gerar_planilha_km', str.encode):
+            for _ in lote_km._gerar_planilhas(self.lote(20), None, None):
+                entregues += 1
+                # Nunca mais que a janela (2 por processo) montada e ainda não entregue
+                self.assertLessEqual(len(montados) - entregues, 2 * processos)
+        self.assertEqual(entregues, 20)
+
+# ==========================================
+# RESUMO DE CONTRACHEQUES (ROLLUP)
+# ==========================================
+
+class ResumoContrachequeTests(TestCase):
+    def test_recalculo_repetido_nao_duplica_linhas(self):
+        equipe = Equipe.objects.create(nome='Campo Resumo', oculta=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            for funcionario in (criar_funcionario('Com Equipe', equipe=equipe), criar_funcionario('Sem Equipe')):
+                Contracheque.objects.create(funcionario=funcionario, mes=3, ano=2026, arquivo='contracheques/teste.pdf')
+
+        atualizar_resumo_competencia(3, 2026)
+        atualizar_resumo_competencia(3, 2026)
+
+        resumos = ResumoContracheque.objects.filter(mes=3, ano=2026)
+        self.assertCountEqual(resumos.values_list('equipe_id', 'enviados'), [(equipe.id, 1), (None, 1)])
+
+    def test_assinatura_e_recalculo_contam_uma_vez(self):
+        equipe = Equipe.objects.create(nome='Campo Assina', oculta=True)
+        funcionario = criar_funcionario('Assina Resumo', equipe=equipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            contracheque = Contracheque.objects.create(
+                funcionario=funcionario, mes=4, ano=2026, arquivo='contracheques/teste.pdf'
+            )
+        resumo = ResumoContracheque.objects.filter(mes=4, ano=2026, equipe=equipe)
+
+        with mock.patch.object(contracheque_service, 'enfileirar_carimbo'):
+            registrado = contracheque_service.registrar_ciencia_contracheque(
+                contracheque.pk, funcionario.usuario, '127.0.0.1', 'chave-resumo'
+            )
+        self.assertEqual(registrado, contracheque_service.CIENCIA_REGISTRADA)
+        self.assertEqual(resumo.get().assinados, 1)
+
+        # O recálculo completo chega ao mesmo número que a soma da assinatura
+        atualizar_resumo_competencia(4, 2026)
+        self.assertEqual(resumo.get().assinados, 1)
@@ -10,6 +10,8 @@ urlpatterns = [
     path('folha-ponto/', views.folha_ponto_view, name='folha_ponto'),
     path('salvar-ponto/', views.salvar_ponto_view, name='salvar_ponto'),
     path('folha-ponto/gerar-pdf/', views.gerar_pdf_ponto_view, name='gerar_pdf_ponto'),
+    path('folha-ponto/pdf/<str:chave>/status/', views.status_pdf_ponto_view, name='status_pdf_ponto'),
+    path('folha-ponto/pdf/<str:chave>/', views.baixar_pdf_ponto_view, name='baixar_pdf_ponto'),
 
     # --- ÁREA DO GESTOR ---
     path('equipe/', views.area_gestor_view, name='area_gestor'),
@@ -20,6 +22,7 @@ urlpatterns = [
     path('rh/', views.rh_summary_view, name='rh_summary'),
     path('rh/folhas-ponto/<int:equipe_id>/', views.rh_team_detail_view, name='rh_team_detail'),
     path('rh/download-lote/<int:equipe_id>/', views.rh_batch_download_view, name='rh_batch_download'),
+    path('rh/download-lote/todas/', views.rh_batch_download_todas_view, name='rh_batch_download_todas'),
     path('rh/liberar-edicao/<int:func_id>/<int:mes>/<int:ano>/', views.rh_unlock_timesheet_view, name='rh_unlock_timesheet'),
 
     # --- INTEGRAÇÃO COM DJANGO ADMIN (AJAX) ---
@@ -50,8 +53,12 @@ urlpatterns = [
     
     # --- GESTÃO DE CONTRACHEQUES (RH) ---
     path('gestao-contracheques/', views.gerenciar_contracheques, name='gerenciar_contracheques'),
+    path('gestao-contracheques/processamento/<int:pk>/', views.processamento_contracheque_view, name='processamento_contracheque'),
+    path('gestao-contracheques/processamento/<int:pk>/status/', views.status_processamento_contracheque_view, name='status_processamento_contracheque'),
     path('rh/contracheque/upload/<int:func_id>/', views.upload_individual_contracheque, name='upload_individual_contracheque'),
     path('rh/contracheque/excluir/<int:cc_id>/', views.excluir_contracheque, name='excluir_contracheque'),
+    path('rh/contracheque/painel/', views.painel_contracheques_view, name='painel_contracheques'),
+    path('rh/documentos/busca/', views.buscar_documentos_view, name='buscar_documentos'),
     
     # --- ATESTADOS ---
     path('meus-atestados/', views.meus_atestados_view, name='meus_atestados'),
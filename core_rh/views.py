@@ -1,13 +1,10 @@
 from django.db.models import Q
 from django.shortcuts import render, redirect, get_object_or_404
 import csv
-import zipfile
-import io
-import os
-import base64
 import requests 
 import re 
-from urllib.parse import unquote 
+import uuid
+from urllib.parse import unquote, urlencode
 from django.contrib.staticfiles import finders
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model, update_session_auth_hash
@@ -15,16 +12,19 @@ from django.contrib.auth.views import PasswordResetView, PasswordResetDoneView
 from django.contrib.auth.forms import PasswordResetForm, PasswordChangeForm
 from django.urls import reverse_lazy, reverse
 from django.utils import timezone 
-from django.http import HttpResponse 
-from datetime import date, time, datetime, timedelta 
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from itertools import chain
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import date, datetime, timedelta 
 from calendar import monthrange, monthcalendar 
 from django.template.loader import render_to_string 
 from django.conf import settings
 from django.contrib import messages
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.db.models import Sum
 from django.db import transaction
-from django.db.models import Sum, F, Q, Count
+from django.db.models import Sum, F, FilteredRelation, Q, Count
 from django.contrib import messages
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
@@ -32,16 +32,11 @@ from django.utils import timezone
 import openpyxl
 # PDF e Relatórios
 import pdfplumber
-from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors 
 import openpyxl
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from openpyxl.styles import Font, Alignment, PatternFill
 from openpyxl.drawing.image import Image as ExcelImage
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import NamedStyle
-from collections import defaultdict
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -50,66 +45,59 @@ from django.views.decorators.http import require_POST
 from .nfe_service import emitir_nfe_saida
 from django.db.models import Max #
 # Utils Extras
-import holidays 
 try:
     from weasyprint import HTML, CSS
 except ImportError:
     pass
 
 try:
-    from pdf2image import convert_from_path
-    HAS_PDF_CONVERTER = True
-except ImportError:
-    HAS_PDF_CONVERTER = False
-
-try:
-    from pypdf import PdfReader, PdfWriter
+    from pypdf import PdfReader
 except ImportError:
     PdfReader = None
-    PdfWriter = None
 
 # Models e Forms
 from .models import (
-    RegistroPonto, Funcionario, Equipe, Contracheque, Ferias, 
-    Atestado, ControleKM, TrechoKM, DespesaDiversa,
+    RegistroPonto, FolhaPontoStatus, Funcionario, Equipe, Contracheque, Ferias, 
+    Atestado, ControleKM, TrechoKM, DespesaDiversa, ProcessamentoContracheque, ResumoContracheque,
     # Novos Models de Estoque:
     Peca, MovimentacaoPeca, GrupoPeca
 )
 from .forms import AtestadoForm, CpfPasswordResetForm
+from .ponto_service import (
+    anotar_status_folha, desbloquear_folha, folha_travada, mapa_status_folhas, registrar_assinatura_funcionario,
+    registrar_assinatura_gestor, resumo_equipes_competencia, salvar_registros_competencia,
+)
+from .papeis import papeis_do_usuario
+from .middleware import marcar_primeiro_acesso_sessao
+from .zip_stream import gerar_zip_streaming, nome_sem_repetir
+from .planilhas import BORDA_FINA, FORMATO_MOEDA, Celula, Planilha
+from .lote_km import dados_planilha_km, entradas_zip_lote_km, lancamentos_semana, preparar_lote_km
+from .planilha_km import montar_planilha_km
+from .relatorio_filiais import totais_relatorio_filiais
+from .semana_km import (
+    agendar_recalculo, agendar_semana, agendar_semanas, aplicar_valor_km, lancamentos_da_equipe, lancamentos_da_semana,
+)
+from . import arquivos, indice_documentos
+from .compactacao_pdf import escrever_pdf
+from .contracheque_service import (
+    CIENCIA_REGISTRADA, CIENCIA_REPETIDA, COMPACTAR_PDF, criar_processamento, registrar_ciencia_contracheque,
+    retomar_se_interrompido, url_processamento_contracheque,
+)
+from .layout_pdf import carimbar_data_recebimento, extrair_layout
+from .calendario import feriados_periodo, get_datas_competencia, montar_dias_competencia
+from .pdf_ponto import (
+    STATUS_ERRO, STATUS_PRONTO, caminho_pdf, chave_pdf, invalidar_cache_ponto,
+    ler_chave, logo_base64, pdf_em_cache, solicitar_pdf, status_pdf, weasyprint_disponivel,
+)
 
 User = get_user_model()
 
 def usuario_eh_rh(user):
     """
-    Retorna True se o usuário for Superuser, ou estiver na equipe 'RH' 
+    Retorna True se o usuário for Superuser, estiver no grupo 'RH' ou na equipe 'RH' 
     (seja como principal ou secundária).
     """
-    if not user.is_authenticated: return False
-    if user.is_superuser: return True
-    
-    # Verifica grupos do Django Admin (legado)
-    if user.groups.filter(name='RH').exists(): return True
-
-    try:
-        func = user.funcionario
-        # Verifica Equipe Principal (Nome exato 'RH' ou 'Recursos Humanos')
-        if func.equipe and func.equipe.nome in ['RH', 'Recursos Humanos', 'Gestão de Pessoas']:
-            return True
-        
-        # Verifica Equipes Secundárias
-        if func.outras_equipes.filter(nome__in=['RH', 'Recursos Humanos', 'Gestão de Pessoas']).exists():
-            return True
-            
-    except AttributeError:
-        # Usuário sem funcionário vinculado
-        pass
-        
-    return False
-
-DIAS_SEMANA_PT = {
-    0: 'Segunda-feira', 1: 'Terça-feira', 2: 'Quarta-feira', 3: 'Quinta-feira',
-    4: 'Sexta-feira', 5: 'Sábado', 6: 'Domingo'
-}
+    return papeis_do_usuario(user)['rh']
 
 MESES_PT = {
     1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril',
@@ -132,19 +120,6 @@ def get_competencia_anterior(mes, ano):
         return 12, ano - 1
     return mes - 1, ano
 
-def get_datas_competencia(mes_referencia, ano_referencia):
-    if mes_referencia == 1:
-        mes_anterior = 12
-        ano_anterior = ano_referencia - 1
-    else:
-        mes_anterior = mes_referencia - 1
-        ano_anterior = ano_referencia
-        
-    data_inicio = date(ano_anterior, mes_anterior, 16)
-    data_fim = date(ano_referencia, mes_referencia, 15)
-    
-    return data_inicio, data_fim
-
 def calcular_horas_trabalhadas(entrada_1_str, saida_1_str, entrada_2_str, saida_2_str):
     total = timedelta()
     try:
@@ -163,16 +138,7 @@ def calcular_horas_trabalhadas(entrada_1_str, saida_1_str, entrada_2_str, saida_
     return total
 
 def usuario_eh_campo(user):
-    if not user.is_authenticated: return False
-    if user.is_superuser: return True
-    try:
-        func = user.funcionario
-        termo = "Campo"
-        if func.equipe and termo in func.equipe.nome: return True
-        if func.outras_equipes.filter(nome__icontains=termo).exists(): return True
-    except:
-        pass
-    return False
+    return papeis_do_usuario(user)['campo']
 
 @login_required 
 def home(request):
@@ -181,9 +147,6 @@ def home(request):
     is_campo = False
     equipes_gestor = []
     
-    # Variável de controle do estoque
-    can_access_estoque = False
-
     try:
         funcionario = Funcionario.objects.get(usuario=request.user)
         
@@ -205,27 +168,15 @@ def home(request):
             tem_ferias = True
             
         is_campo = usuario_eh_campo(request.user)
-        
-        # --- CORREÇÃO DA PERMISSÃO DE ESTOQUE ---
-        # Verifica se a EQUIPE do funcionário é "Estoque" (Principal ou Secundária)
-        if funcionario.equipe and funcionario.equipe.nome.strip().lower() == 'estoque':
-            can_access_estoque = True
-        elif funcionario.outras_equipes.filter(nome__iexact='Estoque').exists():
-            can_access_estoque = True
             
     except Funcionario.DoesNotExist: 
         pass 
     
     can_access_rh_area = usuario_eh_rh(request.user)
     
-    # --- PERMISSÃO FINAL DO ESTOQUE ---
-    # Libera se:
-    # 1. Já foi liberado pela Equipe acima
-    # 2. OU se for Superusuário
-    # 3. OU se estiver no Grupo de Permissões "Estoque" do Django Admin
-    if not can_access_estoque:
-        if request.user.is_superuser or request.user.groups.filter(name='Estoque').exists():
-            can_access_estoque = True
+    # --- PERMISSÃO DO ESTOQUE ---
+    # Equipe "Estoque" (principal ou secundária), superusuário ou grupo "Estoque" do admin
+    can_access_estoque = usuario_tem_acesso_estoque(request.user)
     
     return render(request, 'core_rh/index.html', {
         'is_gestor': is_gestor or request.user.is_superuser, 
@@ -257,7 +208,7 @@ def salvar_ponto_view(request):
 
     data_inicio, data_fim = get_datas_competencia(mes, ano)
 
-    if RegistroPonto.objects.filter(funcionario=funcionario, data__range=[data_inicio, data_fim], assinado_gestor=True).exists():
+    if folha_travada(funcionario, mes, ano):
         messages.error(request, "ERRO: Esta folha já foi fechada e assinada pelo gestor. Solicite o desbloqueio ao RH.")
         return redirect(redirect_url)
 
@@ -265,169 +216,92 @@ def salvar_ponto_view(request):
         arquivo = request.FILES['pdf_assinado']
         nome_limpo = funcionario.nome_completo.strip().replace(' ', '_')
         arquivo.name = f"Folha_{nome_limpo}_{mes:02d}_{ano}_Assinado_Colab.pdf"
-        registros = RegistroPonto.objects.filter(funcionario=funcionario, data__range=[data_inicio, data_fim])
-        if registros.exists():
-            registros.update(assinado_funcionario=True, assinado_gestor=False)
-            primeiro_reg = registros.first()
-            primeiro_reg.arquivo_anexo = arquivo
-            primeiro_reg.save()
+        if registrar_assinatura_funcionario(funcionario, mes, ano, arquivo):
+            invalidar_cache_ponto(funcionario.id, mes, ano)
             messages.success(request, "Documento enviado com sucesso! A assinatura do gestor foi resetada (se houver).")
         else:
              messages.error(request, "Nenhum registro de ponto encontrado para anexar o arquivo.")
         return redirect(redirect_url)
 
-    # --- CONFIGURAÇÃO DE FERIADOS (Igual ao folha_ponto_view) ---
-    feriados_br = holidays.BR(state='DF', years=ano) 
-    if hasattr(funcionario, 'estado_sigla') and funcionario.estado_sigla:
-        try: 
-            feriados_br = holidays.BR(state=funcionario.estado_sigla, years=ano)
-        except: 
-            pass
-    # -----------------------------------------------------------
-
-    delta_dias = (data_fim - data_inicio).days
-
-    for i in range(delta_dias + 1):
-        data_ponto = data_inicio + timedelta(days=i)
-        dia_num = data_ponto.day
-        
-        entrada_1_str = request.POST.get(f'entrada_1_{dia_num}', '').strip()
-        saida_1_str = request.POST.get(f'saida_1_{dia_num}', '').strip()
-        entrada_2_str = request.POST.get(f'entrada_2_{dia_num}', '').strip()
-        saida_2_str = request.POST.get(f'saida_2_{dia_num}', '').strip()
-        entrada_extra_str = request.POST.get(f'entrada_extra_{dia_num}', '').strip()
-        saida_extra_str = request.POST.get(f'saida_extra_{dia_num}', '').strip()
-        observacoes = request.POST.get(f'observacoes_{dia_num}', '').strip()
-        
-        # --- LÓGICA CORRIGIDA: PRIORIDADE DO USUÁRIO ---
-        eh_feriado = data_ponto in feriados_br
-        
-        # Se o campo estiver VAZIO e for FERIADO, preenche automático.
-        # Se o usuário escreveu algo (ex: "Hora Extra"), MANTÉM o que ele escreveu.
-        if not observacoes and eh_feriado:
-            observacoes = "Feriado"
-        # -----------------------------------------------
-        
-        try:
-            registro = RegistroPonto.objects.get(funcionario=funcionario, data=data_ponto)
-            registro_existe = True
-        except RegistroPonto.DoesNotExist:
-            registro_existe = False
-            
-        if not any([entrada_1_str, saida_1_str, entrada_2_str, saida_2_str, entrada_extra_str, saida_extra_str, observacoes]):
-            if registro_existe:
-                registro.delete()
-            continue
-            
-        try:
-            entrada_1 = time.fromisoformat(entrada_1_str) if entrada_1_str else None
-            saida_1 = time.fromisoformat(saida_1_str) if saida_1_str else None
-            entrada_2 = time.fromisoformat(entrada_2_str) if entrada_2_str else None
-            saida_2 = time.fromisoformat(saida_2_str) if saida_2_str else None
-            entrada_extra = time.fromisoformat(entrada_extra_str) if entrada_extra_str else None
-            saida_extra = time.fromisoformat(saida_extra_str) if saida_extra_str else None
-        except ValueError:
-            continue 
+    feriados_br = feriados_periodo(funcionario, data_inicio, data_fim)
 
-        RegistroPonto.objects.update_or_create(
-            funcionario=funcionario, 
-            data=data_ponto,
-            defaults={
-                'entrada_manha': entrada_1,      
-                'saida_almoco': saida_1,        
-                'volta_almoco': entrada_2,        
-                'saida_tarde': saida_2,          
-                'extra_entrada': entrada_extra,
-                'extra_saida': saida_extra,      
-                'observacao': observacoes,        
-            }
-        )
+    resultado = salvar_registros_competencia(funcionario, data_inicio, data_fim, request.POST, feriados_br)
+    total_alterado = resultado['criados'] + resultado['atualizados'] + resultado['removidos']
+    if total_alterado:
+        invalidar_cache_ponto(funcionario.id, mes, ano)
 
-    if not request.FILES.get('pdf_assinado'):
-        messages.success(request, "Dados de ponto salvos com sucesso!")          
+    messages.success(request, f"Dados de ponto salvos com sucesso! ({total_alterado} dia(s) alterado(s))")
     
     return redirect(redirect_url)
 
-@login_required
-def gerar_pdf_ponto_view(request):
-    mes_atual, ano_atual = get_competencia_atual()
-    try:
-        mes = int(request.GET.get('mes', mes_atual))
-        ano = int(request.GET.get('ano', ano_atual))
-        target_func_id = request.GET.get('funcionario_id')
-    except ValueError: return HttpResponse("Parâmetros inválidos.", status=400)
-
+def _funcionario_da_folha(request, target_func_id):
+    """
+    Resolve de quem é a folha pedida e se o usuário pode vê-la.
+    Retorna (funcionario, None) ou (None, HttpResponse de erro).
+    """
     if target_func_id:
         try:
             alvo = Funcionario.objects.get(id=target_func_id)
-            if usuario_eh_rh(request.user) or request.user.is_superuser: 
-                funcionario = alvo
-            else:
-                try:
-                    gestor = Funcionario.objects.get(usuario=request.user)
-                    is_gestor_autorizado = Equipe.objects.filter(
-                        Q(gestor=gestor) | Q(gestores=gestor)
-                    ).filter(Q(id=alvo.equipe.id) | Q(id__in=alvo.outras_equipes.values_list('id', flat=True))).exists()
-
-                    if is_gestor_autorizado:
-                        funcionario = alvo
-                    else: return HttpResponse("Acesso negado.", status=403)
-                except Funcionario.DoesNotExist: return HttpResponse("Perfil não encontrado.", status=403)
-        except Funcionario.DoesNotExist: return HttpResponse("Funcionário não encontrado.", status=404)
+            if alvo.usuario_id == request.user.id or usuario_eh_rh(request.user) or request.user.is_superuser: 
+                return alvo, None
+            try:
+                gestor = Funcionario.objects.get(usuario=request.user)
+                is_gestor_autorizado = Equipe.objects.filter(
+                    Q(gestor=gestor) | Q(gestores=gestor)
+                ).filter(Q(id=alvo.equipe_id) | Q(id__in=alvo.outras_equipes.values_list('id', flat=True))).exists()
+
+                if is_gestor_autorizado:
+                    return alvo, None
+                return None, HttpResponse("Acesso negado.", status=403)
+            except Funcionario.DoesNotExist: return None, HttpResponse("Perfil não encontrado.", status=403)
+        except Funcionario.DoesNotExist: return None, HttpResponse("Funcionário não encontrado.", status=404)
+
+    try: return Funcionario.objects.get(usuario=request.user), None
+    except Funcionario.DoesNotExist: return None, HttpResponse("Perfil não encontrado.", status=404)
+
+
+def _nome_arquivo_folha(funcionario, mes, ano):
+    nome_func = funcionario.nome_completo.strip().replace(' ', '_')
+    return f"Folha_{nome_func}_{mes:02d}_{ano}.pdf"
+
+
+def _resposta_pdf_cache(request, chave, nome_arquivo):
+    """PDF do cache em streaming; com cabeçalho Range devolve só a faixa (retomar download no celular)."""
+    caminho = caminho_pdf(chave)
+    total = arquivos.tamanho(caminho)
+    try:
+        faixa = arquivos.faixa_solicitada(request.headers.get('Range'), total)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{total}"
+        return response
+
+    if faixa:
+        inicio, fim = faixa
+        response = HttpResponse(arquivos.ler_intervalo(caminho, inicio, fim), status=206, content_type='application/pdf')
+        response['Content-Range'] = f"bytes {inicio}-{fim - 1}/{total}"
     else:
-        try: funcionario = Funcionario.objects.get(usuario=request.user)
-        except Funcionario.DoesNotExist: return HttpResponse("Perfil não encontrado.", status=404)
+        response = StreamingHttpResponse(arquivos.ler_blocos(caminho), content_type='application/pdf')
+        response['Content-Length'] = total
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    return response
 
-    feriados_br = holidays.BR(state='DF', years=ano) 
-    if hasattr(funcionario, 'estado_sigla') and funcionario.estado_sigla:
-        try: feriados_br = holidays.BR(state=funcionario.estado_sigla, years=ano)
-        except: pass
-            
+
+def _montar_html_folha(funcionario, mes, ano):
+    """HTML da folha de ponto da competência; é a entrada do PDF e da chave do cache."""
     data_inicio, data_fim = get_datas_competencia(mes, ano)
-    registros_dict = {r.data.day: r for r in RegistroPonto.objects.filter(funcionario=funcionario, data__range=[data_inicio, data_fim]).order_by('data')}
+    registros_dict = {r.data: r for r in RegistroPonto.objects.filter(funcionario=funcionario, data__range=[data_inicio, data_fim]).order_by('data')}
     
-    atestados_periodo = Atestado.objects.filter(
-        funcionario=funcionario,
-        status='Aprovado',
-        data_inicio__lte=data_fim
-    )
-
-    ferias_periodo = Ferias.objects.filter(
-        funcionario=funcionario,
-        data_inicio__lte=data_fim,
-        data_fim__gte=data_inicio
-    )
-
     dias_do_mes = []
     total_horas_delta = timedelta()
     total_extras_delta = timedelta()
     
-    delta_dias = (data_fim - data_inicio).days
-    for i in range(delta_dias + 1):
-        data_atual = data_inicio + timedelta(days=i)
-        registro = registros_dict.get(data_atual.day)
-        
-        # 1. Verifica Feriado
-        eh_feriado = data_atual in feriados_br
-        nome_feriado = feriados_br.get(data_atual).upper() if eh_feriado else ""
-
-        # 2. Verifica Férias
-        eh_ferias = False
-        for f in ferias_periodo:
-            if f.data_inicio <= data_atual <= f.data_fim:
-                eh_ferias = True
-                break
-
-        # 3. Verifica Atestado
-        tipo_atestado = None
-        for atestado in atestados_periodo:
-            if atestado.tipo == 'DIAS':
-                fim = atestado.data_inicio + timedelta(days=(atestado.qtd_dias or 1) - 1)
-                if atestado.data_inicio <= data_atual <= fim:
-                    tipo_atestado = 'DIAS'
-                    break
-            elif atestado.tipo == 'HORAS' and atestado.data_inicio == data_atual:
-                tipo_atestado = 'HORAS'
+    for dia in montar_dias_competencia(funcionario, data_inicio, data_fim, registros_dict):
+        data_atual = dia['data']
+        registro = dia['registro']
+        eh_feriado = dia['eh_feriado']
+        nome_feriado = dia['nome_feriado']
 
         # Cria Mock se não existir registro
         if not registro:
@@ -448,14 +322,7 @@ def gerar_pdf_ponto_view(request):
         # --- LÓGICA DE PRIORIDADE CORRIGIDA ---
         # Se NÃO tem observação manual, aplica a automática
         if not registro.observacao:
-            if eh_ferias:
-                registro.observacao = "Férias"
-            elif eh_feriado:
-                registro.observacao = "FERIADO"
-            elif tipo_atestado == 'DIAS':
-                registro.observacao = "Atestado Médico"
-            elif tipo_atestado == 'HORAS':
-                registro.observacao = "Atestado de Comparecimento"
+            registro.observacao = dia['obs_automatica']
         
         # --- O TRUQUE: FORÇA O TEXTO MANUAL EM FERIADOS ---
         # Se for feriado MAS tiver texto diferente de "FERIADO", enganamos o template 
@@ -491,26 +358,12 @@ def gerar_pdf_ponto_view(request):
 
         dias_do_mes.append({
             'data': data_atual,
-            'dia_semana_nome': DIAS_SEMANA_PT[data_atual.weekday()],
+            'dia_semana_nome': dia['dia_semana_nome'],
             'eh_feriado': eh_feriado, # Aqui vai o valor "hackeado" se necessário
             'nome_feriado': nome_feriado,
             'registro': registro
         })
 
-    logo_data = None
-    possiveis_caminhos = [
-        os.path.join(settings.BASE_DIR, 'core', 'static', 'images', 'Logo.png'),
-        os.path.join(settings.BASE_DIR, 'staticfiles', 'images', 'Logo.png'),
-        os.path.join(settings.BASE_DIR, 'static', 'images', 'Logo.png')
-    ]
-    for path in possiveis_caminhos:
-        if os.path.exists(path):
-            try:
-                with open(path, "rb") as image_file:
-                    logo_data = base64.b64encode(image_file.read()).decode('utf-8')
-                break
-            except Exception: pass
-
     context = {
         'funcionario': funcionario,
         'empresa': 'Dividata Processamento de Dados Ltda', 
@@ -521,22 +374,90 @@ def gerar_pdf_ponto_view(request):
         'nome_mes': f"{MESES_PT[data_inicio.month]}/{MESES_PT[mes]} {ano}",
         'total_horas': format_delta(total_horas_delta),
         'total_horas_extras': format_delta(total_extras_delta),
-        'user_mock': request.user,
-        'logo_b64': logo_data,
+        # O cabeçalho usa o usuário do próprio funcionário: o PDF não depende de quem pediu
+        'user_mock': funcionario.usuario,
+        'logo_b64': logo_base64(),
     }
 
-    html_string = render_to_string('core_rh/pdf_folha_ponto.html', context)
-    response = HttpResponse(content_type='application/pdf')
-    nome_func = funcionario.nome_completo.strip().replace(' ', '_')
-    response['Content-Disposition'] = f'attachment; filename="Folha_{nome_func}_{mes:02d}_{ano}.pdf"'
+    return render_to_string('core_rh/pdf_folha_ponto.html', context)
 
+
+@login_required
+def gerar_pdf_ponto_view(request):
+    mes_atual, ano_atual = get_competencia_atual()
     try:
-        from weasyprint import HTML
-        HTML(string=html_string, base_url=str(settings.BASE_DIR)).write_pdf(response)
-    except ImportError:
+        mes = int(request.GET.get('mes', mes_atual))
+        ano = int(request.GET.get('ano', ano_atual))
+        target_func_id = request.GET.get('funcionario_id')
+    except ValueError: return HttpResponse("Parâmetros inválidos.", status=400)
+
+    funcionario, erro = _funcionario_da_folha(request, target_func_id)
+    if erro: return erro
+
+    html_string = _montar_html_folha(funcionario, mes, ano)
+    nome_arquivo = _nome_arquivo_folha(funcionario, mes, ano)
+
+    if not weasyprint_disponivel():
+        response = HttpResponse(content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
         response.write(html_string)
-    
-    return response
+        return response
+
+    # --- CACHE: mesmo HTML => mesmo PDF ---
+    chave = chave_pdf(funcionario.id, mes, ano, html_string)
+    status, futuro = solicitar_pdf(chave, html_string)
+
+    if futuro is not None:
+        # Folhas pequenas costumam ficar prontas aqui; as demais seguem no pool
+        try:
+            futuro.result(timeout=getattr(settings, 'PDF_PONTO_ESPERA_SEGUNDOS', 5))
+            status = STATUS_PRONTO
+        except FuturesTimeoutError:
+            pass
+        except Exception:
+            return HttpResponse("Erro ao gerar o PDF da folha de ponto.", status=500)
+
+    if status == STATUS_PRONTO:
+        return _resposta_pdf_cache(request, chave, nome_arquivo)
+
+    return render(request, 'core_rh/pdf_aguarde.html', {
+        'funcionario': funcionario,
+        'mes_ano': f"{mes:02d}/{ano}",
+        'url_status': reverse('status_pdf_ponto', args=[chave]),
+        'url_download': reverse('baixar_pdf_ponto', args=[chave]),
+    })
+
+
+@login_required
+def status_pdf_ponto_view(request, chave):
+    dados = ler_chave(chave)
+    if not dados:
+        return JsonResponse({'status': STATUS_ERRO}, status=400)
+    _, erro = _funcionario_da_folha(request, dados[0])
+    if erro: return erro
+
+    status = status_pdf(chave)
+    return JsonResponse({
+        'status': status or STATUS_ERRO,
+        'url': reverse('baixar_pdf_ponto', args=[chave]) if status == STATUS_PRONTO else None,
+    })
+
+
+@login_required
+def baixar_pdf_ponto_view(request, chave):
+    dados = ler_chave(chave)
+    if not dados:
+        return HttpResponse("Arquivo inválido.", status=400)
+    funcionario, erro = _funcionario_da_folha(request, dados[0])
+    if erro: return erro
+
+    if not pdf_em_cache(chave):
+        return HttpResponse("PDF ainda não está pronto ou expirou. Gere novamente.", status=404)
+
+    _, mes, ano = dados
+    return _resposta_pdf_cache(request, chave, _nome_arquivo_folha(funcionario, mes, ano))
+
+
 @login_required
 def folha_ponto_view(request):
     mes_atual_real, ano_atual_real = get_competencia_atual()
@@ -563,31 +484,11 @@ def folha_ponto_view(request):
         next_mes, next_ano = mes_atual_real, ano_atual_real
 
     funcionario = None
-    feriados_br = holidays.BR(state='DF', years=ano_solicitado)
-    
     data_inicio, data_fim = get_datas_competencia(mes_solicitado, ano_solicitado)
-    
-    atestados_periodo = []
-    ferias_periodo = []
 
     try:
         funcionario = Funcionario.objects.get(usuario=request.user)
-        if hasattr(funcionario, 'estado_sigla') and funcionario.estado_sigla:
-             feriados_br = holidays.BR(state=funcionario.estado_sigla, years=ano_solicitado)
-        
-        atestados_periodo = Atestado.objects.filter(
-            funcionario=funcionario,
-            status='Aprovado',
-            data_inicio__lte=data_fim
-        )
-
-        ferias_periodo = Ferias.objects.filter(
-            funcionario=funcionario,
-            data_inicio__lte=data_fim,
-            data_fim__gte=data_inicio
-        )
-
-    except (Funcionario.DoesNotExist, NameError):
+    except Funcionario.DoesNotExist:
         pass 
 
     dias_do_mes = []
@@ -599,63 +500,21 @@ def folha_ponto_view(request):
             funcionario=funcionario, 
             data__range=[data_inicio, data_fim]
         )
-        registros_dict = {r.data.day: r for r in registros_banco}
-        
-        if registros_banco.filter(assinado_gestor=True).exists():
-            is_locked = True
+        registros_dict = {r.data: r for r in registros_banco}
+        is_locked = folha_travada(funcionario, mes_solicitado, ano_solicitado)
 
-    delta_dias = (data_fim - data_inicio).days
-    for i in range(delta_dias + 1):
-        data_atual = data_inicio + timedelta(days=i)
-        
-        eh_fim_de_semana = data_atual.weekday() >= 5
-        eh_feriado = data_atual in feriados_br
-        nome_feriado = feriados_br.get(data_atual) if eh_feriado else ""
-        
-        eh_ferias = False
-        for f in ferias_periodo:
-            if f.data_inicio <= data_atual <= f.data_fim:
-                eh_ferias = True
-                break
-
-        tipo_atestado = None 
-        for atestado in atestados_periodo:
-            if atestado.tipo == 'DIAS':
-                fim_atestado = atestado.data_inicio + timedelta(days=(atestado.qtd_dias or 1) - 1)
-                if atestado.data_inicio <= data_atual <= fim_atestado:
-                    tipo_atestado = 'DIAS'
-                    break
-            elif atestado.tipo == 'HORAS':
-                if atestado.data_inicio == data_atual:
-                    tipo_atestado = 'HORAS'
-        
-        registro = registros_dict.get(data_atual.day)
+    for dia in montar_dias_competencia(funcionario, data_inicio, data_fim, registros_dict):
+        registro = dia['registro']
         
         # --- LÓGICA DE PRIORIDADE DE EXIBIÇÃO ---
-        obs_visual = ""
+        # Observação manual do colaborador prevalece sobre a automática
         if registro and registro.observacao:
-            obs_visual = registro.observacao
-        elif eh_ferias:
-            obs_visual = "Férias" 
-        elif eh_feriado:
-            obs_visual = "FERIADO"
-        elif tipo_atestado == 'DIAS':
-            obs_visual = "Atestado Médico"
-        elif tipo_atestado == 'HORAS':
-            obs_visual = "Atestado de Comparecimento"
+            dia['obs_visual'] = registro.observacao
+        else:
+            dia['obs_visual'] = dia['obs_automatica']
         # ----------------------------------------
 
-        dias_do_mes.append({
-            'data': data_atual,
-            'dia_semana_nome': DIAS_SEMANA_PT[data_atual.weekday()],
-            'eh_fim_de_semana': eh_fim_de_semana,
-            'eh_feriado': eh_feriado,
-            'nome_feriado': nome_feriado.upper() if nome_feriado else "",
-            'registro': registro,
-            'tipo_atestado': tipo_atestado,
-            'eh_ferias': eh_ferias,
-            'obs_visual': obs_visual
-        })
+        dias_do_mes.append(dia)
 
     mes_anterior_num = data_inicio.month
     nome_mes_composto = f"{MESES_PT[mes_anterior_num]}/{MESES_PT[mes_solicitado]}"
@@ -731,24 +590,18 @@ def area_gestor_view(request):
     # ==========================================
     lista_ponto = []
     if equipes_ponto.exists():
-        try:
-            data_inicio, data_fim = get_datas_competencia(mes, ano)
-        except NameError:
-            data_inicio = date(ano, mes, 1)
-            import calendar
-            last_day = calendar.monthrange(ano, mes)[1]
-            data_fim = date(ano, mes, last_day)
-
-        funcionarios_ponto = Funcionario.objects.filter(
-            Q(equipe__in=equipes_ponto) | Q(outras_equipes__in=equipes_ponto)
-        ).exclude(id=gestor.id).distinct()
-        
+        # Situação das folhas vem anotada: uma consulta para a equipe inteira
+        funcionarios_ponto = anotar_status_folha(
+            Funcionario.objects.filter(
+                Q(equipe__in=equipes_ponto) | Q(outras_equipes__in=equipes_ponto)
+            ).exclude(id=gestor.id).select_related('cargo').distinct(),
+            mes, ano
+        )
+
         for func in funcionarios_ponto:
-            pontos = RegistroPonto.objects.filter(funcionario=func, data__range=[data_inicio, data_fim])
-            assinado_func = pontos.filter(assinado_funcionario=True).exists()
-            assinado_gest = pontos.filter(assinado_gestor=True).exists()
-            ponto_com_arquivo = pontos.exclude(arquivo_anexo='').first()
-            url_arquivo = ponto_com_arquivo.arquivo_anexo.url if ponto_com_arquivo and ponto_com_arquivo.arquivo_anexo else None
+            assinado_func = func.folha_assinada_func
+            assinado_gest = func.folha_assinada_gestor
+            url_arquivo = default_storage.url(func.folha_arquivo) if func.folha_arquivo else None
             
             lista_ponto.append({
                 'funcionario': func,
@@ -815,50 +668,23 @@ def area_gestor_view(request):
         if range_semana_atual:
             funcs_campo = Funcionario.objects.filter(
                 Q(equipe=equipe_km_selecionada) | Q(outras_equipes=equipe_km_selecionada)
-            ).distinct().order_by('nome_completo')
+            ).select_related('cargo').distinct().order_by('nome_completo')
 
             ini, fim = range_semana_atual
-            
-            for f in funcs_campo:
-                kms = ControleKM.objects.filter(funcionario=f, data__range=[ini, fim])
-                despesas = DespesaDiversa.objects.filter(funcionario=f, data__range=[ini, fim])
-                
-                total_km_val = sum(k.total_km for k in kms)
-                total_despesas_val = sum(d.valor for d in despesas)
-                
-                tem_algo = kms.exists() or despesas.exists()
-                status_geral = "Vazio"
-                ids_km = []
-                
-                valor_total_financeiro = 0.0
-
-                if tem_algo:
-                    # Cálculo Financeiro
-                    fator = float(f.valor_km) if f.valor_km and f.valor_km > 0 else 1.20
-                    valor_total_financeiro = (float(total_km_val) * fator) + float(total_despesas_val)
-
-                    # Status
-                    st_km = list(kms.values_list('status', flat=True))
-                    st_dp = list(despesas.values_list('status', flat=True))
-                    todos_status = set(st_km + st_dp)
-
-                    if 'Rejeitado' in todos_status: status_geral = 'Rejeitado'
-                    elif 'Pendente' in todos_status: status_geral = 'Pendente'
-                    elif 'Aprovado_Regional' in todos_status: status_geral = 'Aprovado_Regional'
-                    elif 'Aprovado_Matriz' in todos_status: status_geral = 'Aprovado_Matriz'
-                    elif 'Aprovado_Financeiro' in todos_status: status_geral = 'Aprovado_Financeiro'
-                    elif 'Pago' in todos_status: status_geral = 'Pago'
-                    elif 'Aprovado' in todos_status: status_geral = 'Aprovado_Matriz'
-                    
-                    ids_km = list(kms.values_list('id', flat=True))
+            funcs_campo = list(funcs_campo)
+
+            # Totais e status da semana já consolidados (uma linha por técnico, ver semana_km)
+            lancamentos = lancamentos_da_semana(funcs_campo, ini)
 
+            for f in funcs_campo:
+                lancamento = lancamentos.get(f.id)
                 dados_km_semana_atual.append({
                     'funcionario': f,
-                    'total_km': total_km_val,
-                    'valor_total_financeiro': valor_total_financeiro,
-                    'status': status_geral,
-                    'ids_km': ids_km,
-                    'tem_registro': tem_algo
+                    'total_km': lancamento.total_km if lancamento else 0,
+                    'valor_total_financeiro': float(lancamento.valor_a_pagar) if lancamento else 0.0,
+                    'status': lancamento.status if lancamento else "Vazio",
+                    'ids_km': [lancamento.primeiro_km_id] if lancamento and lancamento.primeiro_km_id else [],
+                    'tem_registro': bool(lancamento)
                 })
 
     return render(request, 'core_rh/area_gestor.html', {
@@ -902,28 +728,13 @@ def assinar_ponto_gestor(request, func_id, mes, ano):
         messages.error(request, "Permissão negada.")
         return redirect('area_gestor')
     
-    data_inicio, data_fim = get_datas_competencia(int(mes), int(ano))
-    
     if request.FILES.get('arquivo_gestor'):
         arquivo = request.FILES['arquivo_gestor']
         nome_limpo = alvo.nome_completo.strip().replace(' ', '_')
         arquivo.name = f"Folha_{nome_limpo}_{mes}_{ano}_Assinada_Gestor.pdf"
         
-        registros = RegistroPonto.objects.filter(
-            funcionario=alvo,
-            data__range=[data_inicio, data_fim]
-        )
-        
-        if registros.exists():
-            
-            registros.update(assinado_gestor=True)
-            
-            registro_com_arquivo = registros.exclude(arquivo_anexo='').first()
-            target_reg = registro_com_arquivo if registro_com_arquivo else registros.first()
-            
-            target_reg.arquivo_anexo = arquivo
-            target_reg.save()
-            
+        if registrar_assinatura_gestor(alvo, int(mes), int(ano), arquivo):
+            invalidar_cache_ponto(alvo.id, mes, ano)
             messages.success(request, f"Ponto de {alvo.nome_completo} assinado e arquivo atualizado com sucesso!")
         else:
             messages.error(request, "Registros não encontrados para o período.")
@@ -989,30 +800,20 @@ def rh_summary_view(request):
     else:
         return redirect(f"{reverse('rh_summary')}?mes={mes_real}&ano={ano_real}")
 
-    data_inicio, data_fim = get_datas_competencia(mes_solicitado, ano_solicitado)
-    
     # --- CORREÇÃO: RH vê todas as equipes, MENOS AS OCULTAS ---
     todas_equipes = Equipe.objects.filter(oculta=False).order_by('nome')
     
     resumo_rh = []
+
+    # Contagens de todas as equipes em uma consulta agregada (com cache curto por competência)
+    resumo_equipes = resumo_equipes_competencia(mes_solicitado, ano_solicitado)
     
     for equipe in todas_equipes:
-        membros = Funcionario.objects.filter(
-            Q(equipe=equipe) | Q(outras_equipes=equipe)
-        ).distinct()
+        contagens = resumo_equipes.get(equipe.id, {})
         
-        total_funcionarios_ativos = membros.count()
-        
-        membros_com_ponto = RegistroPonto.objects.filter(
-            funcionario__in=membros,
-            data__range=[data_inicio, data_fim]
-        ).values('funcionario').distinct().count()
-        
-        assinados_gestor = RegistroPonto.objects.filter(
-            funcionario__in=membros,
-            data__range=[data_inicio, data_fim],
-            assinado_gestor=True
-        ).values('funcionario').distinct().count()
+        total_funcionarios_ativos = contagens.get('total_membros', 0)
+        membros_com_ponto = contagens.get('total_com_ponto', 0)
+        assinados_gestor = contagens.get('total_assinados', 0)
 
         resumo_rh.append({
             'equipe': equipe,
@@ -1064,18 +865,13 @@ def rh_team_detail_view(request, equipe_id):
     membros = Funcionario.objects.filter(equipe=equipe).order_by('nome_completo')
     lista_colaboradores = []
 
+    status_folhas = mapa_status_folhas(membros, mes_solicitado, ano_solicitado)
+
     for func in membros:
-        pontos_mes = RegistroPonto.objects.filter(
-            funcionario=func, 
-            data__range=[data_inicio, data_fim]
-        )
-        
-        registro_status = pontos_mes.first()
+        registro_status = status_folhas.get(func.id)
         status_func = registro_status.assinado_funcionario if registro_status else False
         status_gestor = registro_status.assinado_gestor if registro_status else False
-        
-        anexo_reg = pontos_mes.exclude(arquivo_anexo='').first()
-        url_arquivo = anexo_reg.arquivo_anexo.url if anexo_reg and anexo_reg.arquivo_anexo else None
+        url_arquivo = registro_status.arquivo.url if registro_status and registro_status.arquivo else None
         
         nome_limpo = func.nome_completo.strip().replace(' ', '_')
         nome_para_download = f"Folha_{nome_limpo}_{mes_solicitado:02d}_{ano_solicitado}.pdf"
@@ -1100,86 +896,138 @@ def rh_team_detail_view(request, equipe_id):
         'nav_proximo': nav_proximo,
     })
 
-def rh_batch_download_view(request, equipe_id):
-    """
-    Gera um ZIP com todos os PDFs assinados da equipe no mês selecionado.
-    Busca no intervalo correto da competência, APENAS para membros da equipe PRINCIPAL.
-    """
-    equipe = get_object_or_404(Equipe, pk=equipe_id)
+def _ler_competencia_download(request):
+    """Lê mes/ano do GET para os downloads em lote. Retorna (mes, ano) ou None (com mensagem)."""
     mes = request.GET.get('mes')
     ano = request.GET.get('ano')
 
     if not mes or not ano:
         messages.error(request, "Mês e Ano não informados para download.")
-        return redirect(request.META.get('HTTP_REFERER', '/'))
+        return None
 
     try:
         mes = int(mes)
         ano = int(ano)
-        data_inicio, data_fim = get_datas_competencia(mes, ano)
+        get_datas_competencia(mes, ano)
     except ValueError:
         messages.error(request, "Data inválida.")
-        return redirect(request.META.get('HTTP_REFERER', '/'))
+        return None
+    return mes, ano
 
-    # --- ALTERAÇÃO AQUI: Busca apenas pela equipe principal ---
-    membros = Funcionario.objects.filter(equipe=equipe) 
-    # ----------------------------------------------------------
 
-    registros = RegistroPonto.objects.filter(
-        funcionario__in=membros,
-        data__range=[data_inicio, data_fim]
-    ).exclude(arquivo_anexo='').exclude(arquivo_anexo__isnull=True).select_related('funcionario')
+def _entradas_zip_folhas(status_folhas, mes, ano, pasta_por_equipe=False):
+    """
+    (nome_no_zip, abrir) de cada folha assinada que existe no storage.
+    Mesmo arquivo só entra uma vez; homônimos ganham o id do funcionário no nome.
+    """
+    arquivos_processados = set()
+    nomes_no_zip = set()
+    for status in status_folhas:
+        nome_arquivo = status.arquivo.name
+        if nome_arquivo in arquivos_processados:
+            continue
+        arquivos_processados.add(nome_arquivo)
 
-    if not registros.exists():
-        messages.warning(request, f"Nenhum ponto assinado encontrado para a equipe {equipe.nome} na competência {mes}/{ano}.")
-        return redirect(request.META.get('HTTP_REFERER', '/'))
+        if not arquivos.existe(status.arquivo):
+            continue
 
-    zip_buffer = io.BytesIO()
-    arquivos_adicionados = 0
-    arquivos_processados = set()
+        nome_limpo = status.funcionario.nome_completo.strip().replace(' ', '_')
+        file_name = f"Folha_{nome_limpo}_{mes:02d}_{ano}.pdf"
+        if pasta_por_equipe:
+            nome_equipe = status.funcionario.equipe.nome.strip().replace(' ', '_').replace('/', '-')
+            file_name = f"{nome_equipe}/{file_name}"
 
-    with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-        for ponto in registros:
-            if ponto.arquivo_anexo.name in arquivos_processados:
-                continue
-                
-            try:
-                if ponto.arquivo_anexo and hasattr(ponto.arquivo_anexo, 'path') and os.path.exists(ponto.arquivo_anexo.path):
-                    nome_limpo = ponto.funcionario.nome_completo.strip().replace(' ', '_')
-                    file_name = f"Folha_{nome_limpo}_{mes:02d}_{ano}.pdf"
-                    
-                    zip_file.write(ponto.arquivo_anexo.path, file_name)
-                    arquivos_adicionados += 1
-                    arquivos_processados.add(ponto.arquivo_anexo.name)
-            except Exception as e:
-                print(f"Erro ao adicionar arquivo {ponto}: {e}")
-                continue
+        yield nome_sem_repetir(file_name, nomes_no_zip, status.funcionario.id), arquivos.abridor(status.arquivo)
+
+
+def _resposta_zip_folhas(request, status_folhas, nome_zip, mensagem_vazio, pasta_por_equipe=False):
+    """ZIP em streaming das folhas assinadas; volta para a página anterior se não houver arquivos."""
+    if not status_folhas.exists():
+        messages.warning(request, mensagem_vazio)
+        return redirect(request.META.get('HTTP_REFERER', '/'))
+
+    mes, ano = status_folhas[0].mes, status_folhas[0].ano
+    entradas = _entradas_zip_folhas(status_folhas.iterator(), mes, ano, pasta_por_equipe)
 
-    if arquivos_adicionados == 0:
+    # Confere se há pelo menos um arquivo físico antes de começar a enviar
+    primeira = next(entradas, None)
+    if primeira is None:
         messages.error(request, "Registros encontrados, mas os arquivos físicos não estão no servidor.")
         return redirect(request.META.get('HTTP_REFERER', '/'))
 
-    zip_buffer.seek(0)
-    response = HttpResponse(zip_buffer, content_type='application/zip')
-    nome_zip = f"Pontos_{equipe.nome.replace(' ', '_')}_{mes:02d}_{ano}.zip"
+    response = StreamingHttpResponse(
+        gerar_zip_streaming(chain([primeira], entradas)),
+        content_type='application/zip'
+    )
     response['Content-Disposition'] = f'attachment; filename="{nome_zip}"'
-    
     return response
+
+
+@login_required
+def rh_batch_download_view(request, equipe_id):
+    """
+    Gera um ZIP com todos os PDFs assinados da equipe no mês selecionado.
+    Busca no intervalo correto da competência, APENAS para membros da equipe PRINCIPAL.
+    O ZIP é enviado em streaming, arquivo a arquivo.
+    """
+    equipe = get_object_or_404(Equipe, pk=equipe_id)
+    # RH ou gestor da própria equipe (o botão também aparece na área do gestor)
+    gestor_da_equipe = Equipe.objects.filter(
+        Q(gestor__usuario=request.user) | Q(gestores__usuario=request.user), pk=equipe.pk
+    ).exists()
+    if not (usuario_eh_rh(request.user) or gestor_da_equipe):
+        return HttpResponse("Acesso negado.", status=403)
+
+    competencia = _ler_competencia_download(request)
+    if competencia is None:
+        return redirect(request.META.get('HTTP_REFERER', '/'))
+    mes, ano = competencia
+
+    # --- ALTERAÇÃO AQUI: Busca apenas pela equipe principal ---
+    status_folhas = FolhaPontoStatus.objects.filter(
+        funcionario__equipe=equipe, mes=mes, ano=ano
+    ).exclude(arquivo='').exclude(arquivo__isnull=True).select_related('funcionario').order_by('funcionario__nome_completo')
+
+    return _resposta_zip_folhas(
+        request, status_folhas,
+        nome_zip=f"Pontos_{equipe.nome.replace(' ', '_')}_{mes:02d}_{ano}.zip",
+        mensagem_vazio=f"Nenhum ponto assinado encontrado para a equipe {equipe.nome} na competência {mes}/{ano}.",
+    )
+
+
+@login_required
+def rh_batch_download_todas_view(request):
+    """ZIP único com as folhas assinadas de todas as equipes visíveis (uma pasta por equipe)."""
+    if not usuario_eh_rh(request.user):
+        return HttpResponse("Acesso negado.", status=403)
+
+    competencia = _ler_competencia_download(request)
+    if competencia is None:
+        return redirect(request.META.get('HTTP_REFERER', '/'))
+    mes, ano = competencia
+
+    status_folhas = FolhaPontoStatus.objects.filter(
+        funcionario__equipe__oculta=False, mes=mes, ano=ano
+    ).exclude(arquivo='').exclude(arquivo__isnull=True).select_related(
+        'funcionario', 'funcionario__equipe'
+    ).order_by('funcionario__equipe__nome', 'funcionario__nome_completo')
+
+    return _resposta_zip_folhas(
+        request, status_folhas,
+        nome_zip=f"Pontos_Todas_Equipes_{mes:02d}_{ano}.zip",
+        mensagem_vazio=f"Nenhum ponto assinado encontrado na competência {mes}/{ano}.",
+        pasta_por_equipe=True,
+    )
+
 @login_required
 def rh_unlock_timesheet_view(request, func_id, mes, ano):
     if not usuario_eh_rh(request.user):
         return HttpResponse("Acesso negado. Perfil RH necessário.", status=403)
         
     funcionario = get_object_or_404(Funcionario, id=func_id)
-    data_inicio, data_fim = get_datas_competencia(mes, ano)
-
-    registros = RegistroPonto.objects.filter(
-        funcionario=funcionario,
-        data__range=[data_inicio, data_fim]
-    )
 
-    if registros.exists():
-        registros.update(assinado_gestor=False)
+    if desbloquear_folha(funcionario, mes, ano):
+        invalidar_cache_ponto(funcionario.id, mes, ano)
         messages.success(request, f"Folha de {funcionario.nome_completo} desbloqueada com sucesso!")
     else:
         messages.error(request, "Nenhum registro encontrado para desbloquear.")
@@ -1202,6 +1050,7 @@ def trocar_senha_obrigatoria(request):
             update_session_auth_hash(request, user)
             funcionario.primeiro_acesso = False
             funcionario.save()
+            marcar_primeiro_acesso_sessao(request, False)
             messages.success(request, 'Senha atualizada com sucesso! Bem-vindo.')
             return redirect('home')
         else:
@@ -1245,27 +1094,8 @@ def admin_ponto_partial_view(request, func_id):
         data__range=[data_inicio, data_fim]
     ).order_by('data')
 
-    registros_dict = {r.data.day: r for r in registros}
-    dias_do_mes = []
-    
-    feriados_br = holidays.BR(state='DF', years=ano)
-    if hasattr(funcionario, 'estado_sigla') and funcionario.estado_sigla:
-         try:
-             feriados_br = holidays.BR(state=funcionario.estado_sigla, years=ano)
-         except: pass
-
-    delta_dias = (data_fim - data_inicio).days
-    for i in range(delta_dias + 1):
-        data_atual = data_inicio + timedelta(days=i)
-        eh_feriado = data_atual in feriados_br
-        
-        dias_do_mes.append({
-            'data': data_atual,
-            'dia_semana_nome': DIAS_SEMANA_PT[data_atual.weekday()],
-            'eh_feriado': eh_feriado,
-            'nome_feriado': feriados_br.get(data_atual).upper() if eh_feriado else "",
-            'registro': registros_dict.get(data_atual.day)
-        })
+    registros_dict = {r.data: r for r in registros}
+    dias_do_mes = montar_dias_competencia(funcionario, data_inicio, data_fim, registros_dict, com_afastamentos=False)
 
     context = {
         'funcionario': funcionario,
@@ -1329,8 +1159,8 @@ def admin_gestor_partial_view(request):
         'nav_anterior': nav_ant, 'nav_proximo': nav_prox, 
         'mode': mode, 'q': q, 'equipe_id': eq_id, 'estado_filtro': est,
         'todas_equipes': equipes_permitidas,
-        'is_gestao': usuario_eh_rh(user),
-        'is_financeiro': user.groups.filter(name='Financeiro').exists() or user.is_superuser
+        'is_gestao': is_rh,
+        'is_financeiro': 'Financeiro' in papeis_do_usuario(user)['grupos'] or user.is_superuser
     }
     
     if mode == 'summary':
@@ -1338,10 +1168,11 @@ def admin_gestor_partial_view(request):
         qs_resumo = equipes_permitidas
         if q: qs_resumo = qs_resumo.filter(nome__icontains=q)
         res = []
+        resumo_equipes = resumo_equipes_competencia(m, a)
         for e in qs_resumo:
-            mem = Funcionario.objects.filter(equipe=e)
-            ass = RegistroPonto.objects.filter(funcionario__in=mem, data__range=[di_mes, df_mes], assinado_gestor=True).values('funcionario').distinct().count()
-            tot = mem.count()
+            contagens = resumo_equipes.get(e.id, {})
+            ass = contagens.get('total_assinados', 0)
+            tot = contagens.get('total_membros', 0)
             res.append({'equipe': e, 'total_membros': tot, 'total_assinados': ass, 'progresso': int(ass/tot*100) if tot>0 else 0})
         ctx['resumo_rh'] = res
         
@@ -1358,19 +1189,20 @@ def admin_gestor_partial_view(request):
         lst = []
         url_base_pdf = reverse('gerar_pdf_ponto') # Certifique-se que essa URL existe
 
-        for f in fq.distinct().order_by('nome_completo'):
-            pts = RegistroPonto.objects.filter(funcionario=f, data__range=[di_mes, df_mes])
-            tem_assinatura_func = pts.filter(assinado_funcionario=True).exists()
-            tem_assinatura_gest = pts.filter(assinado_gestor=True).exists()
+        colaboradores = list(fq.distinct().order_by('nome_completo'))
+        status_folhas = mapa_status_folhas(colaboradores, m, a)
+
+        for f in colaboradores:
+            st = status_folhas.get(f.id)
+            tem_assinatura_func = bool(st and st.assinado_funcionario)
+            tem_assinatura_gest = bool(st and st.assinado_gestor)
             
             arq_url = None
             
             # --- CORREÇÃO PRINCIPAL AQUI ---
             # Só pega o arquivo se tiver ASSINADO PELO GESTOR (assinado_gestor=True)
-            ponto_assinado = pts.filter(assinado_gestor=True).exclude(arquivo_anexo='').order_by('-data').first()
-            
-            if ponto_assinado and ponto_assinado.arquivo_anexo:
-                arq_url = ponto_assinado.arquivo_anexo.url
+            if tem_assinatura_gest and st.arquivo:
+                arq_url = st.arquivo.url
             # Se não tiver assinatura do gestor, arq_url continua None, forçando o botão azul
             
             url_gerado = f"{url_base_pdf}?funcionario_id={f.id}&mes={m}&ano={a}"
@@ -1392,107 +1224,9 @@ def admin_gestor_partial_view(request):
         ctx['lista_colaboradores'] = lst
         ctx['estados_disponiveis'] = fq.exclude(local_trabalho_estado__isnull=True).values_list('local_trabalho_estado', flat=True).distinct()
     
-    # KM e Despesas (Mantido simplificado para focar no erro do ponto)
-    equipes_km = equipes_permitidas.filter(nome__icontains="Campo")
-    ctx['equipes_km'] = equipes_km
-    if equipes_km.exists():
-        # ... (Seu código de KM original fica aqui, sem alterações necessárias) ...
-        pass
-
-    return render(request, 'core_rh/includes/rh_area_moderno.html', ctx)
-
-    # =========================================================================
-    # LÓGICA 2: GESTÃO DE KM / CAMPO (ABA 2)
-    # =========================================================================
-    # Mantive a lógica de KM inalterada, pois geralmente KM envolve equipes secundárias de campo.
-    # Se quiser alterar lá também, me avise.
-    
-    equipes_km = equipes_permitidas.filter(nome__icontains="Campo")
-    ctx['equipes_km'] = equipes_km
-
-    if equipes_km.exists():
-        km_team_id = request.GET.get('km_team')
-        if km_team_id and equipes_km.filter(id=km_team_id).exists():
-            equipe_km_selecionada = equipes_km.get(id=km_team_id)
-        else:
-            equipe_km_selecionada = equipes_km.first()
-        
-        ctx['equipe_km_selecionada'] = equipe_km_selecionada
-
-        cal = monthcalendar(a, m)
-        semanas_validas = [s for s in cal if any(d != 0 for d in s)]
-        
-        try:
-            semana_param = int(request.GET.get('semana', 1))
-        except:
-            semana_param = 1
-            
-        if semana_param < 1: semana_param = 1
-        if semana_param > len(semanas_validas): semana_param = len(semanas_validas)
-
-        semanas_info = []
-        dt_inicio_sem = None
-        dt_fim_sem = None
-
-        for idx, semana_lista in enumerate(semanas_validas, start=1):
-            dia_ref = next(d for d in semana_lista if d != 0)
-            data_ref = date(a, m, dia_ref)
-            inicio = data_ref - timedelta(days=data_ref.weekday())
-            fim = inicio + timedelta(days=6)
-            
-            active = (idx == semana_param)
-            if active:
-                dt_inicio_sem = inicio
-                dt_fim_sem = fim
-            
-            semanas_info.append({
-                'numero': idx,
-                'inicio': inicio,
-                'fim': fim,
-                'active': active
-            })
-        
-        ctx['semanas_do_mes'] = semanas_info
-        ctx['semana_selecionada'] = semana_param
-
-        # Aqui mantive a lógica original para KM (Principal OU Secundária)
-        # Pois equipes de campo costumam ser secundárias.
-        funcionarios_km = Funcionario.objects.filter(Q(equipe=equipe_km_selecionada)|Q(outras_equipes=equipe_km_selecionada)).distinct().order_by('nome_completo')
-        
-        dados_km_semana = []
-        
-        for func in funcionarios_km:
-            kms = ControleKM.objects.filter(funcionario=func, data__range=[dt_inicio_sem, dt_fim_sem])
-            despesas = DespesaDiversa.objects.filter(funcionario=func, data__range=[dt_inicio_sem, dt_fim_sem])
-            
-            tem_registro = kms.exists() or despesas.exists()
-            
-            if tem_registro:
-                total_km_val = sum(k.total_km for k in kms)
-                total_despesas_val = sum(d.valor for d in despesas)
-                fator = float(func.valor_km) if func.valor_km and func.valor_km > 0 else 1.20
-                valor_total_financeiro = (float(total_km_val) * fator) + float(total_despesas_val)
-                
-                todos_status = list(kms.values_list('status', flat=True)) + list(despesas.values_list('status', flat=True))
-                
-                if 'Rejeitado' in todos_status: status_geral = 'Rejeitado'
-                elif 'Pendente' in todos_status: status_geral = 'Pendente'
-                elif 'Aprovado_Regional' in todos_status: status_geral = 'Aprovado_Regional'
-                elif 'Aprovado_Matriz' in todos_status: status_geral = 'Aprovado_Matriz'
-                elif 'Aprovado_Financeiro' in todos_status: status_geral = 'Aprovado_Financeiro'
-                elif 'Pago' in todos_status: status_geral = 'Pago'
-                else: status_geral = 'Vazio'
-
-                dados_km_semana.append({
-                    'funcionario': func,
-                    'tem_registro': True,
-                    'total_km': total_km_val,
-                    'valor_total_financeiro': valor_total_financeiro,
-                    'status': status_geral,
-                    'ids_km': list(kms.values_list('id', flat=True))
-                })
-
-        ctx['dados_km_semana_atual'] = dados_km_semana
+    # KM e Despesas: o painel só lista as equipes de campo; totais da semana
+    # ficam na área do gestor (LancamentoSemanalKM, ver semana_km)
+    ctx['equipes_km'] = equipes_permitidas.filter(nome__icontains="Campo")
 
     return render(request, 'core_rh/includes/rh_area_moderno.html', ctx)
 
@@ -1640,128 +1374,57 @@ def meus_contracheques(request):
         lista = []
         messages.error(request, "Seu usuário não está vinculado a um funcionário.")
 
-    return render(request, 'core_rh/meus_contracheques.html', {'lista': lista})
+    # Chave de idempotência do formulário de assinatura (reenvio/duplo clique não duplica)
+    return render(request, 'core_rh/meus_contracheques.html', {'lista': lista, 'chave_assinatura': uuid.uuid4().hex})
 
 @login_required
 def assinar_contracheque_local(request, pk):
     if request.method == "POST":
-        contracheque = get_object_or_404(Contracheque, pk=pk, funcionario__usuario=request.user)
-        
-        if not contracheque.data_ciencia:
-            try:
-                funcionario = contracheque.funcionario
-                nome_assinatura = funcionario.nome_completo.strip().upper()
-                
-                pdf_io = io.BytesIO(contracheque.arquivo.read())
-                
-                plumber_pdf = pdfplumber.open(pdf_io)
-                pdf_io.seek(0)
-                reader = PdfReader(pdf_io)
-                writer = PdfWriter()
-                
-                for i, page in enumerate(reader.pages):
-                    try:
-                        p_page = plumber_pdf.pages[i]
-                        altura_pagina = float(page.mediabox.height)
-                        
-                        palavras = p_page.search("ASSINATURA") or \
-                                   p_page.search("EMPREGADO")
-                        
-                        pos_x = 400
-                        pos_y_base = 50
-                        largura_final = 250
-                        
-                        if palavras:
-                            target = palavras[-1] 
-                            centro_texto = (target['x0'] + target['x1']) / 2
-                            
-                            linha_exata = None
-                            
-                            limite_busca_inferior = target['top'] - 25 
-                            limite_busca_superior = target['top'] 
-                            
-                            for linha in p_page.lines:
-                                if abs(linha['top'] - linha['bottom']) < 2:
-                                    
-                                    if limite_busca_inferior < linha['bottom'] < limite_busca_superior:
-                                        
-                                        if linha['x0'] < centro_texto < linha['x1']:
-                                            linha_exata = linha
-                                            break 
-                            
-                            if linha_exata:
-                                pos_x = linha_exata['x0']
-                                largura_final = linha_exata['x1'] - linha_exata['x0']
-                                
-                                pos_y_base = altura_pagina - linha_exata['bottom']
-                            else:
-                                largura_texto = target['x1'] - target['x0']
-                                largura_final = largura_texto * 3 
-                                if largura_final < 200: largura_final = 200 
-                                
-                                pos_x = centro_texto - (largura_final / 2)
-                                pos_y_base = altura_pagina - target['bottom']
-
-                        packet = io.BytesIO()
-                        can = canvas.Canvas(packet, pagesize=A4)
-                        
-                        rect_h = 32 
-                        rect_y = pos_y_base - 2 
-                        
-                        can.setFillColor(colors.white)
-                        can.rect(pos_x, rect_y, largura_final, rect_h, stroke=0, fill=1)
-                        
-                        font_size = 10
-                        nome_width = can.stringWidth(nome_assinatura, "Helvetica-Bold", font_size)
-                        
-                        if nome_width > largura_final:
-                            font_size = font_size * (largura_final / nome_width) * 0.95
-                        
-                        can.setFillColor(colors.black)
-                        can.setFont("Helvetica-Bold", font_size)
-                        
-                        centro_area = pos_x + (largura_final / 2)
-                        can.drawCentredString(centro_area, rect_y + 12, nome_assinatura)
-                        
-                        can.setLineWidth(0.5)
-                        y_linha = rect_y + 10
-                        can.line(pos_x, y_linha, pos_x + largura_final, y_linha)
-                        
-                        can.setFont("Helvetica", 6)
-                        can.drawCentredString(centro_area, rect_y + 2, "ASSINATURA")
-                        
-                        can.save()
-                        packet.seek(0)
-                        overlay = PdfReader(packet)
-                        page.merge_page(overlay.pages[0])
-                        
-                    except Exception as e:
-                        print(f"Erro processando página {i}: {e}")
-                    
-                    writer.add_page(page)
-                
-                plumber_pdf.close()
-                
-                pdf_output = io.BytesIO()
-                writer.write(pdf_output)
-                
-                filename = f"holerite_{funcionario.id}_{contracheque.mes}_{contracheque.ano}_assinado.pdf"
-                contracheque.arquivo.save(filename, ContentFile(pdf_output.getvalue()), save=False)
-                
-                contracheque.data_ciencia = timezone.now()
-                ip = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR')).split(',')[0]
-                contracheque.ip_ciencia = ip
-                contracheque.save()
-                
-                messages.success(request, "Assinado com sucesso!")
-                
-            except Exception as e:
-                messages.error(request, f"Erro: {str(e)}")
+        # Só registra a ciência (um UPDATE); o PDF assinado é gerado em segundo plano
+        ip = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR')).split(',')[0]
+        chave = request.POST.get('chave_assinatura') or f"{pk}-{request.user.pk}"
+        resultado = registrar_ciencia_contracheque(pk, request.user, ip, chave[:64])
+
+        if resultado in (CIENCIA_REGISTRADA, CIENCIA_REPETIDA):
+            messages.success(request, "Assinado com sucesso! O PDF assinado fica pronto em instantes.")
+        elif not Contracheque.objects.filter(pk=pk, funcionario__usuario=request.user).exists():
+            raise Http404("Contracheque não encontrado.")
         
         return redirect('meus_contracheques')
 
+# --- Painel de contracheques do admin (paginação por chave) ---
+CONTRACHEQUES_POR_PAGINA = 50
+
+# Filtros de status do painel -> condição sobre o contracheque da competência (relação "cc")
+_CC_ENVIADO = Q(cc__isnull=False) & ~Q(cc__arquivo='')
+# Assinado = tem data de ciência, com ou sem arquivo (como o painel sempre mostrou)
+_CC_ASSINADO = Q(cc__data_ciencia__isnull=False)
+FILTROS_STATUS_CONTRACHEQUE = {
+    'enviado': _CC_ENVIADO,
+    'assinado': _CC_ASSINADO,
+    'aguardando': _CC_ENVIADO & Q(cc__data_ciencia__isnull=True),
+    'nao_enviado': ~_CC_ENVIADO,
+}
+
+
+def _cursor_contracheque(funcionario):
+    # id primeiro: o nome pode ter ":"
+    return f"{funcionario.id}:{funcionario.nome_completo}"
+
+
+def _ler_cursor_contracheque(cursor):
+    func_id, _, nome = cursor.partition(':')
+    return nome, int(func_id)
+
+
 @login_required
 def admin_contracheque_partial(request):
+    """
+    Painel de contracheques da competência, de CONTRACHEQUES_POR_PAGINA em
+    CONTRACHEQUES_POR_PAGINA funcionários (chave nome + id). Sem cursor devolve
+    o painel completo; com cursor, só as linhas seguintes ("Carregar mais").
+    ?formato=json devolve a mesma página em JSON.
+    """
     hoje = timezone.now()
     try:
         mes_atual = int(request.GET.get('mes', hoje.month))
@@ -1771,6 +1434,10 @@ def admin_contracheque_partial(request):
         ano_atual = hoje.year
 
     termo_busca = request.GET.get('q', '').strip()
+    status_filtro = request.GET.get('status', '')
+    if status_filtro not in FILTROS_STATUS_CONTRACHEQUE:
+        status_filtro = ''
+    cursor = request.GET.get('cursor', '')
 
     mes_anterior = mes_atual - 1 if mes_atual > 1 else 12
     ano_anterior = ano_atual if mes_atual > 1 else ano_atual - 1
@@ -1778,33 +1445,80 @@ def admin_contracheque_partial(request):
     mes_proximo = mes_atual + 1 if mes_atual < 12 else 1
     ano_proximo = ano_atual if mes_atual < 12 else ano_atual + 1
 
-    funcionarios = Funcionario.objects.all().order_by('nome_completo')
-    
+    # Contracheque da competência (no máximo um por funcionário) num LEFT JOIN
+    funcionarios = Funcionario.objects.annotate(
+        cc=FilteredRelation('contracheques', condition=Q(contracheques__mes=mes_atual, contracheques__ano=ano_atual)),
+    )
     if termo_busca:
         funcionarios = funcionarios.filter(nome_completo__icontains=termo_busca)
 
-    lista_equipe = []
-    
-    contracheques_mes = {
-        cc.funcionario_id: cc 
-        for cc in Contracheque.objects.filter(mes=mes_atual, ano=ano_atual)
-    }
+    # Contagens por status numa única consulta (antes do filtro de status e da página)
+    contagem = funcionarios.aggregate(
+        total=Count('id'),
+        enviados=Count('id', filter=_CC_ENVIADO),
+        assinados=Count('id', filter=_CC_ASSINADO),
+        aguardando=Count('id', filter=FILTROS_STATUS_CONTRACHEQUE['aguardando']),
+    )
+    contagem['nao_enviados'] = contagem['total'] - contagem['enviados']
 
-    for func in funcionarios:
-        cc = contracheques_mes.get(func.id)
-        
-        status_envio = bool(cc and cc.arquivo)
-        status_assinatura = bool(cc and cc.data_ciencia)
-        
-        lista_equipe.append({
+    if status_filtro:
+        funcionarios = funcionarios.filter(FILTROS_STATUS_CONTRACHEQUE[status_filtro])
+    if cursor:
+        try:
+            nome, func_id = _ler_cursor_contracheque(cursor)
+        except ValueError:
+            return HttpResponse("Cursor inválido", status=400)
+        funcionarios = funcionarios.filter(Q(nome_completo__gt=nome) | Q(nome_completo=nome, id__gt=func_id))
+
+    pagina = list(
+        funcionarios.select_related('cargo')
+        .annotate(cc_id=F('cc__id'), cc_arquivo=F('cc__arquivo'), cc_data_ciencia=F('cc__data_ciencia'))
+        .order_by('nome_completo', 'id')[:CONTRACHEQUES_POR_PAGINA + 1]
+    )
+    proximo = None
+    if len(pagina) > CONTRACHEQUES_POR_PAGINA:
+        pagina = pagina[:CONTRACHEQUES_POR_PAGINA]
+        proximo = _cursor_contracheque(pagina[-1])
+
+    storage = Contracheque._meta.get_field('arquivo').storage
+    lista_equipe = [
+        {
             'funcionario': func,
-            'contracheque': cc,
-            'enviado': status_envio,
-            'assinado': status_assinatura
+            'contracheque_id': func.cc_id,
+            'arquivo_url': storage.url(func.cc_arquivo) if func.cc_arquivo else None,
+            'data_ciencia': func.cc_data_ciencia,
+            'enviado': bool(func.cc_arquivo),
+            'assinado': bool(func.cc_data_ciencia),
+        }
+        for func in pagina
+    ]
+
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({
+            'contagem': contagem,
+            'resultados': [
+                {
+                    'funcionario_id': item['funcionario'].id,
+                    'nome': item['funcionario'].nome_completo,
+                    'contracheque_id': item['contracheque_id'],
+                    'enviado': item['enviado'],
+                    'assinado': item['assinado'],
+                    'data_ciencia': item['data_ciencia'].isoformat() if item['data_ciencia'] else None,
+                    'arquivo_url': item['arquivo_url'],
+                }
+                for item in lista_equipe
+            ],
+            'proximo': proximo,
         })
 
+    parametros = {'mes': mes_atual, 'ano': ano_atual, 'q': termo_busca, 'status': status_filtro, 'cursor': proximo}
+    url_proximo = f"{reverse('admin_contracheque_partial')}?{urlencode(parametros)}" if proximo else None
+
     context = {
         'lista_equipe': lista_equipe,
+        'url_proximo': url_proximo,
+        'contagem': contagem,
+        'status_filtro': status_filtro,
         'mes_atual': mes_atual,
         'ano_atual': ano_atual,
         'nome_mes': dict(Contracheque.MESES).get(mes_atual),
@@ -1813,7 +1527,9 @@ def admin_contracheque_partial(request):
         'q': termo_busca,
         'meses_choices': Contracheque.MESES, 
     }
-    
+
+    if cursor:
+        return render(request, 'core_rh/includes/rh_contracheque_linhas.html', context)
     return render(request, 'core_rh/includes/rh_contracheque_moderno.html', context)
 
 @login_required
@@ -1844,121 +1560,185 @@ def gerenciar_contracheques(request):
         if data_str:
             data_para_pdf = datetime.strptime(data_str, '%Y-%m-%d').date()
 
-        arquivo.seek(0)
-        plumber_pdf = pdfplumber.open(arquivo)
-        arquivo.seek(0)
-        reader = PdfReader(arquivo)
-
-        funcionarios_db = Funcionario.objects.all()
-        log_sucesso = []
-        log_erro = []
-        
-        for i, page in enumerate(reader.pages):
-            texto = page.extract_text() or ""
-            texto_upper = texto.upper()
-            
-            encontrou_func = False
-            funcionario_encontrado = None
-            for func in funcionarios_db:
-                nome_busca = func.nome_completo.strip().upper()
-                if nome_busca and nome_busca in texto_upper:
-                    funcionario_encontrado = func
-                    encontrou_func = True
-                    break 
-            
-            if encontrou_func:
-                writer = PdfWriter()
-                
-                if data_para_pdf:
-                    try:
-                        p_page = plumber_pdf.pages[i]
-                        altura_pagina = float(page.mediabox.height)
-
-                        palavras_alvo = p_page.search("DATA DO RECEBIMENTO") or \
-                                        p_page.search("DATA RECEBIMENTO") or \
-                                        p_page.search("RECEBIMENTO")
-                        
-                        palavras_limite = p_page.search("Declaro ter recebido") or \
-                                          p_page.search("Declaro")
-
-                        if palavras_alvo:
-                            target = palavras_alvo[0]
-                            if palavras_limite:
-                                limite_top = palavras_limite[0]['bottom']
-                            else:
-                                limite_top = target['top'] - 40
-
-                            limite_bottom = target['bottom']
-                            rect_y = altura_pagina - limite_bottom
-                            rect_h = limite_bottom - limite_top
-                            rect_x = target['x0'] - 20 
-                            rect_w = (target['x1'] - target['x0']) + 40 
-
-                            packet = io.BytesIO()
-                            can = canvas.Canvas(packet, pagesize=A4)
-                            
-                            can.setFillColor(colors.white)
-                            can.rect(rect_x, rect_y - 2, rect_w, rect_h + 4, stroke=0, fill=1)
-                            
-                            altura_legenda = target['bottom'] - target['top']
-                            tamanho_fonte_data = altura_legenda * 1.8
-                            if tamanho_fonte_data < 12: tamanho_fonte_data = 12
-                            if tamanho_fonte_data > 18: tamanho_fonte_data = 18
-
-                            pos_data_x = target['x0']
-                            pos_data_y = rect_y + 10 
-
-                            can.setFillColor(colors.black)
-                            can.setFont("Helvetica-Bold", tamanho_fonte_data)
-                            can.drawString(pos_data_x, pos_data_y, data_para_pdf.strftime("%d/%m/%Y"))
-
-                            can.setLineWidth(0.5)
-                            can.line(rect_x, rect_y + 8, rect_x + rect_w, rect_y + 8)
-                            can.setFont("Helvetica", 6)
-                            can.drawCentredString(rect_x + (rect_w/2), rect_y, "DATA DO RECEBIMENTO")
-                            
-                            can.save()
-                            packet.seek(0)
-                            overlay = PdfReader(packet)
-                            page.merge_page(overlay.pages[0])
-                    except Exception:
-                        pass
-
-                writer.add_page(page)
-                pdf_bytes = io.BytesIO()
-                writer.write(pdf_bytes)
-                
-                cc, created = Contracheque.objects.update_or_create(
-                    funcionario=funcionario_encontrado, mes=mes_upload, ano=ano_upload,
-                    defaults={'arquivo': None}
-                )
-                
-                nome_arq = f"holerite_{funcionario_encontrado.id}_{mes_upload}_{ano_upload}.pdf"
-                cc.arquivo.save(nome_arq, ContentFile(pdf_bytes.getvalue()))
-                
-                log_sucesso.append({
-                    'pagina': i + 1,
-                    'nome': funcionario_encontrado.nome_completo,
-                    'status': 'Processado'
-                })
-            else:
-                log_erro.append({'pagina': i + 1, 'motivo': 'Nome não encontrado.'})
-        
-        plumber_pdf.close()
-
-        return render(request, 'core_rh/upload_log.html', {
-            'log_sucesso': log_sucesso,
-            'log_erro': log_erro,
-            'total_sucesso': len(log_sucesso),
-            'total_erro': len(log_erro),
-            'mes_nome': dict(Contracheque.MESES).get(mes_upload, mes_upload),
-            'ano': ano_upload,
-            'next_url': next_url, 
-        })
+        # A divisão roda em segundo plano; a página de acompanhamento mostra o progresso
+        processamento = criar_processamento(arquivo, mes_upload, ano_upload, data_para_pdf, 'painel', request.user)
+        return redirect(url_processamento_contracheque(processamento, next_url))
 
     except Exception as e:
         return render(request, 'core_rh/upload_log.html', {'erro_critico': str(e), 'next_url': next_url})
 
+
+def _resumo_tamanho(totais):
+    """Bytes gravados x bytes sem compactação no processamento, para o relatório."""
+    # sem_compactar é estimado na gravação (ver compactacao_pdf); processamentos antigos não têm
+    if not totais or not totais.get('gravado') or not totais.get('sem_compactar'):
+        return None
+    economia = totais['sem_compactar'] - totais['gravado']
+    return {
+        'gravado': totais['gravado'],
+        'sem_compactar': totais['sem_compactar'],
+        'economia': economia,
+        'percentual': round(100 * economia / totais['sem_compactar']) if totais['sem_compactar'] else 0,
+    }
+
+
+@login_required
+def processamento_contracheque_view(request, pk):
+    next_url = request.GET.get('next') or '/admin/'
+    if not (request.user.is_staff or usuario_eh_rh(request.user)):
+        return render(request, 'core_rh/upload_log.html', {'erro_critico': 'Acesso Negado.', 'next_url': next_url})
+
+    processamento = get_object_or_404(ProcessamentoContracheque, pk=pk)
+    retomar_se_interrompido(processamento)
+
+    resultado = processamento.resultado or {}
+    log_sucesso = resultado.get('sucesso', [])
+    log_erro = resultado.get('erro', [])
+    return render(request, 'core_rh/upload_log.html', {
+        'processamento': processamento,
+        'url_status': reverse('status_processamento_contracheque', args=[processamento.pk]),
+        'erro_critico': processamento.mensagem_erro if processamento.status == 'Erro' else None,
+        'log_sucesso': log_sucesso,
+        'log_erro': log_erro,
+        'avisos': resultado.get('avisos', []),
+        'comparativo': resultado.get('comparativo'),
+        'tamanho': _resumo_tamanho(resultado.get('bytes')),
+        'total_sucesso': len(log_sucesso),
+        'total_erro': len(log_erro),
+        'mes_nome': processamento.get_mes_display(),
+        'ano': processamento.ano,
+        'next_url': next_url,
+    })
+
+
+@login_required
+def status_processamento_contracheque_view(request, pk):
+    if not (request.user.is_staff or usuario_eh_rh(request.user)):
+        return JsonResponse({'erro': 'Acesso negado'}, status=403)
+
+    processamento = get_object_or_404(ProcessamentoContracheque, pk=pk)
+    retomar_se_interrompido(processamento)
+    return JsonResponse({
+        'status': processamento.status,
+        'finalizado': processamento.finalizado,
+        'total_paginas': processamento.total_paginas,
+        'paginas_processadas': processamento.paginas_processadas,
+        'percentual': processamento.percentual,
+    })
+
+
+def _com_percentual(linha):
+    linha['pendentes'] = linha['enviados'] - linha['assinados']
+    linha['percentual'] = round(100 * linha['assinados'] / linha['enviados']) if linha['enviados'] else 0
+    return linha
+
+
+@login_required
+def painel_contracheques_view(request):
+    """
+    Indicadores de ciência dos contracheques por mês e equipe. Lê só o resumo
+    (ResumoContracheque), nunca a tabela de contracheques. ?formato=csv exporta.
+    """
+    if not (request.user.is_staff or usuario_eh_rh(request.user)):
+        return render(request, 'core_rh/painel_contracheques.html', {'erro_critico': 'Acesso Negado.'})
+
+    hoje = timezone.localdate()
+    try:
+        ano_fim = int(request.GET.get('ano_fim') or hoje.year)
+        ano_inicio = int(request.GET.get('ano_inicio') or ano_fim - 1)
+    except ValueError:
+        ano_fim, ano_inicio = hoje.year, hoje.year - 1
+    if ano_inicio > ano_fim:
+        ano_inicio, ano_fim = ano_fim, ano_inicio
+    equipe_filtro = request.GET.get('equipe', '')
+
+    resumos = ResumoContracheque.objects.filter(ano__range=(ano_inicio, ano_fim))
+    if equipe_filtro == 'sem':
+        resumos = resumos.filter(equipe__isnull=True)
+    elif equipe_filtro.isdigit():
+        resumos = resumos.filter(equipe_id=int(equipe_filtro))
+
+    if request.GET.get('formato') == 'csv':
+        # BOM uma vez só (com charset utf-8-sig cada linha escrita ganharia o seu)
+        response = HttpResponse('\ufeff', content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="ciencia_contracheques_{ano_inicio}_{ano_fim}.csv"'
+        writer = csv.writer(response, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(['Mês', 'Ano', 'Equipe', 'Enviados', 'Assinados', 'Pendentes', '% Assinados', 'Atualizado em'])
+        for resumo in resumos.select_related('equipe').order_by('ano', 'mes', 'equipe__nome'):
+            writer.writerow([
+                resumo.get_mes_display(), resumo.ano, resumo.equipe.nome if resumo.equipe else 'Sem equipe',
+                resumo.enviados, resumo.assinados, resumo.pendentes,
+                round(100 * resumo.assinados / resumo.enviados) if resumo.enviados else 0,
+                timezone.localtime(resumo.atualizado_em).strftime('%d/%m/%Y %H:%M'),
+            ])
+        return response
+
+    somas = {'enviados': Sum('enviados'), 'assinados': Sum('assinados')}
+    nomes_meses = dict(Contracheque.MESES)
+    por_mes = [
+        _com_percentual(dict(linha, nome_mes=nomes_meses.get(linha['mes'], linha['mes'])))
+        for linha in resumos.values('ano', 'mes').annotate(**somas).order_by('-ano', '-mes')
+    ]
+    por_equipe = [
+        _com_percentual(linha)
+        for linha in resumos.values('equipe_id', 'equipe__nome').annotate(**somas).order_by('equipe__nome')
+    ]
+    totais = resumos.aggregate(**somas)
+    totais = _com_percentual({'enviados': totais['enviados'] or 0, 'assinados': totais['assinados'] or 0})
+
+    return render(request, 'core_rh/painel_contracheques.html', {
+        'por_mes': por_mes,
+        'por_equipe': por_equipe,
+        'totais': totais,
+        'equipes': Equipe.objects.filter(oculta=False).order_by('nome'),
+        'equipe_filtro': equipe_filtro,
+        'ano_inicio': ano_inicio,
+        'ano_fim': ano_fim,
+        'querystring_csv': urlencode({
+            'ano_inicio': ano_inicio, 'ano_fim': ano_fim, 'equipe': equipe_filtro, 'formato': 'csv',
+        }),
+        'next_url': request.GET.get('next') or '/admin/',
+    })
+
+
+@login_required
+def buscar_documentos_view(request):
+    """
+    Busca do RH em todos os anos: ?q=nome, matrícula, CPF ou MM/AAAA, com filtros
+    opcionais tipo/ano/funcionario. Paginação por cursor (campo "proximo").
+    """
+    if not (request.user.is_staff or usuario_eh_rh(request.user)):
+        return JsonResponse({'erro': 'Acesso negado'}, status=403)
+
+    try:
+        ano = int(request.GET['ano']) if request.GET.get('ano') else None
+        funcionario_id = int(request.GET['funcionario']) if request.GET.get('funcionario') else None
+        limite = int(request.GET.get('limite', indice_documentos.LIMITE_PADRAO))
+        documentos, proximo = indice_documentos.buscar(
+            request.GET.get('q', '').strip(), tipo=request.GET.get('tipo') or None, ano=ano,
+            funcionario_id=funcionario_id, cursor=request.GET.get('cursor') or None, limite=limite,
+        )
+    except ValueError:
+        return JsonResponse({'erro': 'Parâmetros inválidos'}, status=400)
+
+    urls = indice_documentos.urls_documentos(documentos)
+    return JsonResponse({
+        'resultados': [
+            {
+                'tipo': doc.tipo,
+                'tipo_display': doc.get_tipo_display(),
+                'titulo': doc.titulo,
+                'competencia': doc.competencia.strftime('%m/%Y'),
+                'funcionario_id': doc.funcionario_id,
+                'funcionario': doc.funcionario.nome_completo,
+                'matricula': doc.funcionario.matricula,
+                'url': urls.get(doc.pk),
+            }
+            for doc in documentos
+        ],
+        'proximo': proximo,
+    })
+
 @login_required
 def upload_individual_contracheque(request, func_id):
     if not (request.user.is_staff or usuario_eh_rh(request.user)):
@@ -1986,64 +1766,26 @@ def upload_individual_contracheque(request, func_id):
             plumber_pdf = pdfplumber.open(arquivo)
             arquivo.seek(0)
             reader = PdfReader(arquivo)
-            writer = PdfWriter()
+
+            # Layout lido uma vez: carimba a data agora e fica salvo para a assinatura
+            layout = extrair_layout(plumber_pdf, reader)
+            plumber_pdf.close()
 
             for i, page in enumerate(reader.pages):
                 if data_para_pdf:
                     try:
-                        p_page = plumber_pdf.pages[i]
-                        altura_pagina = float(page.mediabox.height)
-                        
-                        palavras_alvo = p_page.search("DATA DO RECEBIMENTO") or p_page.search("RECEBIMENTO")
-                        palavras_limite = p_page.search("Declaro ter recebido") or p_page.search("Declaro")
-
-                        if palavras_alvo:
-                            target = palavras_alvo[0]
-                            limite_top = palavras_limite[0]['bottom'] if palavras_limite else target['top'] - 40
-                            limite_bottom = target['bottom']
-                            
-                            rect_y = altura_pagina - limite_bottom
-                            rect_h = limite_bottom - limite_top
-                            rect_x = target['x0'] - 20 
-                            rect_w = (target['x1'] - target['x0']) + 40 
-
-                            packet = io.BytesIO()
-                            can = canvas.Canvas(packet, pagesize=A4)
-                            
-                            can.setFillColor(colors.white)
-                            can.rect(rect_x, rect_y - 2, rect_w, rect_h + 4, stroke=0, fill=1)
-                            
-                            altura_legenda = target['bottom'] - target['top']
-                            tamanho = max(12, min(18, altura_legenda * 1.8))
-                            
-                            can.setFillColor(colors.black)
-                            can.setFont("Helvetica-Bold", tamanho)
-                            can.drawString(target['x0'], rect_y + 10, data_para_pdf.strftime("%d/%m/%Y"))
-
-                            can.setLineWidth(0.5)
-                            can.line(rect_x, rect_y + 8, rect_x + rect_w, rect_y + 8)
-                            can.setFont("Helvetica", 6)
-                            can.drawCentredString(rect_x + (rect_w/2), rect_y, "DATA DO RECEBIMENTO")
-                            
-                            can.save()
-                            packet.seek(0)
-                            overlay = PdfReader(packet)
-                            page.merge_page(overlay.pages[0])
+                        carimbar_data_recebimento(page, layout[i], data_para_pdf)
                     except: pass
-                
-                writer.add_page(page)
-            
-            plumber_pdf.close()
-            pdf_bytes = io.BytesIO()
-            writer.write(pdf_bytes)
+
+            conteudo_pdf = escrever_pdf(reader.pages, COMPACTAR_PDF)
             
             cc, created = Contracheque.objects.update_or_create(
                 funcionario=funcionario, mes=mes, ano=ano,
-                defaults={'arquivo': None}
+                defaults={'arquivo': None, 'layout_pdf': layout, 'hash_conteudo': ''}
             )
             
             nome_arq = f"holerite_{funcionario.id}_{mes}_{ano}_manual.pdf"
-            cc.arquivo.save(nome_arq, ContentFile(pdf_bytes.getvalue()))
+            cc.arquivo.save(nome_arq, ContentFile(conteudo_pdf))
             
             messages.success(request, f"Contracheque de {funcionario.nome_completo} anexado!")
 
@@ -2206,221 +1948,10 @@ def excluir_despesa(request, despesa_id):
 
 # --- FUNÇÃO GERADORA DE EXCEL (ATUALIZADA PARA LINK MANUAL) ---
 def gerar_workbook_km(funcionario, dt_inicio, dt_fim):
-    """Gera o objeto Workbook com os dados de KM/Despesas do funcionário."""
-    
-    # Imports necessários dentro da função ou no topo
-    import io
-    import os
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-    from openpyxl.drawing.image import Image as ExcelImage
-    from openpyxl.utils import get_column_letter
-    from PIL import Image as PILImage # Necessário para conversão
-    
-    try:
-        from pdf2image import convert_from_path
-        HAS_PDF_CONVERTER = True
-    except ImportError:
-        HAS_PDF_CONVERTER = False
-
-    def style_range(ws, cell_range, border=None, fill=None, font=None, alignment=None):
-        selection = ws[cell_range]
-        if not isinstance(selection, tuple): selection = ((selection,),)
-        elif isinstance(selection, tuple) and not isinstance(selection[0], tuple): selection = (selection,)
-        for row in selection:
-            for cell in row:
-                if border: cell.border = border
-                if fill: cell.fill = fill
-                if font: cell.font = font
-                if alignment: cell.alignment = alignment
-
-    lista_itens = []
-    val_km = float(funcionario.valor_km) if funcionario.valor_km else 0.0
-
-    # KMs
-    kms = ControleKM.objects.filter(funcionario=funcionario, data__range=[dt_inicio, dt_fim]).order_by('data')
-    for k in kms:
-        trechos = k.trechos.all()
-        obs_texto = k.observacao if k.observacao else ""
-        
-        if trechos.exists():
-            for t in trechos:
-                link = t.origem if t.origem and 'http' in t.origem else None
-                origem_final = t.nome_origem if t.nome_origem else "Origem"
-                destino_final = t.nome_destino if t.nome_destino else "Destino"
-                
-                lista_itens.append({
-                    'data': k.data, 'chamado': k.numero_chamado, 'tipo': 'DESLOCAMENTO',
-                    'origem': origem_final, 'destino': destino_final, 'km': float(t.km),
-                    'valor': float(t.km) * val_km, 
-                    'obs': obs_texto,
-                    'link': link,
-                    'is_img': False, 'is_pdf': False, 'is_km': True, 'path': None
-                })
-        else:
-            lista_itens.append({
-                'data': k.data, 'chamado': k.numero_chamado, 'tipo': 'DESLOCAMENTO',
-                'origem': 'Registro Manual', 'destino': '-', 'km': float(k.total_km),
-                'valor': float(k.total_km) * val_km, 
-                'obs': obs_texto, 
-                'link': None,
-                'is_img': False, 'is_pdf': False, 'is_km': True, 'path': None
-            })
-
-    # Despesas
-    despesas = DespesaDiversa.objects.filter(funcionario=funcionario, data__range=[dt_inicio, dt_fim]).order_by('data')
-    for d in despesas:
-        path_disk = None; url_web = None; is_pdf = False
-        if d.comprovante:
-            try: url_web = d.comprovante.url 
-            except: pass
-            try: path_disk = d.comprovante.path
-            except:
-                try: path_disk = os.path.join(settings.MEDIA_ROOT, d.comprovante.name)
-                except: pass
-            if path_disk and path_disk.lower().endswith('.pdf'): is_pdf = True
-            
-        lista_itens.append({
-            'data': d.data, 'chamado': d.numero_chamado, 'tipo': d.tipo.upper(),
-            'origem': '-', 'destino': '-', 'km': 0.0,
-            'valor': float(d.valor or 0), 'obs': d.especificacao or '',
-            'link': url_web, 
-            'is_img': (path_disk is not None), 'is_pdf': is_pdf, 'is_km': False, 'path': path_disk
-        })
-    lista_itens.sort(key=lambda x: x['data'])
-
-    # Excel Visual
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Relatório"
-    ws.sheet_view.showGridLines = False
-
-    BLUE_DARK = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    BLUE_LIGHT = PatternFill(start_color="DCE6F1", end_color="DCE6F1", fill_type="solid")
-    WHITE_FONT = Font(name='Arial', size=14, bold=True, color="FFFFFF")
-    BOLD_FONT = Font(name='Arial', size=10, bold=True)
-    NORMAL_FONT = Font(name='Arial', size=10)
-    BORDER_ALL = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    CENTER = Alignment(horizontal='center', vertical='center', wrap_text=True)
-    LEFT = Alignment(horizontal='left', vertical='center', wrap_text=True)
-
-    ws.column_dimensions['A'].width = 18; ws.column_dimensions['B'].width = 15
-    ws.column_dimensions['C'].width = 20; ws.column_dimensions['D'].width = 30
-    ws.column_dimensions['E'].width = 30; ws.column_dimensions['F'].width = 10
-    ws.column_dimensions['G'].width = 15; ws.column_dimensions['H'].width = 25
-
-    # Cabeçalho
-    ws.merge_cells('A1:F2'); ws['A1'] = "PLANILHA DE DESPESA"
-    style_range(ws, 'A1:F2', border=BORDER_ALL, fill=BLUE_DARK, font=WHITE_FONT, alignment=CENTER)
-    ws.merge_cells('G1:G2'); ws['G1'] = "SEMANA"
-    style_range(ws, 'G1:G2', border=BORDER_ALL, fill=BLUE_LIGHT, font=BOLD_FONT, alignment=CENTER)
-    
-    ano_txt = dt_inicio.year
-    sem_txt = dt_inicio.isocalendar()[1]
-    ws.merge_cells('H1:H2'); ws['H1'] = f"{sem_txt}/{ano_txt}"
-    style_range(ws, 'H1:H2', border=BORDER_ALL, font=BOLD_FONT, alignment=CENTER)
-
-    labels = [
-        (3, 'FUNCIONÁRIO:', funcionario.nome_completo.upper()),
-        (4, 'RESIDÊNCIA:', f"{funcionario.endereco} - {funcionario.bairro}"),
-        (5, 'TRANSPORTE:', funcionario.tipo_veiculo.upper() if funcionario.tipo_veiculo else "PARTICULAR"),
-        (6, 'PERÍODO:', f"DE {dt_inicio.strftime('%d/%m/%Y')} A {dt_fim.strftime('%d/%m/%Y')}")
-    ]
-    for r, lbl, val in labels:
-        ws.cell(row=r, column=1, value=lbl); ws.cell(row=r, column=3, value=val)
-        ws.merge_cells(f'A{r}:B{r}'); ws.merge_cells(f'C{r}:F{r}')
-        style_range(ws, f'A{r}:B{r}', border=BORDER_ALL, font=BOLD_FONT, alignment=LEFT)
-        style_range(ws, f'C{r}:F{r}', border=BORDER_ALL, font=NORMAL_FONT, alignment=LEFT)
-
-    banco_data = [('BANCO', funcionario.banco), ('AGÊNCIA', funcionario.agencia), ('CONTA', funcionario.conta), ('PIX', funcionario.chave_pix)]
-    curr_row = 3
-    for k, v in banco_data:
-        ws.cell(row=curr_row, column=7, value=k); ws.cell(row=curr_row, column=8, value=v or '-')
-        style_range(ws, f'G{curr_row}', border=BORDER_ALL, fill=BLUE_LIGHT, font=BOLD_FONT, alignment=CENTER)
-        style_range(ws, f'H{curr_row}', border=BORDER_ALL, font=NORMAL_FONT, alignment=CENTER)
-        curr_row += 1
-
-    headers_table = ["Data", "Chamado", "Tipo", "Origem / Descrição", "Destino", "KM", "Valor", "Obs / Link"]
-    for i, h in enumerate(headers_table, 1):
-        ws.cell(row=7, column=i, value=h)
-        ws.merge_cells(start_row=7, start_column=i, end_row=8, end_column=i)
-        col_letter = get_column_letter(i)
-        style_range(ws, f"{col_letter}7:{col_letter}8", border=BORDER_ALL, fill=BLUE_DARK, font=Font(name='Arial', size=11, bold=True, color="FFFFFF"), alignment=CENTER)
-
-    current_row = 9; total_val = 0.0
-    wb.create_sheet("Comprovantes"); ws_gal = wb["Comprovantes"]; ws_gal.column_dimensions['A'].width = 80; row_gal = 1
-
-    for item in lista_itens:
-        obs_final = item['obs']
-        vals = [item['data'].strftime('%d/%m/%Y'), item['chamado'], item['tipo'], item['origem'] if item['is_km'] else obs_final, item['destino'], item['km'] if item['km'] > 0 else "-", item['valor']]
-        for col, val in enumerate(vals, 1):
-            cell = ws.cell(row=current_row, column=col, value=val)
-            cell.border = BORDER_ALL; cell.font = NORMAL_FONT
-            cell.alignment = LEFT if col in [4, 5] else CENTER
-            if col == 7: cell.number_format = 'R$ #,##0.00'
-
-        cell_link = ws.cell(row=current_row, column=8); cell_link.border = BORDER_ALL; cell_link.alignment = CENTER
-        if item['link']:
-            txt = "Abrir PDF" if item['is_pdf'] else ("Ver Mapa" if item['is_km'] else "Abrir Anexo")
-            if item['is_km'] and obs_final: txt = f"{obs_final} (Ver Mapa)"
-            cell_link.value = txt; cell_link.hyperlink = item['link']; cell_link.font = Font(color="0000FF", underline="single")
-        elif item['is_img']:
-            cell_link.value = "Ver Aba Comprovantes"; cell_link.font = Font(color="FF0000", italic=True)
-        else:
-            cell_link.value = obs_final if obs_final else "-"
-
-        # --- TRATAMENTO DE IMAGEM ROBUSTO (CORREÇÃO DO .MPO) ---
-        if item['path'] and os.path.exists(item['path']):
-            ws_gal.cell(row=row_gal, column=1, value=f"REF: {item['data'].strftime('%d/%m')} - R$ {item['valor']} ({item['tipo']})").font = BOLD_FONT
-            row_gal += 1
-            
-            try:
-                img_io = None
-                
-                # Caso 1: É PDF e tem conversor instalado
-                if item['is_pdf'] and HAS_PDF_CONVERTER:
-                    images = convert_from_path(item['path'], first_page=1, last_page=1)
-                    if images:
-                        img_io = io.BytesIO()
-                        images[0].convert('RGB').save(img_io, format='JPEG')
-                        img_io.seek(0)
-
-                # Caso 2: É Imagem (JPG, PNG, MPO, WEBP...)
-                elif not item['is_pdf']:
-                    with PILImage.open(item['path']) as pil_img:
-                        # Converte TUDO para RGB (remove transparência do PNG, trata MPO, etc)
-                        rgb_im = pil_img.convert('RGB')
-                        img_io = io.BytesIO()
-                        # Salva como JPEG na memória
-                        rgb_im.save(img_io, format='JPEG', quality=85)
-                        img_io.seek(0)
-
-                if img_io:
-                    # Adiciona ao Excel a partir da memória
-                    img_to_insert = ExcelImage(img_io)
-                    # Redimensiona
-                    base_height = 400
-                    ratio = img_to_insert.width / img_to_insert.height
-                    img_to_insert.height = base_height
-                    img_to_insert.width = base_height * ratio
-                    
-                    ws_gal.add_image(img_to_insert, f'A{row_gal}')
-                    row_gal += 21
-                else:
-                    ws_gal.cell(row=row_gal, column=1, value="[Visualização indisponível no Excel - Use o Link]").font = Font(italic=True)
-                    row_gal += 2
-
-            except Exception as e:
-                print(f"Erro ao processar imagem {item['path']}: {e}")
-                ws_gal.cell(row=row_gal, column=1, value=f"[Erro ao carregar imagem: {str(e)}]").font = Font(color="FF0000")
-                row_gal += 2
-
-        total_val += item['valor']; current_row += 1
-
-    ws.cell(row=current_row, column=6, value="TOTAL"); ws.cell(row=current_row, column=7, value=total_val)
-    style_range(ws, f'F{current_row}:G{current_row}', border=BORDER_ALL, fill=BLUE_LIGHT, font=BOLD_FONT, alignment=CENTER)
-    ws.cell(row=current_row, column=7).number_format = 'R$ #,##0.00'
-    return wb
+    """Gera a planilha (Planilha write-only) com os dados de KM/Despesas do funcionário."""
+    kms, despesas = lancamentos_semana([funcionario], dt_inicio, dt_fim)
+    dados = dados_planilha_km(funcionario, dt_inicio, dt_fim, kms[funcionario.id], despesas[funcionario.id])
+    return montar_planilha_km(dados)
 # BLOCO KM / DESPESAS / LOTE (Colar no lugar das funções antigas)
 # ==============================================================================
 
@@ -2447,101 +1978,14 @@ def baixar_lote_km(request, equipe_id, ano, mes, semana):
             messages.error(request, "Erro ao calcular datas.")
             return redirect('area_gestor')
 
-        # 2. Buffer do ZIP
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            
-            # ==========================================
-            # PARTE A: PDF DE RESUMO GERAL (FINANCEIRO)
-            # ==========================================
-            pdf_buffer = io.BytesIO()
-            doc = SimpleDocTemplate(pdf_buffer, pagesize=landscape(A4), rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
-            elements = []
-            styles = getSampleStyleSheet()
-
-            elements.append(Paragraph(f"Resumo de Pagamento - {equipe.nome}", styles['Title']))
-            elements.append(Paragraph(f"Semana: {dt_inicio.strftime('%d/%m')} a {dt_fim.strftime('%d/%m/%Y')}", styles['Normal']))
-            elements.append(Spacer(1, 20))
-
-            data_pdf = [['Técnico', 'Banco', 'Ag/Conta', 'PIX', 'Total a Pagar']]
-            total_geral_pdf = 0.0
-            
-            funcionarios = Funcionario.objects.filter(Q(equipe=equipe)|Q(outras_equipes=equipe)).distinct()
-
-            # ==========================================
-            # PARTE B: LOOP PARA GERAR EXCEL INDIVIDUAL
-            # ==========================================
-            for func in funcionarios:
-                kms = ControleKM.objects.filter(funcionario=func, data__range=[dt_inicio, dt_fim]).exclude(status='Rejeitado')
-                despesas = DespesaDiversa.objects.filter(funcionario=func, data__range=[dt_inicio, dt_fim]).exclude(status='Rejeitado')
-                
-                # Se não tem nada, pula
-                if not kms.exists() and not despesas.exists():
-                    continue
-
-                # --- 1. REUTILIZANDO A FUNÇÃO JÁ EXISTENTE ---
-                # Isso garante que o Excel seja idêntico ao individual
-                wb = gerar_workbook_km(func, dt_inicio, dt_fim)
-
-                # Salva o Excel na memória e escreve no ZIP
-                xls_buffer = io.BytesIO()
-                wb.save(xls_buffer)
-                
-                # Nome do arquivo limpo
-                nome_safe = func.nome_completo.strip().replace(' ', '_')
-                zip_file.writestr(f"Planilhas/{nome_safe}_Semana{semana}.xlsx", xls_buffer.getvalue())
-
-                # --- 2. SALVAR ANEXOS ORIGINAIS (PDFs/Imagens) ---
-                # A função gerar_workbook_km coloca as imagens dentro do Excel, 
-                # mas aqui também salvamos os arquivos originais numa pasta para facilitar auditoria.
-                for d in despesas:
-                    if d.comprovante:
-                        try:
-                            ext = d.comprovante.name.split('.')[-1]
-                            nome_limpo = func.nome_completo.strip().replace(' ', '_')
-                            fname = f"Comprovantes/{nome_limpo}_{d.tipo}_{d.id}.{ext}"
-                            zip_file.writestr(fname, d.comprovante.read())
-                        except: pass
-
-                # --- 3. CÁLCULO PARA O PDF DE RESUMO ---
-                total_km = sum([k.total_km for k in kms])
-                total_despesas = sum([d.valor for d in despesas])
-                fator = float(func.valor_km) if func.valor_km and func.valor_km > 0 else 1.20
-                valor_final = (float(total_km) * fator) + float(total_despesas)
-
-                if valor_final > 0:
-                    data_pdf.append([
-                        func.nome_completo,
-                        func.banco or "-",
-                        f"{func.agencia}/{func.conta}",
-                        func.chave_pix or "-",
-                        f"R$ {valor_final:,.2f}"
-                    ])
-                    total_geral_pdf += valor_final
-
-            # Finaliza o PDF de Resumo
-            data_pdf.append(['', '', '', 'TOTAL GERAL:', f"R$ {total_geral_pdf:,.2f}"])
-            
-            t = Table(data_pdf, colWidths=[200, 100, 150, 150, 100])
-            t.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            elements.append(t)
-            doc.build(elements)
-            
-            # Adiciona o PDF ao ZIP
-            nome_filial = equipe.nome.replace('Campo ', '').strip()
-            zip_file.writestr(f"RESUMO_PAGAMENTO_{nome_filial}.pdf", pdf_buffer.getvalue())
+        # 2. Lançamentos da equipe na semana (lidos de uma vez, ver lote_km)
+        lote = preparar_lote_km(equipe, dt_inicio, dt_fim)
 
-        # 3. Retorno do Arquivo ZIP
-        zip_buffer.seek(0)
-        response = HttpResponse(zip_buffer, content_type='application/zip')
+        # 3. ZIP em streaming: resumo em PDF, planilhas (montadas em paralelo) e comprovantes originais
+        response = StreamingHttpResponse(
+            gerar_zip_streaming(entradas_zip_lote_km(equipe, dt_inicio, dt_fim, semana, lote)),
+            content_type='application/zip'
+        )
         response['Content-Disposition'] = f'attachment; filename="Lote_{equipe.nome}_S{semana}.zip"'
         return response
 
@@ -2572,10 +2016,11 @@ def aprovar_semana_lote(request, equipe_id, ano, mes, semana):
         return redirect('area_gestor')
 
     equipe = get_object_or_404(Equipe, id=equipe_id)
-    funcionarios = Funcionario.objects.filter(Q(equipe=equipe)|Q(outras_equipes=equipe)).distinct()
+    # Só quem tem lançamento na semana (ver semana_km)
+    funcionarios = [lancamento.funcionario_id for lancamento in lancamentos_da_equipe(equipe, dt_inicio)]
 
-    kms_qs = ControleKM.objects.filter(funcionario__in=funcionarios, data__range=[dt_inicio, dt_fim])
-    desp_qs = DespesaDiversa.objects.filter(funcionario__in=funcionarios, data__range=[dt_inicio, dt_fim])
+    kms_qs = ControleKM.objects.filter(funcionario_id__in=funcionarios, data__range=[dt_inicio, dt_fim])
+    desp_qs = DespesaDiversa.objects.filter(funcionario_id__in=funcionarios, data__range=[dt_inicio, dt_fim])
 
     count = 0
     etapa = ""
@@ -2610,8 +2055,10 @@ def aprovar_semana_lote(request, equipe_id, ano, mes, semana):
         d = desp_qs.filter(status='Pendente').update(status='Aprovado_Regional')
         count = k + d
         etapa = "Regional"
-    
+
     if count > 0:
+        # .update() não dispara signals: recalcula as semanas da equipe
+        agendar_semanas(funcionarios, dt_inicio)
         messages.success(request, f"Lote ({etapa}) processado: {count} itens avançaram de etapa.")
     else:
         messages.info(request, f"Nenhum item aguardando a etapa ({etapa}) nesta semana.")
@@ -2735,9 +2182,7 @@ def baixar_relatorio_excel(request, func_id=None):
     else:
         dt_inicio = date(ano, mes, 1); dt_fim = date(ano, mes, monthrange(ano, mes)[1])
 
-    wb = gerar_workbook_km(funcionario, dt_inicio, dt_fim)
-    
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    planilha = gerar_workbook_km(funcionario, dt_inicio, dt_fim)
     
     # --- NOVA LÓGICA DE NOME DA FILIAL ---
     # Prioridade: Equipe Secundária que tenha "Campo" no nome
@@ -2764,9 +2209,7 @@ def baixar_relatorio_excel(request, func_id=None):
     # Ex: LucasAntonio_KM_SaoPaulo_S2.xlsx
     nome_arq = f"{nome_func}_KM_{nome_filial}_S{semana_anual}.xlsx"
     
-    response['Content-Disposition'] = f'attachment; filename="{nome_arq}"'
-    wb.save(response)
-    return response
+    return planilha.resposta(nome_arq)
 @login_required
 def avancar_status_km(request, controle_id):
     km = get_object_or_404(ControleKM, id=controle_id)
@@ -2824,6 +2267,7 @@ def avancar_status_km(request, controle_id):
         
         DespesaDiversa.objects.filter(funcionario=km.funcionario, data__range=[ini, fim]).update(status=novo_status)
         ControleKM.objects.filter(funcionario=km.funcionario, data__range=[ini, fim]).update(status=novo_status)
+        agendar_semana(km.funcionario_id, ini)
         
         messages.success(request, msg_sucesso)
     else:
@@ -2856,6 +2300,7 @@ def rejeitar_km_gestor(request, controle_id):
             funcionario=km.funcionario, 
             data__range=[ini, fim]
         ).update(status=novo_status, nota_recusa=motivo)
+        agendar_semana(km.funcionario_id, ini)
         
         messages.warning(request, "Registro rejeitado. O técnico foi notificado.")
         
@@ -3052,41 +2497,15 @@ def is_periodo_travado(funcionario, data_ref):
     return bloq_km or bloq_desp
 def usuario_eh_gestao(user):
     """Verifica se o usuário está na equipe 'Gestão' ou 'Matriz' (Ignora acentos/case)."""
-    if not user.is_authenticated: return False
-    if user.is_superuser: return True
-    
-    try:
-        func = user.funcionario
-        # Lista de nomes aceitos (Adicione variações aqui)
-        nomes_permitidos = ['Gestão', 'Gestao', 'Matriz', 'Diretoria', 'Administrativo']
-        
-        # Verifica Equipe Principal
-        if func.equipe and func.equipe.nome in nomes_permitidos:
-            return True
-            
-        # Verifica Equipes Secundárias
-        if func.outras_equipes.filter(nome__in=nomes_permitidos).exists():
-            return True
-    except:
-        pass
-    return False
+    return papeis_do_usuario(user)['gestao']
 
 def usuario_eh_financeiro(user):
     """Verifica se o usuário está na equipe 'Financeiro'."""
-    if not user.is_authenticated: return False
-    if user.is_superuser: return True
-    
-    try:
-        func = user.funcionario
-        nomes_permitidos = ['Financeiro', 'Financeira', 'Finanças']
-        
-        if func.equipe and func.equipe.nome in nomes_permitidos:
-            return True
-        if func.outras_equipes.filter(nome__in=nomes_permitidos).exists():
-            return True
-    except:
-        pass
-    return False
+    return papeis_do_usuario(user)['financeiro']
+
+def usuario_tem_acesso_estoque(user):
+    """Equipe 'Estoque' (principal ou secundária), grupo 'Estoque' do admin ou superusuário."""
+    return papeis_do_usuario(user)['estoque']
 
 @login_required
 def resetar_status_bugados(request):
@@ -3095,8 +2514,12 @@ def resetar_status_bugados(request):
     # Reseta tudo que não for um status válido padrão
     status_validos = ['Pendente', 'Aprovado_Regional', 'Aprovado_Matriz', 'Aprovado_Financeiro', 'Pago', 'Rejeitado']
     
-    qtd = ControleKM.objects.exclude(status__in=status_validos).update(status='Pendente')
-    DespesaDiversa.objects.exclude(status__in=status_validos).update(status='Pendente')
+    kms = ControleKM.objects.exclude(status__in=status_validos)
+    despesas = DespesaDiversa.objects.exclude(status__in=status_validos)
+    semanas = list(kms.values_list('funcionario_id', 'data')) + list(despesas.values_list('funcionario_id', 'data'))
+    qtd = kms.update(status='Pendente')
+    despesas.update(status='Pendente')
+    agendar_recalculo(semanas)
     
     messages.success(request, f"{qtd} registros corrompidos foram resetados para Pendente.")
     return redirect('area_gestor')
@@ -3105,9 +2528,31 @@ def resetar_status_bugados(request):
 
 
 
-from collections import defaultdict
 from datetime import datetime
 
+# --- ESTILOS DO RELATÓRIO CUSTOMIZADO (registrados uma vez por arquivo) ---
+_CABECALHO_RELATORIO = dict(
+    font=Font(bold=True, color="FFFFFF"),
+    fill=PatternFill("solid", fgColor="4F81BD"),
+    alignment=Alignment(horizontal="center", vertical="center"),
+)
+ESTILOS_RELATORIO_CUSTOMIZADO = {
+    'rel_cabecalho': dict(_CABECALHO_RELATORIO, border=BORDA_FINA),
+    'rel_cabecalho_tabela': _CABECALHO_RELATORIO,
+    'rel_cabecalho_tipo': dict(_CABECALHO_RELATORIO, font=Font(bold=True, size=9, color="FFFFFF")),
+    'rel_periodo': dict(
+        font=Font(bold=True), fill=PatternFill("solid", fgColor="DCE6F1"),
+        alignment=Alignment(horizontal="center"), border=BORDA_FINA,
+    ),
+    'rel_texto': dict(border=BORDA_FINA),
+    'rel_texto_negrito': dict(border=BORDA_FINA, font=Font(bold=True)),
+    'rel_moeda': dict(border=BORDA_FINA, number_format=FORMATO_MOEDA),
+    'rel_moeda_negrito': dict(border=BORDA_FINA, number_format=FORMATO_MOEDA, font=Font(bold=True)),
+    'rel_titulo': dict(font=Font(bold=True, size=14)),
+    'rel_titulo_tabela': dict(font=Font(bold=True, size=12, color="4F81BD")),
+    'rel_titulo_resumo': dict(font=Font(bold=True, color="4F81BD")),
+}
+
 @login_required
 def gerar_relatorio_customizado(request):
     if request.method != 'POST':
@@ -3126,204 +2571,54 @@ def gerar_relatorio_customizado(request):
         messages.error(request, "Selecione ao menos uma equipe.")
         return redirect('area_gestor')
 
-    # 2. QUERIES
-    equipes = Equipe.objects.filter(id__in=equipes_ids)
-    funcionarios = Funcionario.objects.filter(Q(equipe__in=equipes) | Q(outras_equipes__in=equipes)).distinct()
-
-    kms = ControleKM.objects.filter(funcionario__in=funcionarios, data__range=[data_inicio, data_fim]).exclude(status='Rejeitado').select_related('funcionario', 'funcionario__equipe')
-    despesas = DespesaDiversa.objects.filter(funcionario__in=funcionarios, data__range=[data_inicio, data_fim]).exclude(status='Rejeitado').select_related('funcionario', 'funcionario__equipe')
-
-    # 3. ESTRUTURAS DE DADOS
-    
-    # Estrutura GLOBAL
-    global_data = defaultdict(lambda: {
-        'total_periodo': 0.0,
-        'mensal': defaultdict(float),
-        'semanal': defaultdict(float),
-        'diario': defaultdict(float)
-    })
-
-    # Estrutura DETALHADA POR FILIAL (Antiga Equipe)
-    team_data = defaultdict(lambda: defaultdict(lambda: {
-        'total_periodo': 0.0,
-        'tipos': defaultdict(float),
-        'mensal': defaultdict(lambda: defaultdict(float)),
-        'semanal': defaultdict(lambda: defaultdict(float)),
-        'diario': defaultdict(lambda: defaultdict(float))
-    }))
-
-    all_months = set()
-    all_weeks = set()
-    all_days = set()
-    all_types = set()
-
-    # --- FUNÇÃO DE LIMPEZA DO NOME (FILIAL) ---
-    def get_filial_name(func):
-        raw_name = "Indefinida"
-        if func.equipe and str(func.equipe.id) in equipes_ids: 
-            raw_name = func.equipe.nome
-        else:
-            for eq in func.outras_equipes.all():
-                if str(eq.id) in equipes_ids: 
-                    raw_name = eq.nome
-                    break
-        
-        # Remove "Campo " (com o espaço) e retorna
-        # Ex: "Campo CIAUSRE" -> "CIAUSRE"
-        return raw_name.replace("Campo ", "").replace("campo ", "")
-
-    # --- PROCESSA KMs ---
-    for k in kms:
-        func = k.funcionario
-        filial = get_filial_name(func) # Nome já limpo
-        nome = func.nome_completo
-        val = float(k.total_km) * (float(func.valor_km) if func.valor_km else 0.0)
-        
-        mes = k.data.strftime('%m/%Y')
-        sem = f"{k.data.isocalendar()[1]}/{k.data.year}"
-        dia = k.data.strftime('%d/%m/%Y')
-
-        # Popula GLOBAL
-        global_data[filial]['total_periodo'] += val
-        global_data[filial]['mensal'][mes] += val
-        global_data[filial]['semanal'][sem] += val
-        global_data[filial]['diario'][dia] += val
-
-        # Popula DETALHADO
-        ref = team_data[filial][nome]
-        ref['total_periodo'] += val
-        ref['tipos']['KM'] += val
-        ref['mensal'][mes]['KM'] += val
-        ref['semanal'][sem]['KM'] += val
-        ref['diario'][dia]['KM'] += val
-
-        all_months.add(mes)
-        all_weeks.add(sem)
-        all_days.add(dia)
-        all_types.add('KM')
-
-    # --- PROCESSA DESPESAS ---
-    for d in despesas:
-        func = d.funcionario
-        filial = get_filial_name(func) # Nome já limpo
-        nome = func.nome_completo
-        val = float(d.valor)
-        tipo = d.tipo 
-        
-        mes = d.data.strftime('%m/%Y')
-        sem = f"{d.data.isocalendar()[1]}/{d.data.year}"
-        dia = d.data.strftime('%d/%m/%Y')
-
-        # Popula GLOBAL
-        global_data[filial]['total_periodo'] += val
-        global_data[filial]['mensal'][mes] += val
-        global_data[filial]['semanal'][sem] += val
-        global_data[filial]['diario'][dia] += val
-
-        # Popula DETALHADO
-        ref = team_data[filial][nome]
-        ref['total_periodo'] += val
-        ref['tipos'][tipo] += val
-        ref['mensal'][mes][tipo] += val
-        ref['semanal'][sem][tipo] += val
-        ref['diario'][dia][tipo] += val
-
-        all_months.add(mes)
-        all_weeks.add(sem)
-        all_days.add(dia)
-        all_types.add(tipo)
-
-    # Ordenações
-    sorted_months = sorted(list(all_months), key=lambda x: datetime.strptime(x, '%m/%Y'))
-    sorted_days = sorted(list(all_days), key=lambda x: datetime.strptime(x, '%d/%m/%Y'))
-    sorted_weeks = sorted(list(all_weeks), key=lambda x: (int(x.split('/')[1]), int(x.split('/')[0])))
-    
-    # Ordena tipos garantindo KM primeiro
-    temp_types = list(all_types)
-    if 'KM' in temp_types:
-        temp_types.remove('KM')
-        sorted_types = ['KM'] + sorted(temp_types)
-    else:
-        sorted_types = sorted(temp_types)
-
-    # 4. EXCEL GENERATION
-    wb = Workbook()
-    
-    # Estilos
-    header_style = NamedStyle(name="header")
-    header_style.font = Font(bold=True, color="FFFFFF")
-    header_style.fill = PatternFill("solid", fgColor="4F81BD")
-    header_style.alignment = Alignment(horizontal="center", vertical="center")
-    
-    period_header_style = NamedStyle(name="period_header")
-    period_header_style.font = Font(bold=True)
-    period_header_style.fill = PatternFill("solid", fgColor="DCE6F1")
-    period_header_style.alignment = Alignment(horizontal="center")
-    
-    money_fmt = 'R$ #,##0.00'
-    border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-    # Função de ajuste de largura
-    def auto_adjust_width(ws):
-        for column in ws.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column)
-            for cell in column:
-                try:
-                    if cell.value:
-                        cell_len = len(str(cell.value))
-                        if cell.font and cell.font.bold: cell_len *= 1.2
-                        if cell_len > max_length: max_length = cell_len
-                except: pass
-            adjusted_width = (max_length + 2) * 1.1
-            if adjusted_width < 12: adjusted_width = 12
-            if adjusted_width > 60: adjusted_width = 60
-            ws.column_dimensions[column_letter].width = adjusted_width
-
-    def write_header(ws, row, cols, col_offset=1):
-        for i, c in enumerate(cols):
-            cell = ws.cell(row=row, column=i+col_offset, value=c)
-            cell.style = header_style
-            cell.border = border
-
-    def write_row(ws, row, cols, bold_last=False):
-        for i, val in enumerate(cols, 1):
-            cell = ws.cell(row=row, column=i, value=val)
-            cell.border = border
+    # 2. TOTAIS (consultas agrupadas por funcionário, tipo e período; ver relatorio_filiais.py)
+    totais = totais_relatorio_filiais(equipes_ids, data_inicio, data_fim)
+    global_data = totais['global']
+    team_data = totais['filiais']
+    sorted_months = totais['meses']
+    sorted_weeks = totais['semanas']
+    sorted_days = totais['dias']
+    sorted_types = totais['tipos']
+
+    # 4. EXCEL GENERATION (write-only: linhas direto para o arquivo, estilos nomeados)
+    planilha = Planilha(ESTILOS_RELATORIO_CUSTOMIZADO)
+
+    def valores(vals, bold_last=False):
+        celulas = []
+        for i, val in enumerate(vals, 1):
+            negrito = bold_last and i == len(vals)
             if isinstance(val, (int, float)):
-                cell.number_format = money_fmt
-            if bold_last and i == len(cols):
-                cell.font = Font(bold=True)
+                celulas.append(Celula(val, 'rel_moeda_negrito' if negrito else 'rel_moeda'))
+            else:
+                celulas.append(Celula(val, 'rel_texto_negrito' if negrito else 'rel_texto'))
+        return celulas
+
+    def cabecalho(cols):
+        return [Celula(c, 'rel_cabecalho') for c in cols]
 
     # === 1. ABAS GLOBAIS (AGRUPADO POR FILIAL) ===
 
     def create_global_sheet(title, time_cols, data_key):
-        if title == "Resumo Geral": ws = wb.active; ws.title = title
-        else: ws = wb.create_sheet(title)
-        
         # MUDANÇA AQUI: "Equipe" vira "Filial"
         headers = ["Filial"] + (time_cols if time_cols else ["TOTAL (R$)"]) 
         if time_cols: headers.append("TOTAL")
-        
-        write_header(ws, 1, headers)
-        
-        row = 2
-        for filial in sorted(global_data.keys()):
-            vals = [filial]
-            if not time_cols:
-                vals.append(global_data[filial]['total_periodo'])
-            else:
-                row_total = 0
-                for t in time_cols:
-                    v = global_data[filial][data_key].get(t, 0.0)
-                    vals.append(v)
-                    row_total += v
-                vals.append(row_total)
-            
-            write_row(ws, row, vals, bold_last=True)
-            row += 1
-        
-        auto_adjust_width(ws)
+
+        def preencher(ws):
+            ws.linha(*cabecalho(headers))
+            for filial in sorted(global_data.keys()):
+                vals = [filial]
+                if not time_cols:
+                    vals.append(global_data[filial]['total_periodo'])
+                else:
+                    row_total = 0
+                    for t in time_cols:
+                        v = global_data[filial][data_key].get(t, 0.0)
+                        vals.append(v)
+                        row_total += v
+                    vals.append(row_total)
+                ws.linha(*valores(vals, bold_last=True))
+
+        planilha.aba_ajustada(title, preencher)
 
     # Gera as 4 abas globais
     create_global_sheet("Resumo Geral", [], None)
@@ -3332,106 +2627,76 @@ def gerar_relatorio_customizado(request):
     create_global_sheet("Visão Diária (Global)", sorted_days, 'diario')
 
     # === 2. ABAS POR FILIAL (DETALHADO POR FUNCIONÁRIO E TIPO) ===
-    
-    for filial in sorted(team_data.keys()):
-        # Nome da aba seguro
-        safe_name = filial[:30].replace('/', '-')
-        ws = wb.create_sheet(safe_name)
-        
-        current_row = 1
-        # Título interno
-        ws.cell(row=current_row, column=1, value=f"RELATÓRIO: {filial.upper()}").font = Font(bold=True, size=14)
-        current_row += 2
-
-        def add_complex_table(title, time_periods, data_key):
-            nonlocal current_row
-            ws.cell(row=current_row, column=1, value=title.upper()).font = Font(bold=True, size=12, color="4F81BD")
-            current_row += 1
-            col_idx = 2
-            ws.cell(row=current_row, column=1, value="Colaborador").style = header_style
-            ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row+1, end_column=1)
-            
-            # Linha 1: Períodos
-            for period in time_periods:
-                start_col = col_idx
-                end_col = col_idx + len(sorted_types) - 1 
-                if start_col < end_col:
-                    ws.merge_cells(start_row=current_row, start_column=start_col, end_row=current_row, end_column=end_col)
-                cell = ws.cell(row=current_row, column=start_col, value=period)
-                cell.style = period_header_style
-                cell.border = border
-                col_idx = end_col + 1
-            
-            # Total Geral
-            ws.merge_cells(start_row=current_row, start_column=col_idx, end_row=current_row+1, end_column=col_idx)
-            cell = ws.cell(row=current_row, column=col_idx, value="TOTAL GERAL")
-            cell.style = header_style
-            total_geral_col_idx = col_idx
-            current_row += 1
-            
-            # Linha 2: Tipos
-            col_idx = 2
+
+    def add_complex_table(ws, filial, title, time_periods, data_key):
+        ws.linha(Celula(title.upper(), 'rel_titulo_tabela'))
+
+        # Linha 1: Períodos (cada um mesclado sobre os tipos) e Total Geral
+        r = ws.linha_atual
+        linha_periodos = [Celula("Colaborador", 'rel_cabecalho_tabela')]
+        ws.mesclar(r, 1, r + 1, 1)
+        col_idx = 2
+        for period in time_periods:
+            end_col = col_idx + len(sorted_types) - 1
+            if col_idx < end_col:
+                ws.mesclar(r, col_idx, r, end_col)
+            linha_periodos.append(Celula(period, 'rel_periodo'))
+            linha_periodos.extend([None] * (len(sorted_types) - 1))
+            col_idx = end_col + 1
+        ws.mesclar(r, col_idx, r + 1, col_idx)
+        linha_periodos.append(Celula("TOTAL GERAL", 'rel_cabecalho_tabela'))
+        ws.linha(*linha_periodos)
+
+        # Linha 2: Tipos
+        ws.linha(None, *[Celula(tipo, 'rel_cabecalho_tipo') for period in time_periods for tipo in sorted_types])
+
+        # Dados
+        for func in sorted(team_data[filial].keys()):
+            dados_func = team_data[filial][func]
+            celulas = [Celula(func, 'rel_texto')]
+            func_grand_total = 0
             for period in time_periods:
+                period_values = dados_func[data_key].get(period, {})
                 for tipo in sorted_types:
-                    cell = ws.cell(row=current_row, column=col_idx, value=tipo)
-                    cell.style = header_style
-                    cell.font = Font(bold=True, size=9, color="FFFFFF")
-                    col_idx += 1
-            current_row += 1
-            
-            # Dados
+                    val = period_values.get(tipo, 0.0)
+                    celulas.append(Celula(val, 'rel_moeda'))
+                    func_grand_total += val
+            celulas.append(Celula(func_grand_total, 'rel_moeda_negrito'))
+            ws.linha(*celulas)
+        ws.pular(2)
+
+    def preencher_filial(filial):
+        def preencher(ws):
+            # Título interno
+            ws.linha(Celula(f"RELATÓRIO: {filial.upper()}", 'rel_titulo'))
+            ws.pular()
+
+            # 1. Resumo Simples por Tipo
+            ws.linha(Celula("RESUMO POR TIPO", 'rel_titulo_resumo'))
+            ws.linha(*cabecalho(["Colaborador"] + sorted_types + ["TOTAL"]))
             for func in sorted(team_data[filial].keys()):
-                dados_func = team_data[filial][func]
-                ws.cell(row=current_row, column=1, value=func).border = border
-                col_idx = 2
-                func_grand_total = 0
-                for period in time_periods:
-                    period_values = dados_func[data_key].get(period, {})
-                    for tipo in sorted_types:
-                        val = period_values.get(tipo, 0.0)
-                        cell = ws.cell(row=current_row, column=col_idx, value=val)
-                        cell.number_format = money_fmt
-                        cell.border = border
-                        func_grand_total += val
-                        col_idx += 1
-                cell = ws.cell(row=current_row, column=total_geral_col_idx, value=func_grand_total)
-                cell.number_format = money_fmt
-                cell.font = Font(bold=True)
-                cell.border = border
-                current_row += 1
-            current_row += 2
-
-        # 1. Resumo Simples por Tipo
-        ws.cell(row=current_row, column=1, value="RESUMO POR TIPO").font = Font(bold=True, color="4F81BD")
-        current_row += 1
-        headers_tipo = ["Colaborador"] + sorted_types + ["TOTAL"]
-        write_header(ws, current_row, headers_tipo, col_offset=1)
-        current_row += 1
-        for func in sorted(team_data[filial].keys()):
-            vals = [func]
-            tot = 0
-            for t in sorted_types:
-                v = team_data[filial][func]['tipos'].get(t, 0.0)
-                vals.append(v); tot += v
-            vals.append(tot)
-            write_row(ws, current_row, vals, bold_last=True)
-            current_row += 1
-        current_row += 2
-
-        # 2. Tabelas Complexas
-        add_complex_table("Detalhamento Mensal", sorted_months, 'mensal')
-        add_complex_table("Detalhamento Semanal", sorted_weeks, 'semanal')
-        add_complex_table("Detalhamento Diário", sorted_days, 'diario')
-
-        auto_adjust_width(ws)
+                vals = [func]
+                tot = 0
+                for t in sorted_types:
+                    v = team_data[filial][func]['tipos'].get(t, 0.0)
+                    vals.append(v); tot += v
+                vals.append(tot)
+                ws.linha(*valores(vals, bold_last=True))
+            ws.pular(2)
+
+            # 2. Tabelas Complexas
+            add_complex_table(ws, filial, "Detalhamento Mensal", sorted_months, 'mensal')
+            add_complex_table(ws, filial, "Detalhamento Semanal", sorted_weeks, 'semanal')
+            add_complex_table(ws, filial, "Detalhamento Diário", sorted_days, 'diario')
+        return preencher
+
+    for filial in sorted(team_data.keys()):
+        # Nome da aba seguro
+        planilha.aba_ajustada(filial[:30].replace('/', '-'), preencher_filial(filial))
 
     # Finaliza
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     nome_arq = f"Relatorio_Filiais_{data_inicio.strftime('%d%m')}_{data_fim.strftime('%d%m')}.xlsx"
-    response['Content-Disposition'] = f'attachment; filename="{nome_arq}"'
-    wb.save(response)
-    
-    return response
+    return planilha.resposta(nome_arq)
 
 
 class CustomPasswordResetView(PasswordResetView):
@@ -3520,7 +2785,8 @@ def gerar_pdf_pagamento_equipe(request, equipe_id, ano, mes, semana):
         return redirect('area_gestor')
 
     equipe = get_object_or_404(Equipe, id=equipe_id)
-    funcionarios = Funcionario.objects.filter(Q(equipe=equipe)|Q(outras_equipes=equipe)).distinct()
+    # Totais da semana já consolidados por técnico (ver semana_km)
+    lancamentos = lancamentos_da_equipe(equipe, dt_inicio)
 
     # 2. Configurar PDF
     response = HttpResponse(content_type='application/pdf')
@@ -3543,16 +2809,10 @@ def gerar_pdf_pagamento_equipe(request, equipe_id, ano, mes, semana):
     
     total_geral = 0.0
 
-    for func in funcionarios:
-        kms = ControleKM.objects.filter(funcionario=func, data__range=[dt_inicio, dt_fim]).exclude(status='Rejeitado')
-        despesas = DespesaDiversa.objects.filter(funcionario=func, data__range=[dt_inicio, dt_fim]).exclude(status='Rejeitado')
-        
-        total_km = sum([k.total_km for k in kms])
-        total_despesas = sum([d.valor for d in despesas])
-
-        # LÓGICA DE CÁLCULO CORRIGIDA (Padrão 1.20 se não tiver valor cadastrado)
-        fator = float(func.valor_km) if func.valor_km and func.valor_km > 0 else 1.20
-        valor_final = (float(total_km) * fator) + float(total_despesas)
+    for lancamento in lancamentos:
+        func = lancamento.funcionario
+        # KM x valor do KM (padrão 1.20) + despesas, sem os rejeitados
+        valor_final = float(lancamento.valor_a_pagar)
 
         if valor_final > 0:
             dados_bancarios = f"{func.banco or '-'}"
@@ -3611,6 +2871,7 @@ def atualizar_valor_km_equipe(request, equipe_id):
             # Atualiza TODOS os funcionários desta equipe (Principal e Secundária)
             funcs = Funcionario.objects.filter(Q(equipe=equipe)|Q(outras_equipes=equipe)).distinct()
             updated = funcs.update(valor_km=val)
+            aplicar_valor_km(funcs.values('id'), val)
             
             messages.success(request, f"Valor do KM atualizado para R$ {val:.2f} em {updated} colaboradores da filial.")
         except ValueError:
@@ -0,0 +1,83 @@
+import io
+import zipfile
+
+# Tamanho dos blocos lidos do storage e enviados ao cliente
+TAMANHO_BLOCO_ZIP = 64 * 1024
+
+
+class _SaidaZip(io.RawIOBase):
+    """
+    Destino "não pesquisável" para o ZipFile: acumula só o que foi escrito
+    desde o último esvaziar(), então a memória fica limitada a um bloco.
+    """
+    def __init__(self):
+        super().__init__()
+        self._partes = []
+        self._posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def esvaziar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+
+def nome_sem_repetir(nome, usados, sufixo):
+    """
+    `nome` ou, se já estiver no ZIP, com `_sufixo` antes da extensão (ex: id do
+    funcionário, para homônimos). Registra o nome escolhido em `usados`.
+    """
+    if nome in usados:
+        base, ponto, extensao = nome.rpartition('.')
+        nome = f"{base}_{sufixo}.{extensao}" if ponto else f"{nome}_{sufixo}"
+    usados.add(nome)
+    return nome
+
+
+def gerar_zip_streaming(entradas, tamanho_bloco=TAMANHO_BLOCO_ZIP):
+    """
+    Gera os bytes de um ZIP à medida que os arquivos são lidos.
+
+    `entradas` é um iterável de (nome_no_zip, abrir), onde abrir() devolve um
+    arquivo binário aberto. Arquivos que não abrem são ignorados; nomes
+    repetidos no ZIP entram uma única vez. Uso típico:
+    StreamingHttpResponse(gerar_zip_streaming(...), content_type='application/zip').
+    """
+    saida = _SaidaZip()
+    nomes_adicionados = set()
+
+    # PDFs já são comprimidos: ZIP_STORED evita gastar CPU à toa (mesmo padrão de antes)
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_STORED) as zip_file:
+        for nome, abrir in entradas:
+            if nome in nomes_adicionados:
+                continue
+            try:
+                arquivo = abrir()
+            except Exception as e:
+                print(f"Erro ao abrir arquivo {nome} para o ZIP: {e}")
+                continue
+
+            with arquivo, zip_file.open(nome, 'w', force_zip64=True) as destino:
+                for bloco in iter(lambda: arquivo.read(tamanho_bloco), b''):
+                    destino.write(bloco)
+                    dados = saida.esvaziar()
+                    if dados:
+                        yield dados
+            nomes_adicionados.add(nome)
+
+            dados = saida.esvaziar()
+            if dados:
+                yield dados
+
+    # Diretório central do ZIP
+    yield saida.esvaziar()